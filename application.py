@@ -11,37 +11,80 @@ from base64 import b64decode
 
 def main():
     logger = jlib.Logger()
+    # Warm Lambda invocations reuse the process, so clients and their caches from the last run are dropped
+    # before the schedulers they go through are configured again.
+    jlib.ClientRegistry.clear()
     # Get config
     config = jlib.ConfigHelper()
     if not config.validate_config():
         sys.exit(1)
 
     # Create objects we'll interact with later
-    halo = jlib.Halo(config.halo_api_key, config.halo_api_secret_key, config.halo_api_hostname)
+    halo = jlib.ClientRegistry.get_halo(config)
+    state_store = jlib.StateStore(config.state_db_path) if config.state_db_path else None
     # Get issues created, changed, deleted since starting timestamp
     logger.info(f"Getting all Halo issues")
 
     issues_count = 0
 
+    started_at = datetime.datetime.now(datetime.timezone.utc)
+    reconcilers = {rule["name"]: jlib.Reconciler(config, rule, state_store) for rule in config.rules}
+    since_by_rule = {name: reconciler.get_incremental_since() for name, reconciler in reconcilers.items()}
+    engine = jlib.AsyncEngine(config, halo) if config.sync_engine == "async" else None
+    shared_issues = {}
+    # Streaming lists issues page by page for each rule, so they are never shared.
+    if config.fetch_mode == "shared" and config.sync_engine != "streaming":
+        shared_issues = halo.get_issues_for_rules([rule for rule in config.rules if not since_by_rule[rule["name"]]])
+
     for rule in config.rules:
-        halo_issues = halo.get_issues(rule.get("filters", {}))
+        reconciler = reconcilers[rule["name"]]
+        since = since_by_rule[rule["name"]]
+        if engine:
+            engine.sync_rule(reconciler, shared_issues.pop(rule["name"], None), since, reconciler.since_filter)
+        elif config.sync_engine == "streaming":
+            issues_count += jlib.StreamingPipeline(halo, reconciler, config.pipeline_queue_size).run(
+                since, reconciler.since_filter
+            )
+        elif config.spill_dir and rule["name"] not in shared_issues:
+            issue_store = jlib.IssueStore(config.spill_dir)
+            try:
+                halo.get_issues(rule.get("filters", {}), since, reconciler.since_filter, issue_store,
+                                config.spill_batch_size, reconciler.enrich)
+                logger.info(f"Reconciling {len(issue_store)} Halo issues")
+                caches = {}
+                for halo_issues in issue_store.iter_batches(config.spill_batch_size):
+                    reconciler.reconcile_batch(halo_issues, caches)
+            finally:
+                issue_store.close()
+        else:
+            if rule["name"] in shared_issues:
+                halo_issues = reconciler.enrich(shared_issues.pop(rule["name"]))
+            else:
+                halo_issues = halo.get_issues(rule.get("filters", {}), since, reconciler.since_filter,
+                                              enrich=reconciler.enrich)
 
-        # Print initial stats
-        logger.info(f"Reconciling {len(halo_issues)} Halo issues")
-        reconciler = jlib.Reconciler(config, rule)
+            # Print initial stats
+            logger.info(f"Reconciling {len(halo_issues)} Halo issues")
 
-        if halo_issues:
-            for project_key in rule["jira_config"]["project_keys"]:
-                reconciler.reconcile_issues(halo_issues, project_key)
+            if halo_issues:
+                reconciler.reconcile_batch(halo_issues, {})
 
-        reconciler.update_all_jira_issues()
+        reconciler.update_all_jira_issues(since)
         reconciler.cleanup(rule["jira_config"]["project_keys"])
+        reconciler.commit_watermark(started_at, since)
 
+    if state_store:
+        state_store.close()
+    concurrency_stats = jlib.Scheduler.get_stats()
+    for service, stats in concurrency_stats.items():
+        logger.info(f"{service} concurrency limit: {stats['limit']} ({stats['min']}-{stats['max']}), "
+                    f"{len(stats['history']) - 1} changes, average latency {stats['latency']}s")
     logger.info("Done!")
 
     return {"result": json.dumps(
                 {"message": "Halo/Jira issue sync complete",
-                 "total_issues": issues_count})}
+                 "total_issues": issues_count,
+                 "concurrency": concurrency_stats})}
 
 
 def lambda_handler(event, context):
@@ -1,9 +1,15 @@
+from jlib.clients import ClientRegistry  # NOQA
+from jlib.async_engine import AsyncEngine  # NOQA
 from jlib.config_helper import ConfigHelper  # NOQA
 from jlib.halo import Halo  # NOQA
 from jlib.formatter import Formatter  # NOQA
-from jlib.jira_local import JiraLocal  # NOQA
+from jlib.issue_store import IssueStore  # NOQA
+from jlib.jira_local import JiraLocal, PreparedIssue  # NOQA
 from jlib.logger import Logger  # NOQA
+from jlib.pipeline import StreamingPipeline  # NOQA
 from jlib.reconciler import Reconciler  # NOQA
+from jlib.scheduler import Scheduler, ServiceScheduler  # NOQA
+from jlib.state_store import StateStore  # NOQA
 
 
 __version__ = "2.0.1"
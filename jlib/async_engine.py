@@ -0,0 +1,594 @@
+"""Asyncio alternative to the threaded sync of Halo issues to Jira."""
+import asyncio
+import json
+import time
+from collections import defaultdict
+import aiohttp
+import cloudpassage
+from cloudpassage.utility import Utility
+from jira.exceptions import JIRAError
+from jlib.halo import Halo
+from jlib.jira_local import JiraLocal
+from jlib.logger import Logger
+from jlib.scheduler import Scheduler
+
+
+class AsyncJiraIssue(object):
+    """Stand-in for jira.Issue, built from an issue returned by the Jira REST API."""
+
+    def __init__(self, raw):
+        self.raw = raw
+        self.key = raw["key"]
+
+
+class AsyncEngine(object):
+    """Sync Halo issues to Jira from one event loop instead of thread pools.
+
+    Halo listing and enrichment, Jira lookups, epic creation and issue pushes
+    run as coroutines over one aiohttp session. Requests go through the same
+    jlib.Scheduler() caps, rate limits and retries as the threaded engine's,
+    in flight as coroutines rather than threads. Field mapping, hashing and state store
+    bookkeeping are shared with jlib.JiraLocal(), so both engines produce the
+    same Jira issues.
+
+    Args:
+        config (obj): Instance of jlib.ConfigHelper().
+        halo (obj): Instance of jlib.Halo(), for its session and caches.
+    """
+
+    max_pages = 20
+    slot_poll_interval = 0.1
+
+    def __init__(self, config, halo):
+        self.logger = Logger()
+        self.config = config
+        self.halo = halo
+        self.halo_scheduler = Scheduler.get("halo")
+        self.jira_scheduler = Scheduler.get("jira")
+        self.jira_auth = aiohttp.BasicAuth(config.jira_api_user, config.jira_api_token)
+        self.described = {}
+
+    def sync_rule(self, reconciler, halo_issues=None, since=None, since_filter="last_seen_at_gte"):
+        """Reconcile a rule's Halo issues with Jira, in every project of the rule.
+
+        Args:
+            reconciler (obj): Instance of jlib.Reconciler() for the rule,
+                which renders the issues once for all projects.
+            halo_issues (list): Listed Halo issues, listed here if None.
+                Those whose content may have changed are enriched here.
+            since (str): ISO8601-formatted timestamp. If set, only issues
+                changed since then are listed.
+            since_filter (str): Halo issue filter used to apply `since`.
+
+        Returns:
+            list: List of dictionary objects describing the Halo issues.
+        """
+        return asyncio.run(self.run_rule(reconciler, halo_issues, since, since_filter))
+
+    async def run_rule(self, reconciler, halo_issues, since, since_filter):
+        try:
+            return await self.reconcile_rule(reconciler, halo_issues, since, since_filter)
+        finally:
+            # Described objects are only kept for the rule, so they don't pile up over the run.
+            self.described.clear()
+
+    async def reconcile_rule(self, reconciler, halo_issues, since, since_filter):
+        rule = reconciler.rule
+        self.slot_freed = {self.halo_scheduler.name: asyncio.Condition(), self.jira_scheduler.name: asyncio.Condition()}
+        self.auth_lock = asyncio.Lock()
+        connector = aiohttp.TCPConnector(
+            limit=self.halo_scheduler.max_concurrency + self.jira_scheduler.max_concurrency
+        )
+        async with aiohttp.ClientSession(connector=connector) as self.client:
+            if halo_issues is None:
+                filters = rule.get("filters") or {}
+                issue_filters = dict(filters.get("issue") or {})
+                if since:
+                    issue_filters[since_filter] = since
+                halo_issues = await self.list_issues(issue_filters, filters.get("partitions"))
+                self.logger.info(f"Issues to process: {len(halo_issues)}")
+            changed_issues = reconciler.get_changed_issues(halo_issues)
+            if changed_issues:
+                await self.enrich(changed_issues)
+            self.logger.info(f"Reconciling {len(halo_issues)} Halo issues")
+            if halo_issues:
+                project_keys = rule["jira_config"]["project_keys"]
+                jira_issues_dicts = await asyncio.gather(*[
+                    self.get_jira_issues(reconciler.jira, project_key, halo_issues) for project_key in project_keys
+                ])
+                prepared_issues, groups = reconciler.prepare_issues(halo_issues, jira_issues_dicts)
+                await asyncio.gather(*[
+                    self.reconcile_issues(reconciler.jira, prepared_issues, groups, project_key, jira_issues_dict)
+                    for project_key, jira_issues_dict in zip(project_keys, jira_issues_dicts)
+                ])
+        return halo_issues
+
+    async def list_issues(self, issue_filters, partitions=None):
+        """Return list of issues matching filters, paging partitions concurrently."""
+        if not partitions:
+            return await self.list_partition(issue_filters)
+        issues = {}
+        results = await asyncio.gather(*[
+            self.list_partition(Halo.merge_partition(issue_filters, partition)) for partition in partitions
+        ])
+        for partition_issues in results:
+            for issue in partition_issues:
+                issues[issue["id"]] = issue
+        self.logger.info(f"Listed {len(issues)} issues from {len(partitions)} partitions")
+        return list(issues.values())
+
+    async def list_partition(self, issue_filters):
+        params = Utility.sanitize_url_params(Halo.format_issue_filters(issue_filters))
+        page = await self.halo_get(
+            self.halo.issue.endpoint(), {k: str(v) for k, v in params.items() if v is not None}
+        )
+        issues, next_page = cloudpassage.HttpHelper.process_page(page, self.halo.issue.objects_name)
+        pages_parsed = 1
+        while next_page and pages_parsed < self.max_pages:
+            page = await self.halo_get(next_page)
+            page_issues, next_page = cloudpassage.HttpHelper.process_page(page, self.halo.issue.objects_name)
+            issues.extend(page_issues)
+            pages_parsed += 1
+        return issues
+
+    async def enrich(self, issues):
+        """Enrich issues with their asset, last finding and CVE details, through the run's memo."""
+        missed_issues = self.halo.recall_enrichment(issues)
+        if missed_issues:
+            await self.enrich_missed(missed_issues)
+            self.halo.remember_enrichment(missed_issues)
+        return issues
+
+    async def enrich_missed(self, issues):
+        asset_url_to_issues, finding_url_to_issues = Halo.group_issues_by_url(issues)
+        await asyncio.gather(
+            *[self.enrich_issues(url, url_issues, "asset", self.halo.asset_cache)
+              for url, url_issues in asset_url_to_issues.items()],
+            *[self.enrich_issues(url, url_issues, "findings")
+              for url, url_issues in finding_url_to_issues.items()]
+        )
+        self.halo.evict_describe_caches()
+
+        cve_ids = set(cve for issue in issues for cve in issue.get("cve_ids", []))
+        cve_dict = self.halo.get_cached_cve_dict(cve_ids)
+        missing_cve_ids = sorted(cve_ids - set(cve_dict))
+        results = await asyncio.gather(*[
+            self.halo_get(f"{self.halo.cve_detail.endpoint()}/{cve_id}") for cve_id in missing_cve_ids
+        ], return_exceptions=True)
+        fetched_cve_dict = {}
+        for cve_id, result in zip(missing_cve_ids, results):
+            if isinstance(result, Exception):
+                self.logger.error(f"{cve_id} generated an exception: {result}")
+            else:
+                fetched_cve_dict[cve_id] = result
+        self.halo.cache_cve_dict(fetched_cve_dict)
+        cve_dict.update(fetched_cve_dict)
+        return Halo.attach_cve_details(issues, cve_dict)
+
+    async def enrich_issues(self, url, issues, type, disk_cache=None):
+        data = None
+        try:
+            data = await self.describe_cached(url, disk_cache)
+        except Exception as e:
+            self.logger.error(f"{issues[0]['asset_url']} generated an exception: {e}")
+        for issue in issues:
+            issue[type] = data
+
+    async def describe_cached(self, url, disk_cache=None):
+        """Describe url once per run; a disk cache is consulted before Halo and filled after."""
+        if url in self.described:
+            return self.described[url]
+        described = disk_cache.get(url) if disk_cache else None
+        if described is None:
+            described = await self.describe(url)
+            if disk_cache and described is not None:
+                disk_cache.set(url, described)
+        self.described[url] = described
+        return described
+
+    async def describe(self, url):
+        """Get full json description of asset or finding."""
+        short_url, object_type = Halo.parse_object_url(url)
+        if not short_url:
+            self.logger.error("Invalid URL:" + url)
+            return None
+        try:
+            response = await self.get_conditional(short_url)
+        except cloudpassage.exceptions.CloudPassageBaseException:
+            self.logger.error("Invalid URL: " + url)
+            return None
+        if object_type in response:
+            return response[object_type]
+        return response
+
+    async def get_conditional(self, endpoint):
+        """GET endpoint, revalidating a cached body as jlib.Halo().get_conditional() does."""
+        body_cache = self.halo.describe_body_cache
+        if not body_cache:
+            return await self.halo_get(endpoint)
+        cached = body_cache.get(endpoint)
+        headers = {}
+        if cached and cached.get("etag"):
+            headers["If-None-Match"] = cached["etag"]
+        if cached and cached.get("last_modified"):
+            headers["If-Modified-Since"] = cached["last_modified"]
+        status, text, response_headers = await self.halo_request(endpoint, headers=headers)
+        if status == 304 and cached:
+            return cached["body"]
+        body = self.parse_halo_response(endpoint, status, text)
+        etag = response_headers.get("ETag")
+        last_modified = response_headers.get("Last-Modified")
+        if etag or last_modified:
+            body_cache.set(endpoint, {"etag": etag, "last_modified": last_modified, "body": body})
+        return body
+
+    async def halo_get(self, endpoint, params=None):
+        status, text, _ = await self.halo_request(endpoint, params)
+        return self.parse_halo_response(endpoint, status, text)
+
+    def parse_halo_response(self, endpoint, status, text):
+        success, exception = Utility.parse_status(endpoint, status, text)
+        if not success:
+            raise exception
+        return json.loads(text)
+
+    async def halo_request(self, endpoint, params=None, headers=None):
+        """GET a Halo endpoint, authenticating first and again on a 401, like cloudpassage does."""
+        session = self.halo.session
+        url = session.build_endpoint_prefix() + endpoint
+        for attempt in range(2):
+            token = session.auth_token
+            if token is None or attempt:
+                await self.authenticate(token)
+            request_headers = dict(session.build_header(), **(headers or {}))
+            status, text, response_headers = await self.send(
+                self.halo_scheduler, "GET", url, params=params, headers=request_headers
+            )
+            if status != 401:
+                break
+        return status, text, response_headers
+
+    async def authenticate(self, stale_token):
+        """Get a new Halo token, unless another coroutine already replaced the stale one."""
+        async with self.auth_lock:
+            if self.halo.session.auth_token == stale_token:
+                await asyncio.get_running_loop().run_in_executor(None, self.halo.session.authenticate_client)
+
+    async def jira_request(self, method, path, **kwargs):
+        url = f"{self.config.jira_api_url.rstrip('/')}/rest/api/2/{path}"
+        status, text, _ = await self.send(
+            self.jira_scheduler, method, url, auth=self.jira_auth, **kwargs
+        )
+        if status >= 400:
+            raise JIRAError(text=text, status_code=status, url=url)
+        return json.loads(text) if text else None
+
+    async def send(self, scheduler, method, url, **kwargs):
+        """Send a request through a service's scheduler, retrying as jlib.ScheduledHTTPAdapter() does."""
+        attempt = 0
+        slot_freed = self.slot_freed[scheduler.name]
+        while True:
+            await self.acquire(scheduler, slot_freed)
+            try:
+                await asyncio.sleep(scheduler.get_wait())
+                started_at = time.monotonic()
+                try:
+                    async with self.client.request(method, url, **kwargs) as response:
+                        text = await response.text()
+                        status, headers = response.status, response.headers
+                except Exception:
+                    scheduler.record(None, time.monotonic() - started_at)
+                    raise
+                scheduler.record(status, time.monotonic() - started_at)
+            finally:
+                scheduler.release()
+                async with slot_freed:
+                    slot_freed.notify_all()
+            if not scheduler.should_retry(method, status, attempt):
+                return status, text, headers
+            delay = scheduler.back_off(attempt, headers)
+            scheduler.logger.warn(f"{scheduler.name} returned {status} for {method} {url}, retrying in {delay:.1f}s")
+            attempt += 1
+
+    async def acquire(self, scheduler, slot_freed):
+        """Take a request slot of the scheduler, waiting for coroutines or threads to free one.
+
+        Threads sharing the scheduler, like Halo authentication, free slots
+        and raise limits without notifying the event loop, so the scheduler
+        is polled again every `slot_poll_interval` seconds as well.
+        """
+        async with slot_freed:
+            while not scheduler.try_acquire():
+                try:
+                    await asyncio.wait_for(slot_freed.wait(), self.slot_poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def search(self, jql, start_at=0, max_results=50, fields=None):
+        # Like validate_query=False in jira: keys of deleted issues are dropped rather than failing the search.
+        result = await self.jira_request("POST", "search", json={
+            "jql": jql, "startAt": start_at, "maxResults": max_results, "fields": fields or ["*all"],
+            "validateQuery": "warn"
+        })
+        return [AsyncJiraIssue(issue) for issue in result["issues"]], result["total"]
+
+    async def search_all(self, jql, page_size, fields=None):
+        """Return every issue matching jql, fetching pages after the first concurrently."""
+        jira_issues, total = await self.search(jql, 0, page_size, fields)
+        # Jira may cap maxResults, so later pages are sized like the first.
+        page_size = len(jira_issues)
+        if not page_size:
+            return jira_issues
+        pages = await asyncio.gather(*[
+            self.search(jql, start_at, page_size, fields) for start_at in range(page_size, total, page_size)
+        ])
+        for page_issues, _ in pages:
+            jira_issues.extend(page_issues)
+        return jira_issues
+
+    async def reconcile_issues(self, jira_local, prepared_issues, groups, project_key, jira_issues_dict):
+        jira_epics_dict = await self.get_jira_epic_keys(jira_local, project_key)
+        new_groups = [(group_key_hash, group_key_str) for group_key_hash, group_key_str in groups.items()
+                      if group_key_hash not in jira_epics_dict]
+        if new_groups:
+            jira_epics_dict.update(await self.create_jira_epics(jira_local, new_groups, project_key))
+
+        pushes = []
+        to_create = []
+        for prepared in prepared_issues:
+            jira_issues = jira_issues_dict.get(prepared.issue["id"])
+            if jira_issues:
+                pushes.append(self.update_jira_issue(jira_local, prepared, jira_issues))
+            else:
+                epic_link = jira_epics_dict.get(prepared.groupby_key)
+                to_create.append((prepared, epic_link, jira_local.get_create_fields(prepared, epic_link, project_key)))
+        for i in range(0, len(to_create), jira_local.bulk_create_size):
+            pushes.append(self.create_jira_issue_chunk(
+                jira_local, to_create[i:i + jira_local.bulk_create_size], project_key
+            ))
+        for result in await asyncio.gather(*pushes, return_exceptions=True):
+            if isinstance(result, JIRAError):
+                jira_local.log.error(f"Could not push issue to {project_key}: {result.text}")
+            elif isinstance(result, Exception):
+                jira_local.log.error(f"Could not push issue to {project_key}: {result}")
+
+    async def get_jira_issues(self, jira_local, project_key, halo_issues):
+        """Return dict of Halo issue ID to matching Jira issues, as jlib.JiraLocal().get_jira_issues()."""
+        jira_issues_dict = {}
+        if jira_local.state_store:
+            issue_states = jira_local.state_store.get_issue_states(
+                project_key, [issue["id"] for issue in halo_issues])
+            known_keys = {
+                issue["id"]: [state["jira_key"] for state in issue_states[issue["id"]]]
+                for issue in halo_issues if issue["id"] in issue_states
+            }
+            jira_issues_dict = await self.get_jira_issues_by_key(jira_local, project_key, known_keys)
+            halo_issues = [issue for issue in halo_issues if not jira_issues_dict.get(issue["id"])]
+            if not halo_issues:
+                return jira_issues_dict
+        if jira_local.lookup_mode == "bulk":
+            jira_issue_index = await self.get_jira_issue_index(jira_local, project_key)
+            jira_issues_dict.update({issue["id"]: jira_issue_index.get(issue["id"], []) for issue in halo_issues})
+        else:
+            results = await asyncio.gather(*[
+                self.get_jira_issues_for_halo_issue(jira_local, issue["id"], project_key) for issue in halo_issues
+            ])
+            jira_issues_dict.update(zip([issue["id"] for issue in halo_issues], results))
+        return jira_issues_dict
+
+    async def get_jira_issues_by_key(self, jira_local, project_key, keys_by_issue_id):
+        issue_id_by_key = {key: issue_id for issue_id, keys in keys_by_issue_id.items() for key in keys}
+        jira_issues_dict = defaultdict(list)
+        keys = list(issue_id_by_key)
+        page_size = jira_local.lookup_page_size
+        pages = await asyncio.gather(*[
+            self.search(f'key in ({", ".join(keys[i:i + page_size])})', 0, page_size)
+            for i in range(0, len(keys), page_size)
+        ])
+        for results, _ in pages:
+            for issue in results:
+                issue_id = issue_id_by_key.get(issue.key)
+                if issue_id and jira_local.lookup.get_issue_id(issue) == issue_id:
+                    jira_issues_dict[issue_id].append(issue)
+                    del issue_id_by_key[issue.key]
+        for key in issue_id_by_key:
+            jira_local.state_store.forget_issue(project_key, key)
+        return jira_issues_dict
+
+    async def get_jira_issue_index(self, jira_local, project_key):
+        jira_issues = await self.search_all(
+            jira_local.get_issue_index_jql(project_key), jira_local.lookup_page_size, jira_local.index_fields
+        )
+        jira_issue_index = defaultdict(list)
+        to_migrate = []
+        jira_local.add_to_issue_index(jira_issue_index, to_migrate, jira_issues)
+        jira_local.log.info(f"Indexed {len(jira_issues)} Jira issues in {project_key}")
+        await self.migrate_jira_issues(jira_local, to_migrate)
+        return jira_issue_index
+
+    async def get_jira_issues_for_halo_issue(self, jira_local, issue_id, project_key):
+        results = await self.search_jira_issues_for_halo_issue(
+            jira_local, jira_local.lookup.match_clause(issue_id), issue_id, project_key
+        )
+        fallback_clause = jira_local.lookup.fallback_clause(issue_id)
+        if not results and fallback_clause:
+            results = await self.search_jira_issues_for_halo_issue(jira_local, fallback_clause, issue_id, project_key)
+            await self.migrate_jira_issues(jira_local, [(issue, issue_id) for issue in results])
+        return results
+
+    async def search_jira_issues_for_halo_issue(self, jira_local, clause, issue_id, project_key):
+        results, _ = await self.search(jira_local.get_search_jql(clause, project_key))
+        return [issue for issue in results if jira_local.lookup.get_issue_id(issue) == issue_id]
+
+    async def migrate_jira_issues(self, jira_local, jira_issues_with_ids):
+        if not jira_issues_with_ids:
+            return
+        jira_local.log.info(f"Migrating {len(jira_issues_with_ids)} Jira issues to '{jira_local.lookup.name}' lookup")
+        results = await asyncio.gather(*[
+            self.jira_request("PUT", f"issue/{jira_issue.key}", json={
+                "fields": jira_local.lookup.migration_fields(jira_issue, issue_id)
+            }) for jira_issue, issue_id in jira_issues_with_ids
+        ], return_exceptions=True)
+        for (jira_issue, _), result in zip(jira_issues_with_ids, results):
+            if isinstance(result, JIRAError):
+                jira_local.log.error(f"Could not migrate Jira Issue '{jira_issue.key}': {result.text}")
+
+    async def get_jira_epic_keys(self, jira_local, project_key):
+        """Return dict of group key hash to open epic key, as jlib.JiraLocal().get_jira_epic_keys()."""
+        state_store = jira_local.state_store
+        if state_store:
+            epic_keys = state_store.get_epic_keys(project_key)
+            if epic_keys:
+                return epic_keys
+        jira_epics = await self.search_all(
+            jira_local.get_epics_or_issues_jql(project_key, "Epic"), jira_local.lookup_page_size
+        )
+        epic_keys = {}
+        for epic in jira_epics:
+            epic_keys.setdefault(epic.raw["fields"][jira_local.jira_issue_id_field_key], epic.key)
+        if state_store:
+            for group_key_hash, epic_key in epic_keys.items():
+                state_store.record_epic(group_key_hash, project_key, epic_key)
+        return epic_keys
+
+    async def create_jira_epic(self, jira_local, group_key_hash, group_key_str, project_key):
+        epic_dict = jira_local.get_epic_fields(group_key_hash, group_key_str, project_key)
+        epic = await self.jira_request("POST", "issue", json={"fields": epic_dict})
+        if jira_local.state_store:
+            jira_local.state_store.record_epic(group_key_hash, project_key, epic["key"])
+        return epic["key"]
+
+    async def create_jira_epics(self, jira_local, groups, project_key):
+        """Create epics in bulk, as jlib.JiraLocal().create_jira_epics()."""
+        chunks = [groups[i:i + jira_local.bulk_create_size] for i in range(0, len(groups), jira_local.bulk_create_size)]
+        results = await asyncio.gather(*[self.bulk_create([
+            jira_local.get_epic_fields(group_key_hash, group_key_str, project_key)
+            for group_key_hash, group_key_str in chunk
+        ]) for chunk in chunks])
+        epic_keys = {}
+        for chunk, chunk_results in zip(chunks, results):
+            for (group_key_hash, group_key_str), (epic_key, error) in zip(chunk, chunk_results):
+                if epic_key is None:
+                    jira_local.log.error(f"Could not bulk create epic {group_key_str}, retrying: {error}")
+                    epic_key = await self.create_jira_epic(jira_local, group_key_hash, group_key_str, project_key)
+                elif jira_local.state_store:
+                    jira_local.state_store.record_epic(group_key_hash, project_key, epic_key)
+                epic_keys[group_key_hash] = epic_key
+        return epic_keys
+
+    async def create_jira_issue_chunk(self, jira_local, chunk, project_key):
+        """Create a chunk of prepared issues in one bulk request, retrying failed ones one by one."""
+        jira_local.log.info(
+            f"Creating {len(chunk)} issues: {', '.join(prepared.issue['id'] for prepared, _, _ in chunk)}"
+        )
+        results = await self.bulk_create([issue_dict for _, _, issue_dict in chunk])
+        pending = []
+        for (prepared, epic_link, issue_dict), (jira_key, error) in zip(chunk, results):
+            if jira_key is None:
+                jira_local.log.error(f"Could not bulk create issue {prepared.issue['id']}: {error}")
+                pending.append(self.create_prepared_issue(jira_local, prepared, epic_link, issue_dict, project_key))
+            else:
+                pending.append(self.finish_created_issue(jira_local, prepared, project_key, jira_key, epic_link))
+        await asyncio.gather(*pending)
+
+    async def create_prepared_issue(self, jira_local, prepared, epic_link, issue_dict, project_key):
+        try:
+            jira_issue = await self.jira_request("POST", "issue", json={"fields": issue_dict})
+        except JIRAError as e:
+            jira_local.log.error(f"Could not create issue {prepared.issue['id']}: {e.text}")
+            return
+        await self.finish_created_issue(jira_local, prepared, project_key, jira_issue["key"], epic_link)
+
+    async def finish_created_issue(self, jira_local, prepared, project_key, jira_key, epic_link):
+        """Attach details to a new Jira issue and record it, as jlib.JiraLocal().finish_created_issue()."""
+        pushed = await self.sync_attachment(jira_local, jira_key, [], prepared) if prepared.attachment else True
+        jira_local.record_created_issue(prepared, project_key, jira_key, epic_link, pushed)
+
+    async def bulk_create(self, field_dicts):
+        """Create issues with one bulk-create request, and return a (Jira key, error) pair per issue."""
+        try:
+            raw_issue_json = await self.jira_request("POST", "issue/bulk", json={
+                "issueUpdates": [{"fields": field_dict} for field_dict in field_dicts]
+            })
+        except JIRAError as e:
+            if e.status_code != 400:
+                return [(None, e.text)] * len(field_dicts)
+            try:
+                raw_issue_json = json.loads(e.text)
+            except ValueError:
+                return [(None, e.text)] * len(field_dicts)
+        return JiraLocal.parse_bulk_create_response(raw_issue_json, len(field_dicts))
+
+    async def update_jira_issue(self, jira_local, prepared, jira_issues):
+        issue = prepared.issue
+        payload_hash = prepared.payload_hash
+        for jira_issue in jira_issues:
+            pushed = True
+            if prepared.fields is None:
+                jira_local.log.debug(f"Only transitioning issue: {issue['id']} ({jira_issue.key})")
+            elif payload_hash == jira_local.get_last_payload_hash(jira_issue, issue["id"]):
+                jira_local.log.debug(f"Skipping unchanged issue: {issue['id']} ({jira_issue.key})")
+            else:
+                changed_fields = jira_local.get_changed_fields(jira_issue, issue["id"], dict(prepared.fields))
+                if changed_fields:
+                    jira_local.log.info(f"Updating issue: {issue['id']} ({', '.join(sorted(changed_fields))})")
+                    await self.jira_request("PUT", f"issue/{jira_issue.key}", json={"fields": changed_fields})
+                if prepared.attachment:
+                    attachments = await self.get_attachments(jira_issue)
+                    pushed = await self.sync_attachment(jira_local, jira_issue.key, attachments, prepared)
+                if pushed:
+                    jira_local.pushed_payload_hashes[jira_issue.key] = payload_hash
+            transition_name = jira_local.get_transition_name(issue, jira_issue)
+            if transition_name:
+                await self.transition_issue(jira_local, jira_issue, transition_name)
+            jira_local.record_jira_issue(jira_issue, issue["id"], status=issue["status"],
+                                         **jira_local.get_pushed_state(prepared, pushed))
+
+    async def get_attachments(self, jira_issue):
+        """Return the attachments of a Jira issue, fetching them if the issue was found without."""
+        attachments = jira_issue.raw["fields"].get("attachment")
+        if attachments is None:
+            jira_issue = await self.jira_request("GET", f"issue/{jira_issue.key}", params={"fields": "attachment"})
+            attachments = jira_issue["fields"]["attachment"]
+        return attachments
+
+    async def sync_attachment(self, jira_local, jira_key, attachments, prepared):
+        """Attach the prepared issue's details, as jlib.JiraLocal().sync_attachment(), and return True if attached."""
+        filename, content = prepared.attachment
+        if any(attachment["filename"] == filename for attachment in attachments):
+            return True
+        form = aiohttp.MultipartWriter("form-data")
+        part = form.append(content, {"Content-Type": "application/gzip"})
+        part.set_content_disposition("form-data", name="file", filename=filename)
+        try:
+            jira_local.log.info(f"Attaching {filename} to {jira_key}")
+            await self.jira_request("POST", f"issue/{jira_key}/attachments", data=form,
+                                    headers={"X-Atlassian-Token": "no-check"})
+        except JIRAError as e:
+            jira_local.log.error(f"Could not attach {filename} to {jira_key}: {e.text}")
+            return False
+        prefix = f"halo-{prepared.issue['id']}-"
+        for attachment in attachments:
+            if attachment["filename"].startswith(prefix) and attachment["filename"].endswith(".json.gz"):
+                try:
+                    await self.jira_request("DELETE", f"attachment/{attachment['id']}")
+                except JIRAError as e:
+                    jira_local.log.error(f"Could not delete {attachment['filename']} from {jira_key}: {e.text}")
+        return True
+
+    async def transition_issue(self, jira_local, jira_issue, transition_name):
+        jira_local.log.info(f"Transitioning issue {jira_issue.key} to {transition_name}")
+        try:
+            transitions = await self.jira_request("GET", f"issue/{jira_issue.key}/transitions")
+            transition_id = next((
+                transition["id"] for transition in transitions["transitions"]
+                if transition["name"].lower() == transition_name.lower()
+            ), None)
+            await self.jira_request("POST", f"issue/{jira_issue.key}/transitions", json={
+                "transition": {"id": transition_id}
+            })
+        except JIRAError:
+            jira_local.log.error(
+                f"Could not transition Jira Issue '{jira_issue.key}' "
+                f"from {jira_issue.raw['fields']['status']['name']} to {transition_name}"
+            )
@@ -0,0 +1,121 @@
+"""Caches for Halo objects fetched during a run, and across runs."""
+import json
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+
+
+class SingleFlightCache(object):
+    """Run-scoped cache which collapses concurrent loads of the same key.
+
+    The first caller for a key runs the loader; callers arriving while it is
+    in flight wait for the same result. Failed loads are not cached.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.futures = {}
+
+    def get(self, key, loader, *args):
+        with self.lock:
+            future = self.futures.get(key)
+            owner = future is None
+            if owner:
+                future = self.futures[key] = Future()
+        if owner:
+            try:
+                future.set_result(loader(*args))
+            except Exception as e:
+                with self.lock:
+                    del self.futures[key]
+                future.set_exception(e)
+        return future.result()
+
+    def discard(self, keys):
+        """Forget the results for keys, so they can be garbage-collected."""
+        with self.lock:
+            for key in keys:
+                self.futures.pop(key, None)
+
+    def __contains__(self, key):
+        with self.lock:
+            future = self.futures.get(key)
+        return future is not None and future.done() and future.exception() is None
+
+    def clear(self):
+        with self.lock:
+            self.futures = {}
+
+
+class DiskCache(object):
+    """TTL-bounded key/value cache of JSON documents, kept in SQLite.
+
+    Args:
+        db_path (str): Path to the SQLite database file.
+        table (str): Table holding this cache, so caches can share a file.
+        ttl (int): Seconds after which an entry is considered expired.
+        max_entries (int): If set, evict() drops the oldest entries beyond
+            this many.
+    """
+
+    def __init__(self, db_path, table, ttl, max_entries=None):
+        db_dir = os.path.dirname(os.path.abspath(db_path))
+        if not os.path.exists(db_dir):
+            os.makedirs(db_dir)
+        self.table = table
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.lock = threading.RLock()
+        self.connection = sqlite3.connect(db_path, check_same_thread=False)
+        with self.lock, self.connection:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("PRAGMA synchronous=NORMAL")
+            self.connection.execute(
+                f"CREATE TABLE IF NOT EXISTS {table} ("
+                f"key TEXT PRIMARY KEY, "
+                f"value TEXT NOT NULL, "
+                f"stored_at REAL NOT NULL)"
+            )
+            self.connection.execute(
+                f"CREATE INDEX IF NOT EXISTS {table}_stored_at ON {table} (stored_at)"
+            )
+
+    def get(self, key):
+        """Return the cached value for key, or None if missing or expired."""
+        with self.lock:
+            row = self.connection.execute(
+                f"SELECT value, stored_at FROM {self.table} WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None or row[1] + self.ttl < time.time():
+            return None
+        return json.loads(row[0])
+
+    def set(self, key, value):
+        with self.lock, self.connection:
+            self.connection.execute(
+                f"INSERT OR REPLACE INTO {self.table} (key, value, stored_at) VALUES (?, ?, ?)",
+                (key, json.dumps(value), time.time())
+            )
+
+    def evict(self):
+        """Drop expired entries, then the oldest ones beyond max_entries."""
+        with self.lock, self.connection:
+            self.connection.execute(
+                f"DELETE FROM {self.table} WHERE stored_at < ?", (time.time() - self.ttl,)
+            )
+            if self.max_entries:
+                self.connection.execute(
+                    f"DELETE FROM {self.table} WHERE key IN ("
+                    f"SELECT key FROM {self.table} ORDER BY stored_at DESC LIMIT -1 OFFSET ?)",
+                    (self.max_entries,)
+                )
+
+    def __len__(self):
+        with self.lock:
+            return self.connection.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
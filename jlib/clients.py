@@ -0,0 +1,59 @@
+"""Process-wide registry of the Halo and Jira clients."""
+import hashlib
+import threading
+from jira import JIRA
+from jlib.halo import Halo
+from jlib.scheduler import ScheduledHTTPAdapter, Scheduler
+
+
+class ClientRegistry(object):
+    """Hand out one shared, thread-safe client per set of credentials.
+
+    Sharing clients means each run authenticates once per service, and all
+    threads draw from one warm HTTP connection pool, whose requests go
+    through the service's jlib.Scheduler(). Clients are keyed by a digest of
+    their secret as well, so rotated credentials get a new client.
+
+    Clients hold the schedulers and caches of the run they were made in, so
+    each run starts with clear().
+    """
+
+    lock = threading.Lock()
+    clients = {}
+
+    @classmethod
+    def get_halo(cls, config):
+        """Return the shared jlib.Halo() for the configured Halo credentials."""
+        key = cls.get_key("halo", config.halo_api_key, config.halo_api_hostname, config.halo_api_secret_key)
+        with cls.lock:
+            if key not in cls.clients:
+                cls.clients[key] = Halo(
+                    config.halo_api_key, config.halo_api_secret_key, config.halo_api_hostname,
+                    config.cache_db_path, config.asset_cache_ttl, config.cve_cache_ttl,
+                    config.cve_cache_max_entries, config.describe_cache_ttl
+                )
+            return cls.clients[key]
+
+    @classmethod
+    def get_jira(cls, jira_url, auth_user, auth_token):
+        """Return the shared JIRA client for a Jira URL and user."""
+        key = cls.get_key("jira", auth_user, jira_url, auth_token)
+        with cls.lock:
+            if key not in cls.clients:
+                # The scheduled adapter retries requests; ResilientSession retrying too would multiply attempts.
+                jira = JIRA(jira_url, basic_auth=(auth_user, auth_token), max_retries=0)
+                adapter = ScheduledHTTPAdapter(Scheduler.get("jira"))
+                jira._session.mount("https://", adapter)
+                jira._session.mount("http://", adapter)
+                cls.clients[key] = jira
+            return cls.clients[key]
+
+    @staticmethod
+    def get_key(service, user, url, secret):
+        """Return the registry key of a client, which holds a digest of the secret rather than the secret."""
+        return service, user, url, hashlib.sha256(secret.encode()).hexdigest()
+
+    @classmethod
+    def clear(cls):
+        with cls.lock:
+            cls.clients = {}
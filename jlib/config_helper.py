@@ -1,9 +1,12 @@
 """Manage configuration for application."""
 import os
 import yaml
-from jira import JIRA
 from jira.exceptions import JIRAError
+from jlib.clients import ClientRegistry
+from jlib.formatter import Formatter, orjson
 from jlib.logger import Logger
+from jlib.lookup import LOOKUP_STRATEGIES
+from jlib.scheduler import Scheduler
 
 
 class ConfigHelper(object):
@@ -15,6 +18,35 @@ class ConfigHelper(object):
         halo_api_hostname (str): Halo API hostname.
         jira_api_token (str): API token for Jira.
         jira_api_url (str): URL for Jira API.
+        state_db_path (str): Path to the SQLite sync-state database, if any.
+        cache_db_path (str): Path to the SQLite database of persistent caches, if any.
+        asset_cache_ttl (int): Seconds to keep described assets in the persistent cache.
+        cve_cache_ttl (int): Seconds to keep CVE details in the persistent cache.
+        cve_cache_max_entries (int): Maximum number of CVE details in the persistent cache.
+        describe_cache_ttl (int): Seconds to keep described bodies for conditional GETs.
+        max_workers (int): Default number of concurrent requests per service.
+        halo_max_concurrency (int): Maximum number of requests in flight to Halo.
+        jira_max_concurrency (int): Maximum number of requests in flight to Jira.
+        halo_rate_limit (float): Requests per second to Halo. Unlimited if 0.
+        jira_rate_limit (float): Requests per second to Jira. Unlimited if 0.
+        max_retries (int): Retries of a throttled or failed request.
+        backoff_max (float): Maximum seconds to wait before a retry.
+        adaptive_concurrency (bool): Adapt the number of requests in flight to
+            each service, up to its maximum, to observed latency and throttling.
+        min_concurrency (int): Minimum number of requests in flight per
+            service with adaptive concurrency.
+        fetch_mode (str): "per_rule" to list Halo issues for each rule, or
+            "shared" to list them once for all rules.
+        sync_engine (str): "threaded" to reconcile with thread pools,
+            "async" to reconcile from one asyncio event loop, or "streaming"
+            to stream issues from Halo to Jira page by page.
+        pipeline_queue_size (int): Pages buffered between streaming stages.
+        spill_dir (str): Directory where enriched issues are spilled to disk,
+            if any.
+        spill_batch_size (int): Issues enriched, and then reconciled, at a
+            time when spilling to disk.
+        json_encoder (str): "json" to render descriptions with the standard
+            encoder, or "orjson" with orjson, if installed.
     """
 
     def __init__(self):
@@ -29,10 +61,46 @@ class ConfigHelper(object):
         self.jira_api_user = os.getenv('JIRA_API_USER') or self.config.get('JIRA_API_USER')
         self.jira_api_token = os.getenv('JIRA_API_TOKEN') or self.config.get('JIRA_API_TOKEN')
         self.jira_api_url = os.getenv('JIRA_API_URL') or self.config.get('JIRA_API_URL')
+        self.state_db_path = os.getenv('STATE_DB_PATH') or self.config.get('STATE_DB_PATH')
+        self.cache_db_path = os.getenv('CACHE_DB_PATH') or self.config.get('CACHE_DB_PATH')
+        self.asset_cache_ttl = int(os.getenv('ASSET_CACHE_TTL') or self.config.get('ASSET_CACHE_TTL', 3600))
+        self.cve_cache_ttl = int(os.getenv('CVE_CACHE_TTL') or self.config.get('CVE_CACHE_TTL', 604800))
+        self.cve_cache_max_entries = int(os.getenv('CVE_CACHE_MAX_ENTRIES') or
+                                         self.config.get('CVE_CACHE_MAX_ENTRIES', 50000))
+        self.describe_cache_ttl = int(os.getenv('DESCRIBE_CACHE_TTL') or self.config.get('DESCRIBE_CACHE_TTL', 604800))
+        self.max_workers = int(os.getenv('MAX_WORKERS') or self.config.get('MAX_WORKERS', os.cpu_count() * 2))
+        self.fetch_mode = os.getenv('FETCH_MODE') or self.config.get('FETCH_MODE', 'per_rule')
+        self.sync_engine = os.getenv('SYNC_ENGINE') or self.config.get('SYNC_ENGINE', 'threaded')
+        self.pipeline_queue_size = int(os.getenv('PIPELINE_QUEUE_SIZE') or self.config.get('PIPELINE_QUEUE_SIZE', 2))
+        self.spill_dir = os.getenv('SPILL_DIR') or self.config.get('SPILL_DIR')
+        self.spill_batch_size = int(os.getenv('SPILL_BATCH_SIZE') or self.config.get('SPILL_BATCH_SIZE', 500))
+        self.halo_max_concurrency = int(os.getenv('HALO_MAX_CONCURRENCY') or
+                                        self.config.get('HALO_MAX_CONCURRENCY', self.max_workers))
+        self.jira_max_concurrency = int(os.getenv('JIRA_MAX_CONCURRENCY') or
+                                        self.config.get('JIRA_MAX_CONCURRENCY', self.max_workers))
+        self.halo_rate_limit = float(os.getenv('HALO_RATE_LIMIT') or self.config.get('HALO_RATE_LIMIT', 0))
+        self.jira_rate_limit = float(os.getenv('JIRA_RATE_LIMIT') or self.config.get('JIRA_RATE_LIMIT', 0))
+        self.max_retries = int(os.getenv('MAX_RETRIES') or self.config.get('MAX_RETRIES', 5))
+        self.backoff_max = float(os.getenv('BACKOFF_MAX') or self.config.get('BACKOFF_MAX', 60))
+        self.adaptive_concurrency = str(os.getenv('ADAPTIVE_CONCURRENCY') or
+                                        self.config.get('ADAPTIVE_CONCURRENCY', False)).lower() == 'true'
+        self.min_concurrency = int(os.getenv('MIN_CONCURRENCY') or self.config.get('MIN_CONCURRENCY', 1))
+        self.json_encoder = os.getenv('JSON_ENCODER') or self.config.get('JSON_ENCODER', 'json')
+        self.set_schedulers()
+        Formatter.json_encoder = self.json_encoder
         self.jira_fields_dict = self.set_jira_fields(self.jira_api_user, self.jira_api_token, self.jira_api_url)
 
+    def set_schedulers(self):
+        """Configure the schedulers all Halo and Jira requests go through."""
+        Scheduler.configure("halo", self.halo_max_concurrency, rate_limit=self.halo_rate_limit,
+                            max_retries=self.max_retries, backoff_max=self.backoff_max,
+                            adaptive=self.adaptive_concurrency, min_concurrency=self.min_concurrency)
+        Scheduler.configure("jira", self.jira_max_concurrency, rate_limit=self.jira_rate_limit,
+                            max_retries=self.max_retries, backoff_max=self.backoff_max,
+                            adaptive=self.adaptive_concurrency, min_concurrency=self.min_concurrency)
+
     def set_jira_fields(self, auth_user, auth_token, jira_url):
-        jira = JIRA(jira_url, basic_auth=(auth_user, auth_token))
+        jira = ClientRegistry.get_jira(jira_url, auth_user, auth_token)
         jira_fields = {}
         for field in jira.fields():
             jira_fields[field["name"]] = field["id"]
@@ -41,10 +109,10 @@ class ConfigHelper(object):
 
     def validate_config(self):
         """Return True if all required vars are set, False otherwise."""
-        validation_passed = True
         validation_passed = self.validate_creds()
-        validation_passed = self.validate_rules()
-        validation_passed = self.validate_jira_fields()
+        validation_passed = self.validate_settings() and validation_passed
+        validation_passed = self.validate_rules() and validation_passed
+        validation_passed = self.validate_jira_fields() and validation_passed
         return validation_passed
 
     def validate_jira_fields(self):
@@ -61,6 +129,9 @@ class ConfigHelper(object):
                 for key in static.keys():
                     if key not in self.jira_fields_dict:
                         invalid_fields.append(key)
+                label_field = (rule.get("jira_config") or {}).get("lookup_label_field")
+                if label_field and label_field not in self.jira_fields_dict:
+                    invalid_fields.append(label_field)
                 if invalid_fields:
                     self.logger.critical(f"Invalid field names in '{rule['name']}': {', '.join(invalid_fields)}")
                     validation_passed = False
@@ -84,6 +155,19 @@ class ConfigHelper(object):
             return False
         return True
 
+    def validate_settings(self):
+        validation_passed = True
+        if self.sync_engine not in ['threaded', 'async', 'streaming']:
+            self.logger.critical(f"Invalid SYNC_ENGINE: {self.sync_engine}")
+            validation_passed = False
+        if self.json_encoder not in Formatter.json_encoders:
+            self.logger.critical(f"Invalid JSON_ENCODER: {self.json_encoder}")
+            validation_passed = False
+        elif self.json_encoder == 'orjson' and orjson is None:
+            self.logger.critical("JSON_ENCODER is orjson, but orjson isn't installed")
+            validation_passed = False
+        return validation_passed
+
     def validate_rules(self):
         validation_passed = True
         if not self.rules:
@@ -105,16 +189,41 @@ class ConfigHelper(object):
                     rule_missing.append('issue_status_closed')
                 if not rule['jira_config'].get('issue_status_reopened', None):
                     rule_missing.append('issue_status_reopened')
+                if rule['jira_config'].get('update_mode', 'full') not in ['full', 'diff']:
+                    self.logger.critical(f"Invalid 'update_mode' in '{rule['name']}'")
+                    validation_passed = False
+                if rule['jira_config'].get('lookup_strategy', 'text') not in LOOKUP_STRATEGIES:
+                    self.logger.critical(f"Invalid 'lookup_strategy' in '{rule['name']}'")
+                    validation_passed = False
+                if Formatter.get_payload_profile(rule['jira_config'].get('payload_profile', 'full')) is None:
+                    self.logger.critical(f"Invalid 'payload_profile' in '{rule['name']}'")
+                    validation_passed = False
             except KeyError:
                 self.logger.critical(f"Missing 'jira_config' field in {rule['name']}")
                 validation_passed = False
                 continue
+            if not self.validate_partitions(rule):
+                validation_passed = False
             if rule_missing:
                 msg = f"Missing 'jira_config' attributes in '{rule['name']}': {', '.join(rule_missing)}"
                 self.logger.critical(msg)
                 validation_passed = False
         return validation_passed
 
+    def validate_partitions(self, rule):
+        """Return False if a partition sets an issue filter the rule sets already, or one the sync sets itself."""
+        filters = rule.get("filters") or {}
+        incremental = rule.get("incremental") or {}
+        reserved = set(filters.get("issue") or {}) | {"status", incremental.get("filter", "last_seen_at_gte")}
+        for partition in filters.get("partitions") or []:
+            overlap = reserved & set(partition)
+            if overlap:
+                self.logger.critical(
+                    f"Partition in '{rule['name']}' overrides issue filters: {', '.join(sorted(overlap))}"
+                )
+                return False
+        return True
+
     def set_config(self):
         config = {}
         config_dir = self.relpath_to_abspath('../config/etc')
@@ -0,0 +1,134 @@
+"""Evaluate routing rule issue filters locally, against listed Halo issues."""
+
+
+class UnsupportedFilter(Exception):
+    """Raised when an issue filter cannot be evaluated locally."""
+    pass
+
+
+class FilterEngine(object):
+    """Compile the `filters.issue` block of routing rules into predicates.
+
+    Filters follow the Halo API: comma-separated or list values match any of
+    the values, `*_gte`/`*_lte` filters compare, and all filters must match.
+    """
+
+    # Filters named differently from the issue attribute they test.
+    attribute_names = {"cve_id": "cve_ids"}
+    # Filters known to match an issue attribute exactly, as Halo applies them.
+    # Any other filter is left to Halo.
+    exact_filters = {
+        "asset_id", "asset_name", "asset_type", "asset_fqdn", "asset_hostname", "cp_rule_id", "critical",
+        "csp_account_id", "csp_account_name", "csp_account_type", "csp_image_id", "csp_region", "csp_resource_id",
+        "csp_tags", "cve_id", "group_id", "group_name", "os_type", "policy_name", "registry_id", "registry_name",
+        "repository_id", "repository_name", "source", "status", "type",
+    }
+    range_filters = {"first_seen_at", "last_seen_at", "max_cvss"}
+
+    @classmethod
+    def compile(cls, issue_filters):
+        """Return a predicate taking an issue and returning True if it matches.
+
+        Raises:
+            UnsupportedFilter: A filter can't be evaluated locally.
+        """
+        issue_filters = dict(issue_filters or {})
+        issue_filters.setdefault("status", "active")
+        predicates = [cls.compile_filter(name, value) for name, value in issue_filters.items()]
+        return lambda issue: all(predicate(issue) for predicate in predicates)
+
+    @classmethod
+    def compile_filter(cls, name, value):
+        if value is None:
+            raise UnsupportedFilter(name)
+        if name == "csp_tags":
+            wanted_tags = cls.normalize_tags(value)
+            return lambda issue: wanted_tags <= cls.normalize_tags(issue.get("csp_tags"))
+        for suffix, compare in [("_gte", lambda a, b: a >= b), ("_lte", lambda a, b: a <= b)]:
+            if name.endswith(suffix) and name[:-len(suffix)] in cls.range_filters:
+                attribute = name[:-len(suffix)]
+                bound = cls.normalize_scalar(value)
+                return lambda issue: (issue.get(attribute) is not None and
+                                      compare(cls.normalize_scalar(issue[attribute]), bound))
+        if name not in cls.exact_filters:
+            raise UnsupportedFilter(name)
+        attribute = cls.attribute_names.get(name, name)
+        wanted = cls.normalize_values(value)
+
+        def predicate(issue):
+            if attribute not in issue:
+                return False
+            actual = issue[attribute]
+            if isinstance(actual, list):
+                return bool(wanted & cls.normalize_values(actual))
+            return cls.normalize_scalar(actual) in wanted
+        return predicate
+
+    @classmethod
+    def normalize_values(cls, value):
+        if isinstance(value, str):
+            value = value.split(",")
+        elif not isinstance(value, (list, tuple, set)):
+            value = [value]
+        return set(cls.normalize_scalar(x) for x in value)
+
+    @staticmethod
+    def normalize_scalar(value):
+        if isinstance(value, bool):
+            return str(value).lower()
+        if isinstance(value, (int, float)):
+            return float(value)
+        value = str(value).strip()
+        try:
+            return float(value)
+        except ValueError:
+            return value.lower()
+
+    @staticmethod
+    def normalize_tags(tags):
+        """Return csp_tags given as a dict, key/value dicts or "key:value" strings as a set of pairs."""
+        if not tags:
+            return set()
+        if isinstance(tags, dict):
+            return set((str(k), str(v)) for k, v in tags.items())
+        if isinstance(tags, str):
+            tags = tags.split(",")
+        pairs = set()
+        for tag in tags:
+            if isinstance(tag, dict):
+                pairs.add((str(tag.get("key")), str(tag.get("value"))))
+            else:
+                key, _, value = str(tag).partition(":")
+                pairs.add((key.strip('" '), value.strip('" ')))
+        return pairs
+
+    @classmethod
+    def union_filters(cls, issue_filters_list):
+        """Return Halo API filters matching every issue any of the filter dicts matches.
+
+        Only filters present in every dict can narrow the union: their values
+        are merged, bounds are widened, and csp_tags are kept if identical.
+        """
+        issue_filters_list = [dict(issue_filters or {}) for issue_filters in issue_filters_list]
+        for issue_filters in issue_filters_list:
+            issue_filters.setdefault("status", "active")
+        union = {}
+        for name in set.intersection(*[set(issue_filters) for issue_filters in issue_filters_list]):
+            values = [issue_filters[name] for issue_filters in issue_filters_list]
+            if name == "csp_tags":
+                if all(cls.normalize_tags(x) == cls.normalize_tags(values[0]) for x in values):
+                    union[name] = values[0]
+            elif name.endswith("_gte"):
+                union[name] = min(values, key=cls.normalize_scalar)
+            elif name.endswith("_lte"):
+                union[name] = max(values, key=cls.normalize_scalar)
+            else:
+                merged = []
+                for value in values:
+                    for x in (value.split(",") if isinstance(value, str) else
+                              value if isinstance(value, list) else [value]):
+                        x = str(x).lower() if isinstance(x, bool) else str(x)
+                        if x not in merged:
+                            merged.append(x)
+                union[name] = ",".join(merged)
+        return union
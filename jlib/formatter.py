@@ -1,17 +1,37 @@
 """Entrypoint for formatting assets, issues, and findings."""
 import json
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 
 class Formatter(object):
+    # Jira rejects text fields longer than 32,767 characters.
+    max_description_length = 32767
+    code_close = '{code}\n\n'
+    json_encoders = ["json", "orjson"]
+    json_encoder = "json"
+
+    core_issue_fields = ['id', 'name', 'type', 'status', 'critical', 'source', 'first_seen_at', 'last_seen_at',
+                         'policy_name', 'cp_rule_id', 'rule_name', 'resolved_at', 'resolved_by', 'resolution_comment',
+                         'time_to_resolution', 'package_name', 'package_version', 'cve_ids', 'max_cvss',
+                         'remotely_exploitable', ]
+
+    core_asset_fields = ['asset_name', 'asset_type', 'group_name', 'csp_account_id', 'csp_account_type',
+                         'csp_account_name', 'csp_region', 'csp_service_type', 'csp_resource_id', 'csp_tags',
+                         'csp_image_id', 'csp_resource_uri', 'os_type', 'registry_name', ]
 
-    # core_issue_fields = ['name', 'type', 'status', 'critical', 'source', 'first_seen_at', 'last_seen_at',
-    #                      'policy_name', 'cp_rule_id', 'rule_name', 'resolved_at', 'resolved_by', 'resolution_comment'
-    #                      'time_to_resolution', 'package_name', 'package_version', 'cve_ids', 'max_cvss',
-    #                      'remotely_exploitable', ]
-    #
-    # core_asset_fields = ['asset_name', 'asset_type', 'group_name', 'csp_account_id', 'csp_account_type',
-    #                      'csp_account_name', 'csp_region', 'csp_service_type', 'csp_resource_id', 'csp_tags',
-    #                      'csp_image_id', 'csp_resource_uri', 'os_type', 'registry_name', ]
+    # Finding summaries, without rule descriptions, details, FIM findings or CVE entries.
+    core_finding_fields = ['id', 'status', 'critical', 'rule_name', 'package_name', 'package_version', 'cpe',
+                           'counts', ]
+
+    # Fields kept in descriptions for each type of object, which is kept whole if left out.
+    payload_profiles = {
+        "full": {},
+        "core": {"issue": core_issue_fields, "asset": core_asset_fields, "findings": core_finding_fields},
+    }
 
     @classmethod
     def format_object(cls, object_type, object_json):
@@ -24,9 +44,93 @@ class Formatter(object):
         Returns:
             str: Jira-formatted text describing object.
         """
-        formatted = f'h2. {object_type}\n' + '{code:JSON}' + json.dumps(object_json, indent=2) + '{code}\n\n'
+        formatted = cls.format_header(object_type) + ''.join(cls.iterencode(object_json)) + cls.code_close
         return formatted
 
+    @classmethod
+    def format_description(cls, objects, max_length=None):
+        """Return Jira-formatted text describing objects, at most max_length characters long.
+
+        Objects are encoded piece by piece into a bounded buffer, and encoding
+        stops as soon as the buffer is full, so what doesn't fit is never
+        encoded. A {code} block cut short is still closed, and a section
+        is left out if not even its header fits.
+
+        Args:
+            objects (list): (object type, Halo object json) pairs, in order.
+            max_length (int): Defaults to Jira's limit, cls.max_description_length.
+
+        Returns:
+            str: Jira-formatted text describing objects.
+        """
+        max_length = max_length or cls.max_description_length
+        buffer = []
+        length = 0
+        for object_type, object_json in objects:
+            header = cls.format_header(object_type)
+            room = max_length - length - len(header) - len(cls.code_close)
+            if room <= 0:
+                break
+            buffer.append(header)
+            encoded = 0
+            for chunk in cls.iterencode(object_json):
+                if encoded + len(chunk) > room:
+                    buffer.append(chunk[:room - encoded])
+                    encoded = room
+                    break
+                buffer.append(chunk)
+                encoded += len(chunk)
+            buffer.append(cls.code_close)
+            length += len(header) + encoded + len(cls.code_close)
+            if encoded == room:
+                break
+        return ''.join(buffer)
+
+    @classmethod
+    def get_payload_profile(cls, payload_profile):
+        """Return dict of object type to the fields a payload profile keeps, or None if it is invalid.
+
+        Args:
+            payload_profile: Name of one of cls.payload_profiles, or a custom
+                dict of "issue", "asset" and/or "findings" to field list.
+        """
+        if isinstance(payload_profile, dict):
+            if set(payload_profile) <= {"issue", "asset", "findings"} and all(
+                    isinstance(fields, list) for fields in payload_profile.values()):
+                return payload_profile
+            return None
+        return cls.payload_profiles.get(payload_profile)
+
+    @staticmethod
+    def project(object_json, fields):
+        """Return a copy of object_json with only fields, or object_json itself if fields is None."""
+        if fields is None or not isinstance(object_json, dict):
+            return object_json
+        return {field: object_json[field] for field in fields if field in object_json}
+
+    @staticmethod
+    def format_attachment_link(filename):
+        return f'Full asset and findings JSON: [^{filename}]\n\n'
+
+    @staticmethod
+    def format_header(object_type):
+        return f'h2. {object_type}\n' + '{code:JSON}'
+
+    @classmethod
+    def iterencode(cls, object_json):
+        """Return an iterable of the pieces of object_json, encoded with indentation by cls.json_encoder.
+
+        orjson encodes in one piece, which is still much faster than the
+        standard encoder for large objects. Objects it can't encode fall
+        back to the standard encoder.
+        """
+        if cls.json_encoder == "orjson" and orjson is not None:
+            try:
+                return [orjson.dumps(object_json, option=orjson.OPT_INDENT_2).decode()]
+            except TypeError:
+                pass
+        return json.JSONEncoder(indent=2).iterencode(object_json)
+
     @classmethod
     def format_summary(cls, issue_described):
         """Format summary string."""
@@ -2,83 +2,367 @@ import os
 import re
 import json
 import cloudpassage
+from cloudpassage.utility import Utility
+from urllib3.util.retry import Retry
+from collections import defaultdict
 from concurrent.futures import ThreadPoolExecutor, as_completed
-from pprint import pprint
+from jlib.cache import DiskCache, SingleFlightCache
+from jlib.filter_engine import FilterEngine, UnsupportedFilter
 from jlib.logger import Logger
+from jlib.scheduler import ScheduledHTTPAdapter, Scheduler
 
 
 class Halo(object):
-    def __init__(self, key, secret, api_host):
+    # Pages listed per query, as cloudpassage.Issue().list_all() does.
+    max_pages = 20
+
+    def __init__(self, key, secret, api_host, cache_db_path=None, asset_cache_ttl=0, cve_cache_ttl=0,
+                 cve_cache_max_entries=None, describe_cache_ttl=0):
         """Instantiate with key, secret, and API host.
 
         Args:
-            config (ConfigHelper): Config Object
+            key (str): Halo API key.
+            secret (str): Halo API secret.
+            api_host (str): Halo API hostname.
+            cache_db_path (str): Path to the SQLite file of persistent caches.
+            asset_cache_ttl (int): Seconds to keep described assets in the
+                persistent cache. Disabled if 0.
+            cve_cache_ttl (int): Seconds to keep CVE details in the persistent
+                cache. Disabled if 0.
+            cve_cache_max_entries (int): Maximum number of cached CVE details.
+            describe_cache_ttl (int): Seconds to keep described bodies and
+                their validators, for conditional GETs. Disabled if 0.
         """
         self.logger = Logger()
         integration = self.get_integration_string()
         self.session = cloudpassage.HaloSession(key, secret, api_host=api_host, integration_string=integration)
+        self.scheduler = Scheduler.get("halo")
+        # Throttled and failed responses are retried by the scheduler, connection errors by urllib3.
+        self.session.halo_http_adapter = ScheduledHTTPAdapter(
+            self.scheduler, max_retries=Retry(
+                total=self.session.max_retries, backoff_factor=1, respect_retry_after_header=False
+            )
+        )
+        self.session.client.mount(self.session.session_mount, self.session.halo_http_adapter)
         self.issue = cloudpassage.Issue(self.session, endpoint_version=3)
         self.http_helper = cloudpassage.HttpHelper(self.session)
         self.cve_detail = cloudpassage.CveDetails(self.session)
+        self.describe_cache = SingleFlightCache()
+        # Enrichments of this run, by issue ID and last_seen_at.
+        self.enrichment_memo = {}
+        self.asset_cache = None
+        if cache_db_path and asset_cache_ttl:
+            self.asset_cache = DiskCache(cache_db_path, "assets", asset_cache_ttl)
+        self.cve_cache = None
+        if cache_db_path and cve_cache_ttl:
+            self.cve_cache = DiskCache(cache_db_path, "cve_details", cve_cache_ttl, cve_cache_max_entries)
+        self.describe_body_cache = None
+        if cache_db_path and describe_cache_ttl:
+            self.describe_body_cache = DiskCache(cache_db_path, "describe_bodies", describe_cache_ttl)
 
-    def get_issues(self, filters):
-        """Return list of all issues since timestamp, described.
+    def get_issues(self, filters, since=None, since_filter="last_seen_at_gte", issue_store=None, chunk_size=500,
+                   enrich=None):
+        """Return list of all issues matching filters, described.
 
-        This wraps the initial retrieval of all issues touched since timestamp,
-        and makes multi-threaded calls to self.get_issue_full() to get the
-        full description of all issues.
+        This wraps the initial retrieval of all issues matching the rule's
+        filters, and makes multi-threaded calls to enrich them with their
+        asset, last finding and CVE details.
 
         Args:
-            timestamp (str): ISO8601-formatted timestamp.
+            filters (dict): Filters block of a routing rule.
+            since (str): ISO8601-formatted timestamp. If set, only issues
+                changed since then are listed.
+            since_filter (str): Halo issue filter used to apply `since`.
+            issue_store (obj): If set, a jlib.IssueStore() which issues are
+                enriched into, chunk_size issues at a time.
+            chunk_size (int): Issues enriched at a time into issue_store.
+            enrich (callable): Enriches a list of issues and returns it,
+                e.g. jlib.Reconciler().enrich(). Defaults to self.enrich().
 
         Returns:
-            list: List of dictionary objects describing all issues since
-                timestamp.
+            list: List of dictionary objects describing all issues matching
+                filters, or issue_store if set.
         """
         # Create a set of all issue IDs in scope for this run of the tool.
-        issue_filters = filters.get("issue") or {}
-        if "csp_tags" in issue_filters:
-            csp_tags = issue_filters["csp_tags"]
-            csp_tags_formatted = re.sub('[{}]', '', json.dumps(csp_tags).replace(' ', ''))
-            issue_filters["csp_tags"] = csp_tags_formatted
+        issue_filters = dict(filters.get("issue") or {})
+        if since:
+            issue_filters[since_filter] = since
 
-        filtered_issues = self.issue.list_all(**issue_filters)
+        filtered_issues = self.list_issues(issue_filters, filters.get("partitions"))
 
         if filtered_issues:
             self.logger.info(f"Issues to process: {len(filtered_issues)}")
-            filtered_issues = self.get_asset_and_findings(filtered_issues)
-            filtered_issues = self.get_cve_details(filtered_issues)
+            if issue_store is not None:
+                return self.enrich_to_store(filtered_issues, issue_store, chunk_size, enrich)
+            filtered_issues = (enrich or self.enrich)(filtered_issues)
 
         return filtered_issues
 
+    def get_issues_for_rules(self, rules):
+        """Return dict of rule name to matching issues, listed once for all rules.
+
+        Halo applies the union of the rules' filters, then each rule's own
+        filters are evaluated locally. Rules which are partitioned, or whose
+        filters can't be evaluated locally, are left out of the result.
+        The union is listed without the page cap of per-rule listing, which
+        would otherwise be shared by all rules. Issues are left for each rule
+        to enrich, the enrichment memo sharing it between rules.
+
+        Args:
+            rules (list): Routing rules.
+
+        Returns:
+            dict: Rule name to list of dictionary objects describing issues.
+                Each rule gets its own copies of the issue dicts.
+        """
+        predicates = {}
+        for rule in rules:
+            filters = rule.get("filters") or {}
+            if filters.get("partitions"):
+                continue
+            try:
+                predicates[rule["name"]] = FilterEngine.compile(filters.get("issue"))
+            except UnsupportedFilter as e:
+                self.logger.info(f"Listing issues for {rule['name']} separately, can't filter on '{e}' locally")
+        if not predicates:
+            return {}
+        union_filters = FilterEngine.union_filters(
+            [(rule.get("filters") or {}).get("issue") for rule in rules if rule["name"] in predicates]
+        )
+        listed_issues = [issue for page in self.iter_issue_pages(union_filters, max_pages=0) for issue in page]
+        issues_by_rule = {
+            name: [issue for issue in listed_issues if predicate(issue)] for name, predicate in predicates.items()
+        }
+        matched_issues = {issue["id"]: issue for issues in issues_by_rule.values() for issue in issues}
+        self.logger.info(
+            f"Issues to process: {len(matched_issues)} of {len(listed_issues)} listed for {len(predicates)} rules"
+        )
+        return {name: [dict(issue) for issue in issues] for name, issues in issues_by_rule.items()}
+
+    def enrich(self, issues):
+        """Enrich issues with their asset, last finding and CVE details.
+
+        Issues enriched before in this run, and not seen again by Halo since,
+        get their memoized enrichment without any Halo call.
+        """
+        missed_issues = self.recall_enrichment(issues)
+        if missed_issues:
+            self.get_asset_and_findings(missed_issues)
+            self.get_cve_details(missed_issues)
+            self.remember_enrichment(missed_issues)
+        return issues
+
+    @staticmethod
+    def get_enrichment_key(issue):
+        return issue["id"], issue.get("last_seen_at")
+
+    def recall_enrichment(self, issues):
+        """Enrich issues from the run's memo, and return the issues missing from it."""
+        missed_issues = []
+        for issue in issues:
+            enrichment = self.enrichment_memo.get(self.get_enrichment_key(issue))
+            if enrichment is None:
+                missed_issues.append(issue)
+            else:
+                issue.update(enrichment)
+        return missed_issues
+
+    def remember_enrichment(self, issues):
+        """Memoize the enrichment of issues for the run, unless their asset couldn't be described."""
+        for issue in issues:
+            if issue.get("asset") is not None:
+                self.enrichment_memo[self.get_enrichment_key(issue)] = {
+                    "asset": issue["asset"],
+                    "findings": issue.get("findings"),
+                    "extended_attributes": issue.get("extended_attributes")
+                }
+
+    def release(self, issues):
+        """Forget the findings and enrichments of issues, once they are reconciled or stored.
+
+        Assets are kept in the describe cache since they are shared between issues.
+        """
+        self.describe_cache.discard([issue["last_finding_urls"][-1] for issue in issues
+                                     if issue.get("last_finding_urls")])
+        for issue in issues:
+            self.enrichment_memo.pop(self.get_enrichment_key(issue), None)
+
+    def enrich_to_store(self, issues, issue_store, chunk_size=500, enrich=None):
+        """Enrich issues chunk by chunk into a jlib.IssueStore(), and return the store.
+
+        Enriched chunks are released once stored, from memory and from the
+        run-scoped caches. Chunks go through enrich, self.enrich() if None.
+        """
+        for start in range(0, len(issues), chunk_size):
+            chunk = (enrich or self.enrich)(issues[start:start + chunk_size])
+            issue_store.extend(chunk)
+            self.release(chunk)
+            issues[start:start + chunk_size] = [None] * len(chunk)
+        return issue_store
+
+    def list_issues(self, issue_filters, partitions=None):
+        """Return list of issues matching filters.
+
+        If partitions are given, each one is merged into the filters and the
+        partitions are paged concurrently. Results are de-duplicated by ID, so
+        partitions may overlap, but together they must cover every issue.
+
+        Args:
+            issue_filters (dict): Halo issue filters.
+            partitions (list): List of dicts of additional issue filters.
+
+        Returns:
+            list: List of dictionary objects describing issues.
+        """
+        if not partitions:
+            return self.issue.list_all(**self.format_issue_filters(issue_filters))
+        issues = {}
+        with ThreadPoolExecutor(max_workers=self.scheduler.max_concurrency) as executor:
+            futures = [
+                executor.submit(self.issue.list_all, **self.format_issue_filters(
+                    self.merge_partition(issue_filters, partition)
+                ))
+                for partition in partitions
+            ]
+            for future in as_completed(futures):
+                for issue in future.result():
+                    issues[issue["id"]] = issue
+        self.logger.info(f"Listed {len(issues)} issues from {len(partitions)} partitions")
+        return list(issues.values())
+
+    @staticmethod
+    def merge_partition(issue_filters, partition):
+        """Return issue filters narrowed to a partition.
+
+        Raises:
+            ValueError: If the partition sets a filter which issue_filters
+                sets already, since it would replace the rule's own filter.
+        """
+        overlap = set(issue_filters) & set(partition)
+        if overlap:
+            raise ValueError(f"Partition overrides issue filters: {', '.join(sorted(overlap))}")
+        return dict(issue_filters, **partition)
+
+    def iter_issue_pages(self, issue_filters, partitions=None, max_pages=None):
+        """Yield pages of issues matching filters, as they are listed.
+
+        Partitions are listed one after the other, and issues already yielded
+        for an earlier partition are left out of later pages.
+
+        Args:
+            max_pages (int): Pages listed per partition, cls.max_pages by
+                default. 0 lists every page.
+        """
+        max_pages = self.max_pages if max_pages is None else max_pages
+        seen_ids = set()
+        for partition in partitions or [{}]:
+            params = Utility.sanitize_url_params(
+                self.format_issue_filters(self.merge_partition(issue_filters, partition))
+            )
+            page = self.http_helper.get(self.issue.endpoint(), params=params)
+            pages_parsed = 1
+            while True:
+                issues, next_page = self.http_helper.process_page(page, self.issue.objects_name)
+                issues = [issue for issue in issues if issue["id"] not in seen_ids]
+                seen_ids.update(issue["id"] for issue in issues)
+                if issues:
+                    yield issues
+                if next_page is None or (max_pages and pages_parsed >= max_pages):
+                    break
+                page = self.http_helper.get(next_page)
+                pages_parsed += 1
+
+    @staticmethod
+    def format_issue_filters(issue_filters):
+        """Return issue filters formatted as query parameters for the Halo API."""
+        issue_filters = dict(issue_filters)
+        if "csp_tags" in issue_filters and not isinstance(issue_filters["csp_tags"], str):
+            csp_tags = issue_filters["csp_tags"]
+            csp_tags_formatted = re.sub('[{}]', '', json.dumps(csp_tags).replace(' ', ''))
+            issue_filters["csp_tags"] = csp_tags_formatted
+        return issue_filters
+
     def get_asset_and_findings(self, issues):
-        with ThreadPoolExecutor(max_workers=os.cpu_count() * 2) as executor:
-            asset_future_to_issue = {
-                executor.submit(self.describe, issue["asset_url"]): issue for issue in issues
+        """Enrich issues with their asset and last finding.
+
+        Each distinct URL is described once, however many issues refer to it.
+        """
+        asset_url_to_issues, finding_url_to_issues = self.group_issues_by_url(issues)
+        with ThreadPoolExecutor(max_workers=self.scheduler.max_concurrency) as executor:
+            asset_future_to_issues = {
+                executor.submit(self.describe_cached, url, self.asset_cache): url_issues
+                for url, url_issues in asset_url_to_issues.items()
             }
-            findings_future_to_issue = {
-                executor.submit(self.describe, issue["last_finding_urls"][-1]):
-                    issue for issue in issues if "last_finding_urls" in issue
+            findings_future_to_issues = {
+                executor.submit(self.describe_cached, url): url_issues
+                for url, url_issues in finding_url_to_issues.items()
             }
-            self.enrich_issues(asset_future_to_issue, 'asset')
-            self.enrich_issues(findings_future_to_issue, 'findings')
-            return issues
+            self.enrich_issues(asset_future_to_issues, 'asset')
+            self.enrich_issues(findings_future_to_issues, 'findings')
+        self.evict_describe_caches()
+        return issues
+
+    def evict_describe_caches(self):
+        """Drop expired described assets and response bodies, so the disk caches don't grow over runs."""
+        for disk_cache in (self.asset_cache, self.describe_body_cache):
+            if disk_cache:
+                disk_cache.evict()
+
+    @staticmethod
+    def group_issues_by_url(issues):
+        """Return dicts of asset URL and last finding URL to the issues referring to them."""
+        asset_url_to_issues = defaultdict(list)
+        finding_url_to_issues = defaultdict(list)
+        for issue in issues:
+            asset_url_to_issues[issue["asset_url"]].append(issue)
+            if "last_finding_urls" in issue:
+                finding_url_to_issues[issue["last_finding_urls"][-1]].append(issue)
+        return asset_url_to_issues, finding_url_to_issues
 
     def get_cve_details(self, issues):
-        with ThreadPoolExecutor(max_workers=os.cpu_count() * 2) as executor:
-            cve_ids = set(cve for issue in issues for cve in issue.get("cve_ids", []))
-            cve_future_to_cve = {executor.submit(self.cve_detail.describe, cve_id): cve_id for cve_id in cve_ids}
-            cve_dict = self.get_cve_dict(cve_future_to_cve)
-            pprint(cve_dict)
-            for issue in issues:
-                if issue["extended_attributes"] and "cve_info" in issue["extended_attributes"]:
-                    for cve in issue["extended_attributes"]["cve_info"]:
-                        try:
-                            del cve_dict[cve["id"]]["Vulnerable packages"]
-                        except KeyError:
-                            pass
-                        cve["detail"] = cve_dict[cve["id"]]
-            return issues
+        """Enrich the CVE info of issues with CVE details.
+
+        If the persistent CVE cache is enabled, only CVEs which are missing
+        from it or expired are described.
+        """
+        cve_ids = set(cve for issue in issues for cve in issue.get("cve_ids", []))
+        cve_dict = self.get_cached_cve_dict(cve_ids)
+        with ThreadPoolExecutor(max_workers=self.scheduler.max_concurrency) as executor:
+            cve_future_to_cve = {
+                executor.submit(self.cve_detail.describe, cve_id): cve_id for cve_id in cve_ids - set(cve_dict)
+            }
+            fetched_cve_dict = self.get_cve_dict(cve_future_to_cve)
+        self.cache_cve_dict(fetched_cve_dict)
+        cve_dict.update(fetched_cve_dict)
+        return self.attach_cve_details(issues, cve_dict)
+
+    @staticmethod
+    def attach_cve_details(issues, cve_dict):
+        for issue in issues:
+            if issue["extended_attributes"] and "cve_info" in issue["extended_attributes"]:
+                for cve in issue["extended_attributes"]["cve_info"]:
+                    cve["detail"] = cve_dict.get(cve["id"])
+        return issues
+
+    def get_cached_cve_dict(self, cve_ids):
+        cve_dict = {}
+        if not self.cve_cache:
+            return cve_dict
+        for cve_id in cve_ids:
+            cve_detail = self.cve_cache.get(cve_id)
+            if cve_detail is not None:
+                cve_dict[cve_id] = cve_detail
+        self.logger.info(f"CVE details cached: {len(cve_dict)}/{len(cve_ids)}")
+        return cve_dict
+
+    def cache_cve_dict(self, cve_dict):
+        for cve_detail in cve_dict.values():
+            cve_detail.pop("Vulnerable packages", None)
+        if not self.cve_cache or not cve_dict:
+            return
+        for cve_id, cve_detail in cve_dict.items():
+            self.cve_cache.set(cve_id, cve_detail)
+        self.cve_cache.evict()
 
     def get_cve_dict(self, cve_future_to_cve):
         cve_dict = {}
@@ -91,34 +375,95 @@ class Halo(object):
                 self.logger.error(f"{cve_id} generated an exception: {e}")
         return cve_dict
 
-    def enrich_issues(self, future_to_issue, type):
-        for future in as_completed(future_to_issue):
-            issue = future_to_issue[future]
+    def enrich_issues(self, future_to_issues, type):
+        for future in as_completed(future_to_issues):
+            issues = future_to_issues[future]
+            data = None
             try:
                 data = future.result()
             except Exception as e:
-                self.logger.error(f"{issue['asset_url']} generated an exception: {e}")
-            issue[type] = data
+                self.logger.error(f"{issues[0]['asset_url']} generated an exception: {e}")
+            for issue in issues:
+                issue[type] = data
+
+    def describe_cached(self, url, disk_cache=None):
+        """Describe url once per run, sharing in-flight requests for it.
+
+        If a disk cache is given, it is consulted before Halo and filled after.
+        """
+        return self.describe_cache.get(url, self.describe_through_cache, url, disk_cache)
+
+    def describe_through_cache(self, url, disk_cache):
+        if disk_cache:
+            described = disk_cache.get(url)
+            if described is not None:
+                return described
+        described = self.describe(url)
+        if disk_cache and described is not None:
+            disk_cache.set(url, described)
+        return described
 
     def describe(self, url):
         """Get full json description of asset or finding."""
-        try:
-            short_url = '/' + url.split('/', 3)[-1]
-            object_type = url.split('/')[-2][:-1]
-        except IndexError:
+        short_url, object_type = self.parse_object_url(url)
+        if not short_url:
             self.logger.error("Invalid URL:" + url)
             return None
 
         try:
-            response = self.http_helper.get(short_url)
+            if self.describe_body_cache:
+                response = self.get_conditional(short_url)
+            else:
+                response = self.http_helper.get(short_url)
         except cloudpassage.exceptions.CloudPassageBaseException:
             self.logger.error("Invalid URL: " + url)
-            pass
+            return None
         if object_type in response:
             return response[object_type]
         else:
             return response
 
+    @staticmethod
+    def parse_object_url(url):
+        """Return the endpoint of an asset or finding URL, and the type of object it returns."""
+        try:
+            short_url = '/' + url.split('/', 3)[-1]
+            object_type = url.split('/')[-2][:-1]
+        except IndexError:
+            return None, None
+        return short_url, object_type
+
+    def get_conditional(self, endpoint):
+        """GET endpoint, revalidating a previously cached body with ETag/Last-Modified.
+
+        A 304 response reuses the cached body. Authentication and error
+        handling follow cloudpassage.HaloSession.interact().
+        """
+        cached = self.describe_body_cache.get(endpoint)
+        headers = {}
+        if cached and cached.get("etag"):
+            headers["If-None-Match"] = cached["etag"]
+        if cached and cached.get("last_modified"):
+            headers["If-Modified-Since"] = cached["last_modified"]
+        if self.session.auth_token is None:
+            self.session.authenticate_client()
+        url = self.session.build_endpoint_prefix() + endpoint
+        response = self.session.client.get(url, headers=headers)
+        if response.status_code == 401:
+            self.session.authenticate_client()
+            response = self.session.client.get(url, headers=headers)
+        if response.status_code == 304 and cached:
+            return cached["body"]
+        success, exception = Utility.parse_status(url, response.status_code, response.text)
+        if not success:
+            raise exception
+        body = response.json()
+        etag = response.headers.get("ETag")
+        last_modified = response.headers.get("Last-Modified")
+        if etag or last_modified:
+            self.describe_body_cache.set(endpoint, {"etag": etag, "last_modified": last_modified, "body": body})
+        return body
+
     def get_integration_string(self):
         """Return integration string for this tool."""
         return "Jira-Halo-Issues-Sync/%s" % self.get_tool_version()
@@ -0,0 +1,67 @@
+"""Append-only on-disk store of enriched Halo issues."""
+import json
+import os
+import tempfile
+import threading
+from array import array
+
+
+class IssueStore(object):
+    """List-like store of issues, kept as JSON lines in a segment file.
+
+    Only the byte offset of each record stays in memory. Records are read
+    back lazily, and each read returns a new dict, so readers can change
+    the issues they get without affecting each other.
+
+    Args:
+        directory (str): Directory holding the segment file, which is
+            removed when the store is closed.
+    """
+
+    def __init__(self, directory):
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        fd, self.path = tempfile.mkstemp(dir=directory, prefix="issues-", suffix=".jsonl")
+        self.file = os.fdopen(fd, "w+b")
+        self.offsets = array("Q")
+        self.end = 0
+        self.lock = threading.Lock()
+
+    def append(self, issue):
+        record = json.dumps(issue, separators=(",", ":")).encode() + b"\n"
+        with self.lock:
+            self.file.seek(self.end)
+            self.file.write(record)
+            self.offsets.append(self.end)
+            self.end += len(record)
+
+    def extend(self, issues):
+        for issue in issues:
+            self.append(issue)
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __getitem__(self, index):
+        with self.lock:
+            self.file.seek(self.offsets[index])
+            return json.loads(self.file.readline())
+
+    def __iter__(self):
+        for batch in self.iter_batches():
+            yield from batch
+
+    def iter_batches(self, batch_size=500):
+        """Yield lists of up to batch_size issues, read in order."""
+        for start in range(0, len(self), batch_size):
+            count = min(batch_size, len(self) - start)
+            with self.lock:
+                self.file.seek(self.offsets[start])
+                lines = [self.file.readline() for _ in range(count)]
+            yield [json.loads(line) for line in lines]
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+            if os.path.exists(self.path):
+                os.remove(self.path)
@@ -1,26 +1,114 @@
-from jira import JIRA
 from jira.exceptions import JIRAError
-import os
+from requests.exceptions import RequestException
 from concurrent.futures import ThreadPoolExecutor, as_completed
-from collections import defaultdict
+from collections import defaultdict, namedtuple
+from types import MappingProxyType
+import gzip
+import hashlib
+import io
+import json
 
+from jlib.clients import ClientRegistry
 from jlib.logger import Logger
-from jlib.mapper import map_fields
+from jlib.lookup import get_lookup_strategy
+from jlib.mapper import map_fields, diff_fields
 from jlib.formatter import Formatter
+from jlib.scheduler import Scheduler
+
+
+class PreparedIssue(namedtuple("PreparedIssue", ["issue", "fields", "payload_hash", "groupby_key", "attachment"],
+                               defaults=["", None])):
+    """A Halo issue rendered once into the Jira fields kept in sync with it.
+
+    Shared by all the projects of a rule, so `issue`, the Halo issue without
+    its asset and findings, and `fields` are read-only mappings. `attachment`
+    is the (file name, content) pair of the gzipped asset and findings, if
+    they are attached rather than described. `fields` and `payload_hash`
+    are None if the issue's status alone changed.
+    """
+    __slots__ = ()
 
 
 class JiraLocal(object):
-    def __init__(self, jira_url, auth_user, auth_token, rule, jira_fields_dict):
-        self.jira_instance = JIRA(jira_url, basic_auth=(auth_user, auth_token))
+    # Jira's bulk-create endpoint accepts up to 50 issues per request.
+    max_bulk_create_size = 50
+
+    def __init__(self, jira_url, auth_user, auth_token, rule, jira_fields_dict, state_store=None):
+        self.jira_instance = ClientRegistry.get_jira(jira_url, auth_user, auth_token)
+        self.scheduler = Scheduler.get("jira")
+        self.state_store = state_store
         self.jira_config = rule['jira_config']
         self.jira_fields_dict = jira_fields_dict
         self.jira_issue_id_field_key = jira_fields_dict[rule['jira_config']["jira_issue_id_field"]]
+        self.lookup = get_lookup_strategy(self.jira_config, jira_fields_dict)
+        self.lookup_mode = self.jira_config.get("lookup_mode", "bulk")
+        self.lookup_page_size = int(self.jira_config.get("lookup_page_size", 100))
+        self.update_mode = self.jira_config.get("update_mode", "full")
+        bulk_create_size = int(self.jira_config.get("bulk_create_size", self.max_bulk_create_size))
+        self.bulk_create_size = max(1, min(self.max_bulk_create_size, bulk_create_size))
+        self.payload_profile = Formatter.get_payload_profile(self.jira_config.get("payload_profile", "full")) or {}
+        self.attach_details = str(self.jira_config.get("attach_details", False)).lower() == "true"
+        if self.attach_details:
+            # The attachment holds the details, so descriptions keep the core fields unless the profile says otherwise.
+            self.payload_profile = dict(Formatter.payload_profiles["core"], **self.payload_profile)
+        self.status_fast_path = str(self.jira_config.get("status_fast_path", False)).lower() == "true"
+        self.pushed_payload_hashes = {}
+        self.index_fields = self.get_index_fields(rule.get("fields") or {})
         self.log = Logger(rule=rule)
         return
 
-    def get_jira_issues(self, project_key, halo_issues):
+    def get_index_fields(self, fields):
+        """Return the Jira fields the bulk issue index fetches.
+
+        These are the fields read by lookups, transitions and the state store.
+        In diff mode, the fields sent by updates are fetched too, to be
+        compared with what they would send.
+
+        Args:
+            fields (dict): Fields block of the routing rule.
+        """
+        index_fields = self.lookup.index_fields() + ["project", "status", self.jira_fields_dict["Epic Link"]]
+        if self.update_mode == "diff":
+            mapped_names = list(fields.get("static") or {}) + list((fields.get("mapping") or {}).values())
+            index_fields += ["summary", "description"] + [self.jira_fields_dict[name] for name in mapped_names]
+        return index_fields
+
+    def get_jira_issues(self, project_key, halo_issues, cache=None):
+        """Return dict of Halo issue ID to matching Jira issues in a project.
+
+        Jira keys already known to the state store are fetched directly; only
+        the remaining Halo issues go through the configured lookup.
+
+        Args:
+            project_key (str): Jira project key.
+            halo_issues (list): Halo issues to look up.
+            cache (dict): Kept across calls for the same project, so batches
+                of issues share one bulk Jira issue index.
+        """
+        jira_issues_dict = {}
+        if self.state_store:
+            issue_states = self.state_store.get_issue_states(
+                project_key, [issue["id"] for issue in halo_issues])
+            known_keys = {
+                issue["id"]: [state["jira_key"] for state in issue_states[issue["id"]]]
+                for issue in halo_issues if issue["id"] in issue_states
+            }
+            jira_issues_dict = self.get_jira_issues_by_key(project_key, known_keys)
+            halo_issues = [issue for issue in halo_issues if not jira_issues_dict.get(issue["id"])]
+            if not halo_issues:
+                return jira_issues_dict
+        jira_issues_dict.update(self.lookup_jira_issues(project_key, halo_issues, cache))
+        return jira_issues_dict
+
+    def lookup_jira_issues(self, project_key, halo_issues, cache=None):
+        if self.lookup_mode == "bulk":
+            cache = {} if cache is None else cache
+            if "jira_issue_index" not in cache:
+                cache["jira_issue_index"] = self.get_jira_issue_index(project_key)
+            jira_issue_index = cache["jira_issue_index"]
+            return {issue["id"]: jira_issue_index.get(issue["id"], []) for issue in halo_issues}
         jira_issues_dict = {}
-        with ThreadPoolExecutor(max_workers=os.cpu_count()*2) as executor:
+        with ThreadPoolExecutor(max_workers=self.scheduler.max_concurrency) as executor:
             future_to_issue_id = {
                 executor.submit(
                     self.get_jira_issues_for_halo_issue, issue["id"], project_key
@@ -32,16 +120,42 @@ class JiraLocal(object):
                 jira_issues_dict[issue_id] = jira_issues
         return jira_issues_dict
 
+    def get_jira_issues_by_key(self, project_key, keys_by_issue_id):
+        """Return dict of Halo issue ID to Jira issues, fetched by Jira key in batches."""
+        issue_id_by_key = {key: issue_id for issue_id, keys in keys_by_issue_id.items() for key in keys}
+        jira_issues_dict = defaultdict(list)
+        keys = list(issue_id_by_key)
+        for i in range(0, len(keys), self.lookup_page_size):
+            batch = keys[i:i + self.lookup_page_size]
+            results = self.jira_instance.search_issues(
+                f'key in ({", ".join(batch)})', maxResults=len(batch), validate_query=False
+            )
+            for issue in results:
+                issue_id = issue_id_by_key.get(issue.key)
+                if issue_id and self.lookup.get_issue_id(issue) == issue_id:
+                    jira_issues_dict[issue_id].append(issue)
+                    del issue_id_by_key[issue.key]
+        for key in issue_id_by_key:
+            self.state_store.forget_issue(project_key, key)
+        return jira_issues_dict
+
+    def get_jira_epic_keys(self, project_key):
+        """Return dict of group key hash to the Jira key of the open epic for that group."""
+        if self.state_store:
+            epic_keys = self.state_store.get_epic_keys(project_key)
+            if epic_keys:
+                return epic_keys
+        jira_epics_dict = self.get_jira_epics_or_issues(project_key, "Epic")
+        epic_keys = {group_key_hash: epics[0].key for group_key_hash, epics in jira_epics_dict.items()}
+        if self.state_store:
+            for group_key_hash, epic_key in epic_keys.items():
+                self.state_store.record_epic(group_key_hash, project_key, epic_key)
+        return epic_keys
+
     def get_jira_epics_or_issues(self, project_keys, issuetype, dict_format=True):
-        if isinstance(project_keys, str):
-            project_keys = [project_keys]
         jira_issues_dict = defaultdict(list)
         jira_issues = self.jira_instance.search_issues(
-            f'project in ({", ".join(x for x in project_keys)}) AND '
-            f'resolution = Unresolved AND '
-            f'issuetype={issuetype} AND '
-            f'"{self.jira_config["jira_issue_id_field"]}" is not EMPTY',
-            maxResults=False
+            self.get_epics_or_issues_jql(project_keys, issuetype), maxResults=False
         )
         if not dict_format:
             return jira_issues
@@ -49,15 +163,128 @@ class JiraLocal(object):
             jira_issues_dict[issue.raw["fields"][self.jira_issue_id_field_key]].append(issue)
         return jira_issues_dict
 
+    def get_epics_or_issues_jql(self, project_keys, issuetype):
+        """Return JQL matching unresolved tracked issues of a type."""
+        if isinstance(project_keys, str):
+            project_keys = [project_keys]
+        return (
+            f'project in ({", ".join(x for x in project_keys)}) AND '
+            f'resolution = Unresolved AND '
+            f'issuetype={issuetype} AND '
+            f'"{self.jira_config["jira_issue_id_field"]}" is not EMPTY'
+        )
+
+    def get_issue_index_jql(self, project_keys):
+        """Return JQL matching every tracked issue, in a stable order for paging."""
+        if isinstance(project_keys, str):
+            project_keys = [project_keys]
+        return (
+            f'project in ({", ".join(x for x in project_keys)}) AND '
+            f'issuetype="{self.jira_config["jira_issue_type"]}" AND '
+            f'{self.lookup.tracked_clause()} '
+            f'ORDER BY key'
+        )
+
+    def add_to_issue_index(self, jira_issue_index, to_migrate, jira_issues):
+        """Index Jira issues by Halo issue ID, noting those needing migration."""
+        for issue in jira_issues:
+            halo_issue_id = self.lookup.get_issue_id(issue)
+            if halo_issue_id:
+                jira_issue_index[halo_issue_id].append(issue)
+                if self.lookup.needs_migration(issue, halo_issue_id):
+                    to_migrate.append((issue, halo_issue_id))
+
+    def get_jira_issue_index(self, project_keys):
+        """Return dict of Halo issue ID to Jira issues, built from paginated searches.
+
+        Every tracked issue in the project(s) is fetched regardless of status, so
+        closed Jira issues can still be matched and reopened.
+        """
+        if isinstance(project_keys, str):
+            project_keys = [project_keys]
+        jql = self.get_issue_index_jql(project_keys)
+        jira_issue_index = defaultdict(list)
+        to_migrate = []
+        start_at = 0
+        while True:
+            results = self.jira_instance.search_issues(
+                jql, startAt=start_at, maxResults=self.lookup_page_size, fields=self.index_fields
+            )
+            self.add_to_issue_index(jira_issue_index, to_migrate, results)
+            start_at += len(results)
+            if not results or start_at >= results.total:
+                break
+        self.log.info(f"Indexed {start_at} Jira issues in {', '.join(project_keys)}")
+        self.migrate_jira_issues(to_migrate)
+        return jira_issue_index
+
     def get_jira_issues_for_halo_issue(self, issue_id, project_key):
-        results = self.jira_instance.search_issues(
+        results = self.search_jira_issues_for_halo_issue(self.lookup.match_clause(issue_id), issue_id, project_key)
+        fallback_clause = self.lookup.fallback_clause(issue_id)
+        if not results and fallback_clause:
+            results = self.search_jira_issues_for_halo_issue(fallback_clause, issue_id, project_key)
+            self.migrate_jira_issues([(issue, issue_id) for issue in results])
+        return results
+
+    def search_jira_issues_for_halo_issue(self, clause, issue_id, project_key):
+        results = self.jira_instance.search_issues(self.get_search_jql(clause, project_key))
+        return [issue for issue in results if self.lookup.get_issue_id(issue) == issue_id]
+
+    def get_search_jql(self, clause, project_key):
+        """Return JQL matching tracked issues in a project by a lookup clause."""
+        return (
             f'project="{project_key}" AND '
-            f'"{self.jira_config["jira_issue_id_field"]}"~{issue_id} AND '
+            f'{clause} AND '
             f'issuetype="{self.jira_config["jira_issue_type"]}"'
         )
-        return results
+
+    def migrate_jira_issues(self, jira_issues_with_ids):
+        """Store Halo issue IDs where the configured lookup strategy expects them."""
+        if not jira_issues_with_ids:
+            return
+        self.log.info(f"Migrating {len(jira_issues_with_ids)} Jira issues to '{self.lookup.name}' lookup")
+        with ThreadPoolExecutor(max_workers=self.scheduler.max_concurrency) as executor:
+            future_to_key = {
+                executor.submit(self.lookup.migrate, jira_issue, issue_id): jira_issue.key
+                for jira_issue, issue_id in jira_issues_with_ids
+            }
+            for future in as_completed(future_to_key):
+                try:
+                    future.result()
+                except JIRAError as e:
+                    self.log.error(f"Could not migrate Jira Issue '{future_to_key[future]}': {e.text}")
 
     def create_jira_epic(self, group_key_hash, group_key_str, project_key):
+        epic_dict = self.get_epic_fields(group_key_hash, group_key_str, project_key)
+        epic = self.jira_instance.create_issue(fields=epic_dict)
+        if self.state_store:
+            self.state_store.record_epic(group_key_hash, project_key, epic.key)
+        return epic
+
+    def create_jira_epics(self, groups, project_key):
+        """Create epics for groups of issues in bulk, and return dict of group key hash to epic key.
+
+        Args:
+            groups (list): List of (group key hash, group key string) tuples.
+            project_key (str): Jira project key.
+        """
+        epic_keys = {}
+        for i in range(0, len(groups), self.bulk_create_size):
+            chunk = groups[i:i + self.bulk_create_size]
+            results = self.bulk_create([
+                self.get_epic_fields(group_key_hash, group_key_str, project_key)
+                for group_key_hash, group_key_str in chunk
+            ])
+            for (group_key_hash, group_key_str), (epic_key, error) in zip(chunk, results):
+                if epic_key is None:
+                    self.log.error(f"Could not bulk create epic {group_key_str}, retrying: {error}")
+                    epic_key = self.create_jira_epic(group_key_hash, group_key_str, project_key).key
+                elif self.state_store:
+                    self.state_store.record_epic(group_key_hash, project_key, epic_key)
+                epic_keys[group_key_hash] = epic_key
+        return epic_keys
+
+    def get_epic_fields(self, group_key_hash, group_key_str, project_key):
         # Get IDs for epic fields
         epic_dict = {
             'project': {'key': project_key},
@@ -67,43 +294,232 @@ class JiraLocal(object):
             'issuetype': {'name': 'Epic'},
             self.jira_issue_id_field_key: group_key_hash
         }
-        epic = self.jira_instance.create_issue(fields=epic_dict)
-        return epic
+        return epic_dict
+
+    def create_jira_issue(self, prepared, epic_link, project_key):
+        self.log.info(f"Creating issue: {prepared.issue['id']}")
+        self.create_prepared_issue(prepared, epic_link, self.get_create_fields(prepared, epic_link, project_key),
+                                   project_key)
 
-    def create_jira_issue(self, issue, epic, jira_fields_dict, fields, project_key):
-        epic_link = None
-        if epic:
-            epic_link = epic.key
+    def create_jira_issues(self, issues_with_epics, project_key):
+        """Create Jira issues with bulk-create requests of up to `bulk_create_size` issues.
 
-        summary, description, field_mapping = self.prepare_issue(issue, fields, jira_fields_dict)
+        Issues failing in a bulk request, or whose whole bulk request failed,
+        are retried one by one. A chunk raising an unexpected error is logged
+        without stopping the other chunks.
 
+        Args:
+            issues_with_epics (list): List of (jlib.PreparedIssue(), epic key) tuples.
+        """
+        to_create = [
+            (prepared, epic_link, self.get_create_fields(prepared, epic_link, project_key))
+            for prepared, epic_link in issues_with_epics
+        ]
+        chunks = [to_create[i:i + self.bulk_create_size] for i in range(0, len(to_create), self.bulk_create_size)]
+        failed = []
+        with ThreadPoolExecutor(max_workers=self.scheduler.max_concurrency) as executor:
+            future_to_chunk = {
+                executor.submit(self.create_jira_issue_chunk, chunk, project_key): chunk for chunk in chunks
+            }
+            for future in as_completed(future_to_chunk):
+                try:
+                    failed.extend(future.result())
+                except Exception as e:
+                    chunk_ids = ", ".join(prepared.issue["id"] for prepared, _, _ in future_to_chunk[future])
+                    self.log.error(f"Could not create chunk of issues {chunk_ids}: {e!r}")
+            if not failed:
+                return
+            self.log.info(f"Retrying {len(failed)} issues one by one")
+            future_to_issue_id = {
+                executor.submit(self.create_prepared_issue, prepared, epic_link, issue_dict, project_key):
+                    prepared.issue["id"]
+                for prepared, epic_link, issue_dict in failed
+            }
+            failed_ids = [issue_id for future, issue_id in future_to_issue_id.items() if not future.result()]
+        if failed_ids:
+            self.log.error(
+                f"Could not create {len(failed_ids)} of {len(failed)} retried issues: {', '.join(failed_ids)}"
+            )
+
+    def create_jira_issue_chunk(self, chunk, project_key):
+        """Create a chunk of prepared issues in one bulk request, and return those which failed."""
+        self.log.info(f"Creating {len(chunk)} issues: {', '.join(prepared.issue['id'] for prepared, _, _ in chunk)}")
+        try:
+            results = self.bulk_create([issue_dict for _, _, issue_dict in chunk])
+        except RequestException as e:
+            results = [(None, str(e))] * len(chunk)
+        failed = []
+        for (prepared, epic_link, issue_dict), (jira_key, error) in zip(chunk, results):
+            if jira_key is None:
+                self.log.error(f"Could not bulk create issue {prepared.issue['id']}: {error}")
+                failed.append((prepared, epic_link, issue_dict))
+            else:
+                self.finish_created_issue(prepared, project_key, jira_key, epic_link)
+        return failed
+
+    def create_prepared_issue(self, prepared, epic_link, issue_dict, project_key):
+        """Create the Jira issue of a prepared issue, and return True if it was created."""
+        try:
+            jira_issue = self.jira_instance.create_issue(fields=issue_dict)
+        except JIRAError as e:
+            self.log.error(f"Could not create issue {prepared.issue['id']}: {e.text}")
+            return False
+        except RequestException as e:
+            self.log.error(f"Could not create issue {prepared.issue['id']}: {e}")
+            return False
+        self.finish_created_issue(prepared, project_key, jira_issue.key, epic_link)
+        return True
+
+    def bulk_create(self, field_dicts):
+        """Create issues with one bulk-create request, and return a (Jira key, error) pair per issue."""
+        try:
+            results = self.jira_instance.create_issues(field_dicts, prefetch=False)
+        except JIRAError as e:
+            # A 400 means no issue was created, and its body still holds the per-issue errors.
+            if e.status_code == 400 and e.response is not None:
+                try:
+                    return self.parse_bulk_create_response(json.loads(e.response.text), len(field_dicts))
+                except (ValueError, KeyError):
+                    pass
+            return [(None, e.text)] * len(field_dicts)
+        return [
+            (result["issue"].key, None) if result["status"] == "Success" else (None, result["error"])
+            for result in results
+        ]
+
+    @staticmethod
+    def parse_bulk_create_response(raw_issue_json, count):
+        """Return a (Jira key, error) pair per issue sent to the bulk-create endpoint."""
+        errors = {
+            error["failedElementNumber"]: error["elementErrors"].get("errors")
+            for error in raw_issue_json.get("errors", [])
+        }
+        created = iter(raw_issue_json.get("issues", []))
+        return [(None, errors[i]) if i in errors else (next(created)["key"], None) for i in range(count)]
+
+    def get_create_fields(self, prepared, epic_link, project_key):
+        """Return the Jira fields to create a prepared issue with in a project."""
         issue_dict = {
             'project': {'key': project_key},
             'issuetype': {'name': self.jira_config['jira_issue_type']},
-            self.jira_issue_id_field_key: issue["id"],
             self.jira_fields_dict["Epic Link"]: epic_link,
-            'summary': summary,
-            'description': description
         }
 
-        issue_dict.update(field_mapping)
-        self.log.info(f"Creating issue: {issue['id']}")
-        self.jira_instance.create_issue(fields=issue_dict)
+        issue_dict.update(prepared.fields)
+        self.lookup.apply(issue_dict, prepared.issue["id"])
+        return issue_dict
+
+    def finish_created_issue(self, prepared, project_key, jira_key, epic_link):
+        """Attach the prepared issue's details to its new Jira issue, if any, and record the Jira issue."""
+        pushed = self.sync_attachment(jira_key, [], prepared) if prepared.attachment else True
+        self.record_created_issue(prepared, project_key, jira_key, epic_link, pushed)
+
+    def record_created_issue(self, prepared, project_key, jira_key, epic_link, pushed=True):
+        """Record a new Jira issue. Its payload is recorded as pushed only if pushed is True."""
+        if pushed:
+            self.pushed_payload_hashes[jira_key] = prepared.payload_hash
+        if self.state_store:
+            issue = prepared.issue
+            self.state_store.record_issue(
+                issue["id"], project_key, jira_key, epic_key=epic_link, status=issue["status"],
+                **self.get_pushed_state(prepared, pushed)
+            )
+
+    @staticmethod
+    def get_pushed_state(prepared, pushed=True):
+        """Return the state store columns recording a prepared issue as pushed, or none if it wasn't.
 
-    def update_jira_issue(self, issue, jira_issues, jira_fields_dict, fields):
-        self.log.info(f"Updating issue: {issue['id']}")
+        Leaving them out of a failed push makes the next run render and push
+        the issue again.
+        """
+        if not pushed:
+            return {}
+        return {"last_seen_at": prepared.issue.get("last_seen_at"), "payload_hash": prepared.payload_hash}
+
+    def update_jira_issue(self, prepared, jira_issues):
+        issue = prepared.issue
         for jira_issue in jira_issues:
-            summary, description, field_mapping = self.prepare_issue(issue, fields, jira_fields_dict)
-            issue_dict = {
-                'summary': summary,
-                'description': description
-            }
-            issue_dict.update(field_mapping)
+            pushed = True
+            if prepared.fields is None:
+                self.log.debug(f"Only transitioning issue: {issue['id']} ({jira_issue.key})")
+            elif prepared.payload_hash == self.get_last_payload_hash(jira_issue, issue["id"]):
+                self.log.debug(f"Skipping unchanged issue: {issue['id']} ({jira_issue.key})")
+            else:
+                self.push_update(jira_issue, issue["id"], dict(prepared.fields))
+                if prepared.attachment:
+                    pushed = self.sync_attachment(jira_issue.key, self.get_attachments(jira_issue), prepared)
+                if pushed:
+                    self.pushed_payload_hashes[jira_issue.key] = prepared.payload_hash
+            transition_name = self.get_transition_name(issue, jira_issue)
+            if transition_name:
+                self.transition_issue(jira_issue, transition_name)
+            self.record_jira_issue(jira_issue, issue["id"], status=issue["status"],
+                                   **self.get_pushed_state(prepared, pushed))
+
+    def get_transition_name(self, issue, jira_issue):
+        """Return the transition bringing the Jira issue in line with the Halo status, if any."""
+        jira_status = jira_issue.raw["fields"]["status"]["name"]
+        if issue["status"] == "resolved":
+            if jira_status != self.jira_config["issue_status_closed"]:
+                return self.jira_config["issue_status_closed"]
+        elif jira_status == self.jira_config["issue_status_closed"]:
+            return self.jira_config["issue_status_reopened"]
+        return None
+
+    def push_update(self, jira_issue, issue_id, issue_dict):
+        """Update a Jira issue, sending only changed fields when update_mode is "diff"."""
+        issue_dict = self.get_changed_fields(jira_issue, issue_id, issue_dict)
+        if issue_dict:
+            self.log.info(f"Updating issue: {issue_id} ({', '.join(sorted(issue_dict))})")
             jira_issue.update(fields=issue_dict)
-            if issue["status"] == "resolved":
-                self.transition_issue(jira_issue, self.jira_config["issue_status_closed"])
-            elif jira_issue.raw["fields"]["status"]["name"] == self.jira_config["issue_status_closed"]:
-                self.transition_issue(jira_issue, self.jira_config["issue_status_reopened"])
+
+    def get_changed_fields(self, jira_issue, issue_id, issue_dict):
+        """Return the fields an update should send; all of them unless update_mode is "diff"."""
+        if self.update_mode == "diff":
+            issue_dict = diff_fields(issue_dict, jira_issue.raw["fields"])
+            if not issue_dict:
+                self.log.debug(f"Skipping issue already up to date: {issue_id} ({jira_issue.key})")
+        return issue_dict
+
+    def get_update_fields(self, issue, fields, jira_fields_dict, attachment=None):
+        """Return the Jira fields kept in sync with the Halo issue."""
+        summary, description, field_mapping = self.prepare_issue(issue, fields, jira_fields_dict, attachment)
+        issue_dict = {
+            'summary': summary,
+            'description': description
+        }
+        issue_dict.update(field_mapping)
+        self.lookup.guard(issue_dict, issue["id"])
+        return issue_dict
+
+    def get_last_payload_hash(self, jira_issue, issue_id):
+        """Return the hash of the payload last pushed to a Jira issue, if known."""
+        if jira_issue.key in self.pushed_payload_hashes:
+            return self.pushed_payload_hashes[jira_issue.key]
+        if not self.state_store:
+            return None
+        issue_state = self.state_store.get_issue_state(
+            issue_id, jira_issue.raw["fields"]["project"]["key"], jira_issue.key
+        )
+        return issue_state["payload_hash"] if issue_state else None
+
+    @staticmethod
+    def get_payload_hash(issue_dict):
+        """Return a fingerprint of a Jira fields dict."""
+        payload = json.dumps(issue_dict, sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def record_jira_issue(self, jira_issue, issue_id, **kwargs):
+        """Record a Jira issue, and the epic it is linked to, in the state store."""
+        if not self.state_store:
+            return
+        self.state_store.record_issue(
+            issue_id,
+            jira_issue.raw["fields"]["project"]["key"],
+            jira_issue.key,
+            epic_key=jira_issue.raw["fields"].get(self.jira_fields_dict["Epic Link"]),
+            **kwargs
+        )
 
     def transition_issue(self, issue, transition_name):
         self.log.info(f"Transitioning issue {issue.key} to {transition_name}")
@@ -116,40 +532,249 @@ class JiraLocal(object):
                 f"from {issue.raw['fields']['status']['name']} to {transition_name}"
             )
 
-    def prepare_issue(self, issue, fields, jira_fields_dict):
-        asset_formatted = Formatter.format_object(issue["asset_type"], issue.pop("asset"))
-        finding_formatted = Formatter.format_object("findings", issue.pop("findings"))
-        issue_formatted = Formatter.format_object("issue", issue)
+    def get_changed_issues(self, halo_issues, project_keys):
+        """Return the Halo issues whose content may have changed since they were last pushed.
+
+        This is judged from the listed issues against the state store alone,
+        so it runs before issues are enriched or looked up in Jira. An issue
+        is left out if every project has stored Jira issues for it, all
+        pushed with its current last_seen_at. Without `status_fast_path` and
+        the state store, every issue is returned.
 
+        Args:
+            halo_issues (list): Listed Halo issues.
+            project_keys (list): Jira project keys of the rule.
+        """
+        if not (self.status_fast_path and self.state_store):
+            return halo_issues
+        issue_ids = [issue["id"] for issue in halo_issues]
+        issue_states_dicts = [self.state_store.get_issue_states(project_key, issue_ids) for project_key in project_keys]
+        return [issue for issue in halo_issues
+                if not all(self.is_pushed(issue, issue_states.get(issue["id"])) for issue_states in issue_states_dicts)]
+
+    @staticmethod
+    def is_pushed(issue, issue_states):
+        """Return True if stored Jira issue states exist for a Halo issue, all pushed with its last_seen_at."""
+        return bool(issue_states) and all(
+            issue_state["payload_hash"] and issue_state["last_seen_at"] == issue.get("last_seen_at")
+            for issue_state in issue_states
+        )
+
+    def classify_change(self, issue, jira_issues_lists):
+        """Return how a Halo issue changed since it was last pushed: "content", "status" or "unchanged".
+
+        Without `status_fast_path` and the state store, every issue is
+        deemed to have changed content. Otherwise, if every project has Jira
+        issues for the Halo issue, all pushed with its current last_seen_at,
+        its content didn't change. Its status did if a Jira issue needs a
+        transition, or if the state store recorded another status.
+
+        The issue needn't be enriched; see get_changed_issues().
+
+        Args:
+            issue (dict): Halo issue.
+            jira_issues_lists (list): Jira issues of the Halo issue, in
+                each project.
+        """
+        if not (self.status_fast_path and self.state_store and jira_issues_lists):
+            return "content"
+        change = "unchanged"
+        for jira_issues in jira_issues_lists:
+            if not jira_issues:
+                return "content"
+            for jira_issue in jira_issues:
+                issue_state = self.state_store.get_issue_state(
+                    issue["id"], jira_issue.raw["fields"]["project"]["key"], jira_issue.key
+                )
+                if not (issue_state and self.is_pushed(issue, [issue_state])):
+                    return "content"
+                if issue_state["status"] != issue["status"] or self.get_transition_name(issue, jira_issue):
+                    change = "status"
+        return change
+
+    def prepare_change(self, issue, fields, jira_fields_dict, change, groupby_key=""):
+        """Return a jlib.PreparedIssue() for a Halo issue, or None if it didn't change.
+
+        Issues whose status alone changed are not rendered: their prepared
+        issue has no fields, so only their Jira issues' status is synced.
+        Issues whose content changed must be enriched.
+
+        Args:
+            change (str): How the issue changed, see classify_change().
+        """
+        if change == "unchanged":
+            return None
+        if change == "status":
+            return PreparedIssue(MappingProxyType(self.get_issue_fields(issue)), None, None, groupby_key)
+        return self.render_issue(issue, fields, jira_fields_dict, groupby_key)
+
+    def render_issue(self, issue, fields, jira_fields_dict, groupby_key=""):
+        """Render a Halo issue once into a jlib.PreparedIssue(), for every project of the rule."""
+        attachment = self.get_attachment(issue) if self.attach_details else None
+        update_dict = self.get_update_fields(issue, fields, jira_fields_dict, attachment)
+        return PreparedIssue(
+            MappingProxyType(self.get_issue_fields(issue)),
+            MappingProxyType(update_dict),
+            self.get_payload_hash(update_dict),
+            groupby_key,
+            attachment
+        )
+
+    @staticmethod
+    def get_issue_fields(issue):
+        """Return the Halo issue without the asset and findings it was enriched with."""
+        return {k: v for k, v in issue.items() if k not in ("asset", "findings")}
+
+    def prepare_issue(self, issue, fields, jira_fields_dict, attachment=None):
+        """Return the summary, description and mapped fields of a Halo issue, leaving the issue unchanged.
+
+        If an attachment is given, the description links to it instead of
+        describing the findings, and keeps only the core issue and asset
+        fields unless the payload profile lists them.
+        """
+        issue_fields = self.get_issue_fields(issue)
         summary = Formatter.format_summary(issue)
-        description = issue_formatted + asset_formatted + finding_formatted
-        description = description[:32759] + '{code}\n\n'
+        objects = [
+            ("issue", Formatter.project(issue_fields, self.payload_profile.get("issue"))),
+            (issue["asset_type"], Formatter.project(issue.get("asset"), self.payload_profile.get("asset")))
+        ]
+        if attachment:
+            attachment_link = Formatter.format_attachment_link(attachment[0])
+            description = attachment_link + Formatter.format_description(
+                objects, Formatter.max_description_length - len(attachment_link)
+            )
+        else:
+            objects.append(("findings", Formatter.project(issue.get("findings"), self.payload_profile.get("findings"))))
+            description = Formatter.format_description(objects)
 
         dynamic_map = fields.get("mapping") or {}
         static = fields.get("static") or {}
-        field_mapping = map_fields(dynamic_map, static, issue, jira_fields_dict)
+        field_mapping = map_fields(dynamic_map, static, issue_fields, jira_fields_dict)
 
         return summary, description, field_mapping
 
-    def push_issues(self, issues, jira_epics_dict, jira_issues_dict, jira_fields_dict, fields, project_key=None):
-        with ThreadPoolExecutor(max_workers=os.cpu_count() * 2) as executor:
-            for issue in issues:
-                jira_issues = jira_issues_dict.get(issue["id"])
+    @staticmethod
+    def get_attachment(issue):
+        """Return the file name and gzipped content of the issue's full asset, findings and CVE details JSON.
+
+        The file name carries a hash of the content, so a Jira issue already
+        holding it needs no upload.
+        """
+        content = json.dumps({"asset": issue.get("asset"), "findings": issue.get("findings"),
+                              "extended_attributes": issue.get("extended_attributes")},
+                             sort_keys=True, indent=2).encode()
+        content_hash = hashlib.sha256(content).hexdigest()[:16]
+        return f"halo-{issue['id']}-{content_hash}.json.gz", gzip.compress(content, mtime=0)
+
+    def get_attachments(self, jira_issue):
+        """Return the attachments of a Jira issue, fetching them if the issue was found without."""
+        attachments = jira_issue.raw["fields"].get("attachment")
+        if attachments is None:
+            attachments = self.jira_instance.issue(jira_issue.key, fields="attachment").raw["fields"]["attachment"]
+        return attachments
+
+    def sync_attachment(self, jira_key, attachments, prepared):
+        """Attach the prepared issue's asset and findings unless the Jira issue has them already.
+
+        Attachments replaced by the upload are deleted.
+
+        Args:
+            jira_key (str): Key of the Jira issue.
+            attachments (list): Raw attachments of the Jira issue.
+            prepared (obj): jlib.PreparedIssue() with an attachment.
+
+        Returns:
+            bool: True if the Jira issue has the attachment.
+        """
+        filename, content = prepared.attachment
+        if any(attachment["filename"] == filename for attachment in attachments):
+            return True
+        prefix = f"halo-{prepared.issue['id']}-"
+        try:
+            self.log.info(f"Attaching {filename} to {jira_key}")
+            self.jira_instance.add_attachment(jira_key, attachment=io.BytesIO(content), filename=filename)
+        except JIRAError as e:
+            self.log.error(f"Could not attach {filename} to {jira_key}: {e.text}")
+            return False
+        for attachment in attachments:
+            if attachment["filename"].startswith(prefix) and attachment["filename"].endswith(".json.gz"):
+                try:
+                    self.jira_instance.delete_attachment(attachment["id"])
+                except JIRAError as e:
+                    self.log.error(f"Could not delete {attachment['filename']} from {jira_key}: {e.text}")
+        return True
+
+    def push_issues(self, prepared_issues, jira_epics_dict, jira_issues_dict, project_key=None):
+        """Update or create the Jira issues of prepared issues in a project.
+
+        Args:
+            prepared_issues (list): jlib.PreparedIssue() objects, left unchanged.
+            jira_epics_dict (dict): Group key hash to epic key.
+            jira_issues_dict (dict): Halo issue ID to matching Jira issues.
+            project_key (str): Jira project key, needed to create issues.
+        """
+        issues_with_epics = []
+        with ThreadPoolExecutor(max_workers=self.scheduler.max_concurrency) as executor:
+            for prepared in prepared_issues:
+                jira_issues = jira_issues_dict.get(prepared.issue["id"])
                 if jira_issues:
-                    executor.submit(self.update_jira_issue, issue, jira_issues, jira_fields_dict, fields)
+                    executor.submit(self.update_jira_issue, prepared, jira_issues)
                 else:
-                    groupby_key = issue.pop("groupby_key", "")
-                    epic = jira_epics_dict.get(groupby_key)
-                    executor.submit(self.create_jira_issue, issue, epic, jira_fields_dict, fields, project_key)
+                    issues_with_epics.append((prepared, jira_epics_dict.get(prepared.groupby_key)))
+            if issues_with_epics:
+                self.create_jira_issues(issues_with_epics, project_key)
 
     def cleanup_epics(self, project_keys):
+        if self.state_store:
+            return self.cleanup_epics_from_state(project_keys)
         jira_issues = self.get_jira_epics_or_issues(
             project_keys, self.jira_config["jira_issue_type"], dict_format=False)
         epics_set = set(issue.raw["fields"][self.jira_fields_dict["Epic Link"]] for issue in jira_issues)
         jira_epics = self.get_jira_epics_or_issues(project_keys, "Epic", dict_format=False)
 
-        with ThreadPoolExecutor(max_workers=os.cpu_count() * 2) as executor:
+        with ThreadPoolExecutor(max_workers=self.scheduler.max_concurrency) as executor:
             for epic in jira_epics:
                 if epic.key not in epics_set:
                     self.log.info(f"Deleting epic: {epic.key}")
                     executor.submit(self.transition_issue, epic, self.jira_config["issue_status_closed"])
+
+    def cleanup_epics_from_state(self, project_keys):
+        """Close epics which the state store shows have no unresolved issues left.
+
+        The state store may lag behind Jira, e.g. when a resolved issue was
+        reopened by hand, so epics still linked to unresolved Jira issues are
+        kept open.
+        """
+        epic_keys = self.state_store.get_unused_epic_keys(project_keys)
+        linked_epic_keys = self.get_linked_epic_keys(epic_keys)
+        with ThreadPoolExecutor(max_workers=self.scheduler.max_concurrency) as executor:
+            for epic_key in epic_keys:
+                if epic_key in linked_epic_keys:
+                    self.log.info(f"Keeping epic {epic_key}, unresolved issues are still linked to it")
+                    continue
+                executor.submit(self.close_epic, epic_key)
+
+    def get_linked_epic_keys(self, epic_keys):
+        """Return the keys, among epic_keys, of epics which unresolved Jira issues are linked to."""
+        epic_link_field = self.jira_fields_dict["Epic Link"]
+        linked_epic_keys = set()
+        for start in range(0, len(epic_keys), self.lookup_page_size):
+            # Epics deleted in Jira would fail a validated query for the whole batch.
+            jira_issues = self.jira_instance.search_issues(
+                f'"Epic Link" in ({", ".join(epic_keys[start:start + self.lookup_page_size])}) AND '
+                f'resolution = Unresolved',
+                fields=[epic_link_field], maxResults=False, validate_query=False
+            )
+            linked_epic_keys.update(issue.raw["fields"].get(epic_link_field) for issue in jira_issues)
+        return linked_epic_keys
+
+    def close_epic(self, epic_key):
+        self.log.info(f"Deleting epic: {epic_key}")
+        try:
+            epic = self.jira_instance.issue(epic_key)
+        except JIRAError:
+            self.state_store.close_epic(epic_key)
+            return
+        if epic.raw["fields"]["status"]["name"] != self.jira_config["issue_status_closed"]:
+            self.transition_issue(epic, self.jira_config["issue_status_closed"])
+        self.state_store.close_epic(epic_key)
@@ -0,0 +1,130 @@
+"""Strategies for storing and finding Halo issue IDs on Jira issues."""
+
+
+class TextFieldLookup(object):
+    """Match Halo issue IDs with a full-text search on the Halo issue ID field.
+
+    This is the historical behaviour. The `~` operator is a contains query,
+    so results are narrowed to exact matches before they are returned.
+
+    Args:
+        jira_config (dict): The `jira_config` block of a routing rule.
+        jira_fields_dict (dict): Jira field names and IDs, mapped to IDs.
+    """
+
+    name = "text"
+
+    def __init__(self, jira_config, jira_fields_dict):
+        self.id_field_name = jira_config["jira_issue_id_field"]
+        self.id_field_key = jira_fields_dict[self.id_field_name]
+
+    def match_clause(self, issue_id):
+        """Return JQL matching Jira issues for one Halo issue ID."""
+        return f'"{self.id_field_name}"~{issue_id}'
+
+    def fallback_clause(self, issue_id):
+        """Return JQL for a secondary search, or None if there is none."""
+        return None
+
+    def tracked_clause(self):
+        """Return JQL matching every Jira issue tracking a Halo issue."""
+        return f'"{self.id_field_name}" is not EMPTY'
+
+    def get_issue_id(self, jira_issue):
+        """Return the Halo issue ID stored on a Jira issue."""
+        halo_issue_id = jira_issue.raw["fields"].get(self.id_field_key)
+        return halo_issue_id.strip() if halo_issue_id else None
+
+    def index_fields(self):
+        """Return the Jira fields get_issue_id() and migrations read."""
+        return [self.id_field_key]
+
+    def apply(self, fields, issue_id):
+        """Add the fields identifying the Halo issue to a Jira fields dict."""
+        fields[self.id_field_key] = issue_id
+        return fields
+
+    def guard(self, fields, issue_id):
+        """Keep an update from removing the identifying fields."""
+        return fields
+
+    def needs_migration(self, jira_issue, issue_id):
+        return False
+
+    def migration_fields(self, jira_issue, issue_id):
+        """Return the fields to update when migrating a Jira issue."""
+        return {}
+
+    def migrate(self, jira_issue, issue_id):
+        fields = self.migration_fields(jira_issue, issue_id)
+        if fields:
+            jira_issue.update(fields=fields)
+
+
+class LabelLookup(TextFieldLookup):
+    """Match Halo issue IDs exactly, using a label on the Jira issue.
+
+    Labels are matched with `=`/`in`, which Jira resolves from its index
+    without a full-text scan. A labels-type custom field can be used instead
+    of the system `labels` field by setting `lookup_label_field`.
+
+    The Halo issue ID field is still written, so Jira issues created before
+    this strategy was enabled are found through it and get their label added.
+    """
+
+    name = "label"
+
+    def __init__(self, jira_config, jira_fields_dict):
+        super(LabelLookup, self).__init__(jira_config, jira_fields_dict)
+        self.label_field_name = jira_config.get("lookup_label_field", "labels")
+        self.label_field_key = jira_fields_dict.get(self.label_field_name, self.label_field_name)
+        self.label_prefix = jira_config.get("lookup_label_prefix", "halo-")
+
+    def get_label(self, issue_id):
+        return f"{self.label_prefix}{issue_id}"
+
+    def get_labels(self, jira_issue):
+        return jira_issue.raw["fields"].get(self.label_field_key) or []
+
+    def match_clause(self, issue_id):
+        return f'"{self.label_field_name}" = "{self.get_label(issue_id)}"'
+
+    def fallback_clause(self, issue_id):
+        return super(LabelLookup, self).match_clause(issue_id)
+
+    def index_fields(self):
+        return super(LabelLookup, self).index_fields() + [self.label_field_key]
+
+    def get_issue_id(self, jira_issue):
+        for label in self.get_labels(jira_issue):
+            if label.startswith(self.label_prefix):
+                return label[len(self.label_prefix):]
+        return super(LabelLookup, self).get_issue_id(jira_issue)
+
+    def apply(self, fields, issue_id):
+        super(LabelLookup, self).apply(fields, issue_id)
+        labels = list(fields.get(self.label_field_key) or [])
+        if self.get_label(issue_id) not in labels:
+            labels.append(self.get_label(issue_id))
+        fields[self.label_field_key] = labels
+        return fields
+
+    def guard(self, fields, issue_id):
+        if self.label_field_key in fields:
+            self.apply(fields, issue_id)
+        return fields
+
+    def needs_migration(self, jira_issue, issue_id):
+        return self.get_label(issue_id) not in self.get_labels(jira_issue)
+
+    def migration_fields(self, jira_issue, issue_id):
+        return {self.label_field_key: self.get_labels(jira_issue) + [self.get_label(issue_id)]}
+
+
+LOOKUP_STRATEGIES = {strategy.name: strategy for strategy in [TextFieldLookup, LabelLookup]}
+
+
+def get_lookup_strategy(jira_config, jira_fields_dict):
+    """Return the lookup strategy configured for a routing rule."""
+    strategy_name = jira_config.get("lookup_strategy", TextFieldLookup.name)
+    return LOOKUP_STRATEGIES[strategy_name](jira_config, jira_fields_dict)
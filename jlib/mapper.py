@@ -33,3 +33,47 @@ def get_due_date_wrt_first_seen(static_mapping, issue):
     first_seen_at = isoparse(issue.get("first_seen_at"))
     due_date_time = int(static_mapping['duedate'])
     return (first_seen_at + timedelta(days=due_date_time)).isoformat()
+
+def diff_fields(prepared_fields, current_fields):
+    """Return the prepared fields whose values differ from the current Jira values."""
+    return {k: v for k, v in prepared_fields.items() if not field_values_equal(v, current_fields.get(k))}
+
+def field_values_equal(prepared, current):
+    """Compare a prepared field value with Jira's representation of it."""
+    if prepared in (None, "", []) or current in (None, "", []):
+        return prepared in (None, "", []) and current in (None, "", [])
+    if isinstance(prepared, dict):
+        return isinstance(current, dict) and all(
+            field_values_equal(v, current.get(k)) for k, v in prepared.items())
+    if isinstance(prepared, list):
+        if not isinstance(current, list) or len(prepared) != len(current):
+            return False
+        if all(isinstance(x, str) for x in prepared + current):
+            return sorted(normalize_string(x) for x in prepared) == sorted(normalize_string(x) for x in current)
+        return all(field_values_equal(p, c) for p, c in zip(prepared, current))
+    if isinstance(prepared, str) and isinstance(current, str):
+        prepared_dt, current_dt = parse_datetime(prepared), parse_datetime(current)
+        if prepared_dt and current_dt:
+            return compare_datetimes(prepared, prepared_dt, current, current_dt)
+        return normalize_string(prepared) == normalize_string(current)
+    return normalize_string(str(prepared)) == normalize_string(str(current))
+
+def normalize_string(value):
+    """Normalize line endings and surrounding whitespace the way Jira stores text."""
+    return "\n".join(line.rstrip() for line in value.replace("\r\n", "\n").strip().split("\n"))
+
+def parse_datetime(value):
+    if len(value) < 10 or value[4] != "-" or value[7] != "-":
+        return None
+    try:
+        return isoparse(value)
+    except ValueError:
+        return None
+
+def compare_datetimes(prepared, prepared_dt, current, current_dt):
+    """Compare dates at the precision of the less precise side; Jira keeps milliseconds."""
+    if len(prepared) == 10 or len(current) == 10:
+        return prepared_dt.date() == current_dt.date()
+    if (prepared_dt.tzinfo is None) != (current_dt.tzinfo is None):
+        prepared_dt, current_dt = prepared_dt.replace(tzinfo=None), current_dt.replace(tzinfo=None)
+    return abs(prepared_dt - current_dt) < timedelta(milliseconds=1)
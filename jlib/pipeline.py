@@ -0,0 +1,97 @@
+"""Stream Halo issues to Jira page by page, through bounded stages."""
+import queue
+import threading
+from jlib.logger import Logger
+
+
+class StageError(object):
+    """Carries an exception raised in a stage to the stages downstream."""
+
+    def __init__(self, error):
+        self.error = error
+
+
+class StreamingPipeline(object):
+    """Stream a rule's Halo issues to Jira one page at a time.
+
+    Listing, enrichment and reconciliation run in their own threads, linked
+    by queues holding at most `queue_size` pages. A slow stage blocks the
+    stages feeding it, so memory is bounded by the pages in flight rather
+    than by the number of matching issues, and Jira writes start as soon as
+    the first page is enriched.
+
+    Args:
+        halo (obj): Instance of jlib.Halo().
+        reconciler (obj): Instance of jlib.Reconciler() for the rule.
+        queue_size (int): Pages buffered between two stages.
+    """
+
+    done = object()
+
+    def __init__(self, halo, reconciler, queue_size=2):
+        self.logger = Logger()
+        self.halo = halo
+        self.reconciler = reconciler
+        self.queue_size = queue_size
+        self.stopped = threading.Event()
+
+    def run(self, since=None, since_filter="last_seen_at_gte"):
+        """List, enrich and reconcile the rule's Halo issues, and return how many were processed.
+
+        Args:
+            since (str): ISO8601-formatted timestamp. If set, only issues
+                changed since then are listed.
+            since_filter (str): Halo issue filter used to apply `since`.
+        """
+        filters = self.reconciler.rule.get("filters") or {}
+        issue_filters = dict(filters.get("issue") or {})
+        if since:
+            issue_filters[since_filter] = since
+        caches = {}
+        issues_count = 0
+        pages = self.stage(self.halo.iter_issue_pages(issue_filters, filters.get("partitions")))
+        try:
+            for halo_issues in self.stage(pages, self.reconciler.enrich):
+                self.reconciler.reconcile_batch(halo_issues, caches)
+                self.halo.release(halo_issues)
+                issues_count += len(halo_issues)
+                self.logger.info(f"Reconciled {issues_count} Halo issues")
+        finally:
+            self.stopped.set()
+        return issues_count
+
+    def stage(self, source, func=None):
+        """Consume source in a thread, and return a generator of its items, passed through func."""
+        output = queue.Queue(maxsize=self.queue_size)
+
+        def run():
+            try:
+                for item in source:
+                    if not self.put(output, func(item) if func else item):
+                        return
+            except Exception as e:
+                self.put(output, StageError(e))
+                return
+            self.put(output, self.done)
+
+        threading.Thread(target=run, daemon=True).start()
+        return self.drain(output)
+
+    def put(self, output, item):
+        """Put item on a stage's output queue, blocking while it is full, unless the pipeline stopped."""
+        while not self.stopped.is_set():
+            try:
+                output.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def drain(self, output):
+        while True:
+            item = output.get()
+            if item is self.done:
+                return
+            if isinstance(item, StageError):
+                raise item.error
+            yield item
@@ -1,12 +1,14 @@
 """Reconcile Halo issues against Jira."""
-import os
 import logging
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from cloudpassage.exceptions import CloudPassageResourceExistence
 from itertools import groupby
 import json
 import hashlib
-from jlib.halo import Halo
+from datetime import datetime, timedelta, timezone
+from dateutil.parser import isoparse
+from jlib.clients import ClientRegistry
+from jlib.issue_store import IssueStore
 from jlib.jira_local import JiraLocal
 from jlib.logger import Logger
 
@@ -20,55 +22,240 @@ class Reconciler(object):
             from Halo to Jira. See README.md for details.
         static_mapping (dict): Statically-defined fields for Jira. See
             README.md for more info.
+        state_store (obj): Instance of jlib.StateStore(), or None.
     """
 
-    def __init__(self, config, rule):
+    def __init__(self, config, rule, state_store=None):
         self.logger = Logger()
         self.config = config
-        self.halo = Halo(config.halo_api_key, config.halo_api_secret_key, config.halo_api_hostname)
+        self.halo = ClientRegistry.get_halo(config)
         self.jira = JiraLocal(config.jira_api_url, config.jira_api_user, config.jira_api_token, rule,
-                              config.jira_fields_dict)
+                              config.jira_fields_dict, state_store)
         self.rule = rule
+        self.state_store = state_store
+        self.incremental = rule.get("incremental") or {}
+        self.since_filter = self.incremental.get("filter", "last_seen_at_gte")
+        self.reconciled_ids = set()
 
-    def reconcile_issues(self, halo_issues, project_key):
-        jira_issues_dict = self.jira.get_jira_issues(project_key, halo_issues)
-        jira_epics_dict = self.jira.get_jira_epics_or_issues(project_key, "Epic")
-        issues_with_gk = []
-        futures_to_group_key = {}
-        groupby_params = self.rule.get("groupby", [])
-        sorted_issues = sorted(halo_issues, key=lambda issue: [issue[x] for x in groupby_params])
-        with ThreadPoolExecutor(max_workers=os.cpu_count()*2) as executor:
-            for group_key, issues_group in groupby(
-                    sorted_issues, key=lambda issue: {x: issue[x] for x in groupby_params}):
-                group_key_hash = ""
-                if group_key:
-                    group_key_str = json.dumps(group_key)
-                    group_key_hash = hashlib.sha256(group_key_str.encode()).hexdigest()
-                    if group_key_hash not in jira_epics_dict:
-                        futures_to_group_key[executor.submit(
-                            self.jira.create_jira_epic, group_key_hash, group_key_str, project_key
-                        )] = group_key_hash
-
-                for issue in issues_group:
-                    issue["groupby_key"] = group_key_hash
-                    issues_with_gk.append(issue)
-            for future in as_completed(futures_to_group_key):
-                jira_epics_dict[futures_to_group_key[future]] = future.result()
-        
+    def get_incremental_since(self):
+        """Return the watermark to list Halo issues from, or None for a full pass.
+
+        Incremental listing needs the state store. A full pass is made when no
+        watermark exists yet and every `full_sync_hours` after the last one.
+        """
+        if not (self.state_store and self.incremental.get("enabled")):
+            return None
+        watermark, last_full_sync = self.state_store.get_watermark(self.rule["name"])
+        if not watermark or not last_full_sync:
+            return None
+        full_sync_due = isoparse(last_full_sync) + timedelta(hours=self.incremental.get("full_sync_hours", 24))
+        if full_sync_due <= datetime.now(timezone.utc):
+            self.logger.info(f"Full sync due for {self.rule['name']}")
+            return None
+        self.logger.info(f"Listing Halo issues changed since {watermark}")
+        return watermark
+
+    def commit_watermark(self, started_at, since):
+        """Persist the watermark for the next run, once this run succeeded."""
+        if not (self.state_store and self.incremental.get("enabled")):
+            return
+        watermark = started_at - timedelta(minutes=self.incremental.get("overlap_minutes", 5))
+        self.state_store.set_watermark(
+            self.rule["name"], watermark.strftime("%Y-%m-%dT%H:%M:%S.%fZ"), full_sync=since is None
+        )
+
+    def enrich(self, halo_issues):
+        """Enrich the Halo issues whose content may have changed, and return all of them.
+
+        See get_changed_issues(). Issues left unenriched are enriched by
+        prepare_issues() if their content did change in Jira's view after all.
+        """
+        changed_issues = self.get_changed_issues(halo_issues)
+        if len(changed_issues) < len(halo_issues):
+            self.logger.info(f"Enriching {len(changed_issues)} of {len(halo_issues)} Halo issues, others are unchanged")
+        if changed_issues:
+            self.halo.enrich(changed_issues)
+        return halo_issues
+
+    def get_changed_issues(self, halo_issues):
+        """Return the listed Halo issues whose content may have changed, see jlib.JiraLocal().get_changed_issues()."""
+        return self.jira.get_changed_issues(halo_issues, self.rule["jira_config"]["project_keys"])
+
+    def reconcile_batch(self, halo_issues, caches):
+        """Reconcile a batch of Halo issues in every project of the rule.
+
+        The projects' Jira issues are looked up concurrently. Issues are then
+        grouped and prepared once, and the projects, sharing the prepared
+        issues, are reconciled concurrently.
+
+        Args:
+            halo_issues (list): Halo issues, passed through enrich().
+            caches (dict): Project key to the cache given to
+                reconcile_issues(), kept across batches.
+        """
+        project_keys = self.rule["jira_config"]["project_keys"]
+        project_caches = [caches.setdefault(project_key, {}) for project_key in project_keys]
+        with ThreadPoolExecutor(max_workers=len(project_keys)) as executor:
+            jira_issues_dicts = list(executor.map(
+                lambda project_key, cache: self.jira.get_jira_issues(project_key, halo_issues, cache),
+                project_keys, project_caches
+            ))
+            prepared_issues, groups = self.prepare_issues(halo_issues, jira_issues_dicts)
+            futures = [
+                executor.submit(self.reconcile_issues, prepared_issues, groups, project_key, jira_issues_dict, cache)
+                for project_key, jira_issues_dict, cache in zip(project_keys, jira_issues_dicts, project_caches)
+            ]
+            for future in futures:
+                future.result()
+
+    def prepare_issues(self, halo_issues, jira_issues_dicts):
+        """Group and prepare Halo issues once, for every project of the rule.
+
+        Issues are rendered unless only their status changed, and left out
+        if they didn't change at all. See jlib.JiraLocal().classify_change().
+
+        Args:
+            halo_issues (list): Halo issues, passed through enrich().
+            jira_issues_dicts (list): Dict of Halo issue ID to matching Jira
+                issues, for each project.
+
+        Returns:
+            tuple: List of jlib.PreparedIssue(), and dict of group key hash
+                to group key string, for the epics of rendered issues.
+        """
+        self.reconciled_ids.update(issue["id"] for issue in halo_issues)
         fields = self.rule.get("fields") or {}
-        self.jira.push_issues(
-            issues_with_gk,
-            jira_epics_dict,
-            jira_issues_dict,
-            self.config.jira_fields_dict,
-            fields,
-            project_key
+        changes = self.classify_changes(halo_issues, jira_issues_dicts)
+        prepared_issues = []
+        groups = {}
+        for group_key_hash, group_key_str, issues_group in self.group_issues(halo_issues, self.rule.get("groupby", [])):
+            for issue in issues_group:
+                prepared = self.jira.prepare_change(
+                    issue, fields, self.config.jira_fields_dict, changes[issue["id"]], group_key_hash
+                )
+                if prepared is None:
+                    continue
+                prepared_issues.append(prepared)
+                if group_key_hash and prepared.fields is not None:
+                    groups[group_key_hash] = group_key_str
+        self.log_changes(halo_issues, prepared_issues)
+        return prepared_issues, groups
+
+    def classify_changes(self, halo_issues, jira_issues_dicts):
+        """Return dict of Halo issue ID to how it changed, see jlib.JiraLocal().classify_change().
+
+        Issues whose content changed are enriched if enrich() skipped them,
+        e.g. because their Jira issue was deleted since.
+        """
+        changes = {
+            issue["id"]: self.jira.classify_change(
+                issue, [jira_issues_dict.get(issue["id"]) for jira_issues_dict in jira_issues_dicts]
+            )
+            for issue in halo_issues
+        }
+        unenriched_issues = [issue for issue in halo_issues
+                             if changes[issue["id"]] == "content" and "asset" not in issue]
+        if unenriched_issues:
+            self.halo.enrich(unenriched_issues)
+        return changes
+
+    def log_changes(self, halo_issues, prepared_issues):
+        status_changes = sum(1 for prepared in prepared_issues if prepared.fields is None)
+        self.logger.info(
+            f"Changes: {len(prepared_issues) - status_changes} content, {status_changes} status only, "
+            f"{len(halo_issues) - len(prepared_issues)} unchanged"
         )
 
-    def get_jira_halo_issues(self, jira_issues_dict):
+    def reconcile_issues(self, prepared_issues, groups, project_key, jira_issues_dict, cache=None):
+        """Create or update the Jira issues of prepared issues in a project.
+
+        Args:
+            prepared_issues (list): jlib.PreparedIssue() objects.
+            groups (dict): Group key hash to group key string, for the epics
+                of the prepared issues.
+            project_key (str): Jira project key.
+            jira_issues_dict (dict): Halo issue ID to matching Jira issues in
+                the project.
+            cache (dict): Kept across calls for the same project, so batches
+                of issues share the Jira issue index and epic keys.
+        """
+        cache = {} if cache is None else cache
+        if "jira_epics_dict" not in cache:
+            cache["jira_epics_dict"] = self.jira.get_jira_epic_keys(project_key)
+        jira_epics_dict = cache["jira_epics_dict"]
+        new_groups = [(group_key_hash, group_key_str) for group_key_hash, group_key_str in groups.items()
+                      if group_key_hash not in jira_epics_dict]
+        if new_groups:
+            jira_epics_dict.update(self.jira.create_jira_epics(new_groups, project_key))
+        self.jira.push_issues(prepared_issues, jira_epics_dict, jira_issues_dict, project_key)
+
+    @staticmethod
+    def group_issues(halo_issues, groupby_params):
+        """Yield (group key hash, group key string, issues) for each group of issues.
+
+        Without groupby parameters, all issues form one group with an empty key.
+        """
+        sorted_issues = sorted(halo_issues, key=lambda issue: [issue[x] for x in groupby_params])
+        for group_key, issues_group in groupby(
+                sorted_issues, key=lambda issue: {x: issue[x] for x in groupby_params}):
+            group_key_hash = ""
+            group_key_str = ""
+            if group_key:
+                group_key_str = json.dumps(group_key)
+                group_key_hash = hashlib.sha256(group_key_str.encode()).hexdigest()
+            yield group_key_hash, group_key_str, list(issues_group)
+
+    def get_jira_halo_issues(self, jira_issues_dict, since=None):
+        """Return the Halo issues of tracked Jira issues, listed in bulk where possible.
+
+        The rule's filters are listed again for the statuses the reconcile
+        pass didn't cover: resolved issues after a full pass, and every
+        status changed since the watermark after an incremental one.
+        Tracked issues which weren't listed are described one by one, except
+        after an incremental pass for those the state store shows were
+        resolved and last seen before the watermark: Halo didn't see them
+        since, so they weren't reopened. Unresolved ones are still described,
+        since Halo may resolve an issue without seeing it again.
+
+        Args:
+            jira_issues_dict (dict): Halo issue ID to tracked Jira issues.
+            since (str): Watermark the reconcile pass listed issues from, or
+                None after a full pass.
+        """
+        wanted_ids = set(jira_issues_dict)
+        if not wanted_ids:
+            return []
+        filters = self.rule.get("filters") or {}
+        issue_filters = dict(filters.get("issue") or {})
+        issue_filters["status"] = "active,resolved" if since else "resolved"
+        if since:
+            issue_filters[self.since_filter] = since
+        issues = [issue for issue in self.halo.list_issues(issue_filters, filters.get("partitions"))
+                  if issue["id"] in wanted_ids]
+        leftover_ids = wanted_ids - set(issue["id"] for issue in issues)
+        if since and self.since_filter == "last_seen_at_gte":
+            leftover_ids = {issue_id for issue_id in leftover_ids
+                            if not self.is_resolved_unseen_since(issue_id, jira_issues_dict[issue_id], since)}
+        self.logger.info(f"Listed {len(issues)} of {len(wanted_ids)} tracked issues, describing {len(leftover_ids)}")
+        return issues + self.describe_halo_issues(leftover_ids)
+
+    def is_resolved_unseen_since(self, issue_id, jira_issues, since):
+        """Return True if every Jira issue of a Halo issue was pushed as resolved with a last_seen_at before since."""
+        if not (self.state_store and jira_issues):
+            return False
+        for jira_issue in jira_issues:
+            issue_state = self.state_store.get_issue_state(
+                issue_id, jira_issue.raw["fields"]["project"]["key"], jira_issue.key
+            )
+            if not (issue_state and issue_state["status"] == "resolved" and issue_state["last_seen_at"]) or \
+                    isoparse(issue_state["last_seen_at"]) >= isoparse(since):
+                return False
+        return True
+
+    def describe_halo_issues(self, issue_ids):
         issues = []
-        with ThreadPoolExecutor(max_workers=os.cpu_count()*2) as executor:
-            futures = [executor.submit(self.halo.issue.describe, issue_id) for issue_id in jira_issues_dict]
+        with ThreadPoolExecutor(max_workers=self.halo.scheduler.max_concurrency) as executor:
+            futures = [executor.submit(self.halo.issue.describe, issue_id) for issue_id in issue_ids]
             for future in as_completed(futures):
                 try:
                     issues.append(future.result()["issue"])
@@ -76,25 +263,52 @@ class Reconciler(object):
                     pass
         return issues
 
-    def update_all_jira_issues(self):
+    def update_all_jira_issues(self, since=None):
+        """Refresh unresolved Jira issues whose Halo issues weren't reconciled in this run.
+
+        Args:
+            since (str): Watermark the reconcile pass listed issues from, or
+                None after a full pass.
+        """
         jira_issues_dict = self.jira.get_jira_epics_or_issues(
             self.rule["jira_config"]["project_keys"],
             self.rule["jira_config"]["jira_issue_type"]
         )
-        jira_epics_dict = {}
         fields = self.rule.get("fields") or {}
-        halo_issues = self.get_jira_halo_issues(jira_issues_dict)
-        if halo_issues:
+        for issue_id, jira_issues in jira_issues_dict.items():
+            for jira_issue in jira_issues:
+                self.jira.record_jira_issue(jira_issue, issue_id)
+        # Issues reconciled in this run already have up-to-date Jira issues.
+        jira_issues_dict = {issue_id: jira_issues for issue_id, jira_issues in jira_issues_dict.items()
+                            if issue_id not in self.reconciled_ids}
+        halo_issues = self.get_jira_halo_issues(jira_issues_dict, since)
+        if halo_issues and self.config.spill_dir:
             self.logger.info(f"Updating {len(halo_issues)} active Jira issues")
-            halo_issues = self.halo.get_asset_and_findings(halo_issues)
-            halo_issues = self.halo.get_cve_details(halo_issues)
-            self.jira.push_issues(
-                halo_issues,
-                jira_epics_dict,
-                jira_issues_dict,
-                self.config.jira_fields_dict,
-                fields
+            issue_store = self.halo.enrich_to_store(
+                halo_issues, IssueStore(self.config.spill_dir), self.config.spill_batch_size, self.enrich
             )
+            try:
+                for batch in issue_store.iter_batches(self.config.spill_batch_size):
+                    self.jira.push_issues(self.prepare_tracked_issues(batch, fields, jira_issues_dict), {},
+                                          jira_issues_dict)
+            finally:
+                issue_store.close()
+        elif halo_issues:
+            self.logger.info(f"Updating {len(halo_issues)} active Jira issues")
+            halo_issues = self.enrich(halo_issues)
+            self.jira.push_issues(self.prepare_tracked_issues(halo_issues, fields, jira_issues_dict), {},
+                                  jira_issues_dict)
+
+    def prepare_tracked_issues(self, halo_issues, fields, jira_issues_dict):
+        """Prepare Halo issues whose Jira issues, in any project, are in jira_issues_dict."""
+        changes = self.classify_changes(halo_issues, [jira_issues_dict])
+        prepared_issues = []
+        for issue in halo_issues:
+            prepared = self.jira.prepare_change(issue, fields, self.config.jira_fields_dict, changes[issue["id"]])
+            if prepared is not None:
+                prepared_issues.append(prepared)
+        self.log_changes(halo_issues, prepared_issues)
+        return prepared_issues
 
     def cleanup(self, project_keys):
         self.jira.cleanup_epics(project_keys)
@@ -0,0 +1,265 @@
+"""Per-service concurrency caps, rate limits and retries for Halo and Jira calls."""
+import email.utils
+import os
+import random
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from requests.adapters import HTTPAdapter
+from jlib.logger import Logger
+
+
+class TokenBucket(object):
+    """Thread-safe token bucket allowing `rate` requests per second, in bursts of up to `burst`.
+
+    A rate of 0 disables the limit.
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst or max(1, rate)
+        self.tokens = self.burst
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self):
+        """Take a token, and return the seconds to wait before using it."""
+        if not self.rate:
+            return 0
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+            self.updated_at = now
+            self.tokens -= 1
+            return max(0, -self.tokens / self.rate)
+
+
+class ServiceScheduler(object):
+    """Schedule the requests made to one service.
+
+    Requests take one of `max_concurrency` slots and a token from the rate
+    limit before they are sent. Throttled requests (429), and idempotent ones
+    failing with a transient 5xx, are retried with exponential backoff, or
+    after the delay the service asks for in `Retry-After`. A backoff pauses
+    every caller of the service, not only the one that was throttled.
+
+    If adaptive, the number of requests in flight is governed by AIMD, as in
+    TCP congestion control: the limit grows by one per round of healthy
+    responses, and is cut by `decrease_factor` on a 429, a 5xx, a connection
+    error, or a response slower than `latency_tolerance` times the moving
+    average. Limit changes are kept in `history`.
+
+    Args:
+        name (str): Name of the service, for logging.
+        max_concurrency (int): Maximum number of requests in flight.
+        rate_limit (float): Requests per second. Unlimited if 0.
+        burst (int): Requests which may be sent at once within the rate limit.
+        max_retries (int): Retries of a throttled or failed request.
+        backoff_base (float): Seconds to wait before the first retry.
+        backoff_max (float): Maximum seconds to wait before a retry.
+        adaptive (bool): Adapt the limit of requests in flight between
+            `min_concurrency` and `max_concurrency`, starting half-way.
+        min_concurrency (int): Minimum number of requests in flight.
+        latency_tolerance (float): Multiple of the average latency above
+            which a response counts as a latency spike.
+        decrease_factor (float): Factor applied to the limit on congestion.
+    """
+
+    retry_statuses = [429, 502, 503, 504]
+    idempotent_methods = ["GET", "HEAD", "OPTIONS", "PUT", "DELETE"]
+
+    def __init__(self, name, max_concurrency, rate_limit=0, burst=None, max_retries=5, backoff_base=1.0,
+                 backoff_max=60.0, adaptive=False, min_concurrency=1, latency_tolerance=2.0, decrease_factor=0.5):
+        self.logger = Logger()
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = max(1, min(min_concurrency, max_concurrency))
+        self.adaptive = adaptive
+        self.latency_tolerance = latency_tolerance
+        self.decrease_factor = decrease_factor
+        self.limit = float(max_concurrency)
+        if adaptive:
+            self.limit = float(max(self.min_concurrency, max_concurrency // 2))
+        self.in_flight = 0
+        self.latency = None
+        self.decreased_at = 0
+        self.history = deque([(time.time(), int(self.limit), "start")], maxlen=100)
+        self.condition = threading.Condition()
+        self.bucket = TokenBucket(rate_limit, burst)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.lock = threading.Lock()
+        self.paused_until = 0
+
+    @contextmanager
+    def slot(self):
+        """Hold a request slot, once the rate limit and any backoff allow sending."""
+        with self.condition:
+            self.condition.wait_for(self.try_acquire)
+        try:
+            time.sleep(self.get_wait())
+            yield
+        finally:
+            self.release()
+
+    def try_acquire(self):
+        """Take a request slot if one is free under the current limit."""
+        with self.condition:
+            if self.in_flight >= int(self.limit):
+                return False
+            self.in_flight += 1
+            return True
+
+    def release(self):
+        with self.condition:
+            self.in_flight -= 1
+            self.condition.notify_all()
+
+    def record(self, status_code, latency):
+        """Adapt the limit to a response, or to a connection error if status_code is None."""
+        if not self.adaptive:
+            return
+        with self.condition:
+            if status_code is None or status_code == 429 or status_code >= 500:
+                reason = f"status {status_code}" if status_code else "connection error"
+            elif self.latency is not None and latency > self.latency * self.latency_tolerance:
+                reason = f"latency {latency:.2f}s"
+            else:
+                reason = None
+            if status_code is not None and status_code < 500:
+                self.latency = latency if self.latency is None else 0.9 * self.latency + 0.1 * latency
+            now = time.monotonic()
+            if reason is None:
+                self.set_limit(min(self.max_concurrency, self.limit + 1 / self.limit), "healthy")
+                self.condition.notify_all()
+            elif now - self.decreased_at > (self.latency or latency):
+                # Cut once per round trip, however many requests in flight saw the congestion.
+                self.decreased_at = now
+                self.set_limit(max(self.min_concurrency, self.limit * self.decrease_factor), reason)
+
+    def set_limit(self, limit, reason):
+        changed = int(limit) != int(self.limit)
+        self.limit = limit
+        if changed:
+            self.history.append((time.time(), int(limit), reason))
+            self.logger.debug(f"{self.name} concurrency limit {int(limit)} ({reason})")
+
+    def get_stats(self):
+        """Return the current concurrency limit, its bounds, and the history of its changes."""
+        with self.condition:
+            return {
+                "limit": int(self.limit),
+                "min": self.min_concurrency if self.adaptive else self.max_concurrency,
+                "max": self.max_concurrency,
+                "in_flight": self.in_flight,
+                "latency": round(self.latency, 3) if self.latency is not None else None,
+                "history": [
+                    {"at": datetime.fromtimestamp(at, timezone.utc).isoformat(), "limit": limit, "reason": reason}
+                    for at, limit, reason in self.history
+                ]
+            }
+
+    def get_wait(self):
+        """Take a token, and return the seconds to wait before sending a request."""
+        with self.lock:
+            paused_for = self.paused_until - time.monotonic()
+        return max(paused_for, self.bucket.reserve(), 0)
+
+    def should_retry(self, method, status_code, attempt):
+        if attempt >= self.max_retries or status_code not in self.retry_statuses:
+            return False
+        return status_code == 429 or method.upper() in self.idempotent_methods
+
+    def back_off(self, attempt, headers):
+        """Pause requests to the service after a throttled or failed request, and return the delay."""
+        delay = self.parse_retry_after(headers.get("Retry-After"))
+        if delay is None:
+            delay = min(self.backoff_max, self.backoff_base * 2 ** attempt) * random.uniform(0.5, 1)
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + delay)
+        return delay
+
+    @staticmethod
+    def parse_retry_after(retry_after):
+        """Return the seconds to wait from a Retry-After header, given as seconds or an HTTP date."""
+        if not retry_after:
+            return None
+        try:
+            return max(0.0, float(retry_after))
+        except ValueError:
+            pass
+        try:
+            retry_at = email.utils.parsedate_to_datetime(retry_after)
+        except (TypeError, ValueError):
+            return None
+        return max(0.0, retry_at.timestamp() - time.time())
+
+
+class ScheduledHTTPAdapter(HTTPAdapter):
+    """requests transport adapter sending every request through a jlib.ServiceScheduler()."""
+
+    def __init__(self, scheduler, **kwargs):
+        self.scheduler = scheduler
+        kwargs.setdefault("pool_connections", 1)
+        kwargs.setdefault("pool_maxsize", scheduler.max_concurrency)
+        super(ScheduledHTTPAdapter, self).__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        attempt = 0
+        while True:
+            with self.scheduler.slot():
+                started_at = time.monotonic()
+                try:
+                    response = super(ScheduledHTTPAdapter, self).send(request, **kwargs)
+                except Exception:
+                    self.scheduler.record(None, time.monotonic() - started_at)
+                    raise
+                self.scheduler.record(response.status_code, time.monotonic() - started_at)
+            # Streamed bodies, like attachments, can't be sent twice.
+            replayable = request.body is None or isinstance(request.body, (bytes, str))
+            if not replayable or not self.scheduler.should_retry(request.method, response.status_code, attempt):
+                return response
+            delay = self.scheduler.back_off(attempt, response.headers)
+            self.scheduler.logger.warn(
+                f"{self.scheduler.name} returned {response.status_code} for {request.method} "
+                f"{request.path_url}, retrying in {delay:.1f}s"
+            )
+            response.close()
+            attempt += 1
+
+
+class Scheduler(object):
+    """Process-wide registry of the scheduler of each service."""
+
+    lock = threading.Lock()
+    services = {}
+
+    @classmethod
+    def configure(cls, name, max_concurrency, **kwargs):
+        """Replace the scheduler of a service. See jlib.ServiceScheduler() for arguments."""
+        with cls.lock:
+            cls.services[name] = ServiceScheduler(name, max_concurrency, **kwargs)
+            return cls.services[name]
+
+    @classmethod
+    def get(cls, name):
+        """Return the scheduler of a service, with default settings if it wasn't configured."""
+        with cls.lock:
+            if name not in cls.services:
+                cls.services[name] = ServiceScheduler(name, os.cpu_count() * 2)
+            return cls.services[name]
+
+    @classmethod
+    def get_stats(cls):
+        """Return dict of service name to its scheduler's concurrency stats."""
+        with cls.lock:
+            services = dict(cls.services)
+        return {name: service.get_stats() for name, service in services.items()}
+
+    @classmethod
+    def clear(cls):
+        with cls.lock:
+            cls.services = {}
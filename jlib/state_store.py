@@ -0,0 +1,187 @@
+"""Persist the Halo to Jira sync state between runs."""
+import os
+import sqlite3
+import threading
+from datetime import datetime, timezone
+
+
+class StateStore(object):
+    """Embedded SQLite store of what was last pushed to Jira.
+
+    For each Halo issue and Jira project, the store records the Jira issue
+    key(s), the epic the Jira issue is linked to, the Halo status last pushed,
+    the Halo `last_seen_at` timestamp and a hash of the last pushed payload.
+    Epics created for issue groups are recorded as well.
+
+    Args:
+        db_path (str): Path to the SQLite database file. It is created if it
+            does not exist.
+    """
+    # Stays below SQLite's default limit of 999 bound parameters.
+    query_chunk_size = 500
+
+    def __init__(self, db_path):
+        db_dir = os.path.dirname(os.path.abspath(db_path))
+        if not os.path.exists(db_dir):
+            os.makedirs(db_dir)
+        self.lock = threading.RLock()
+        self.connection = sqlite3.connect(db_path, check_same_thread=False)
+        self.connection.row_factory = sqlite3.Row
+        with self.lock, self.connection:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("PRAGMA synchronous=NORMAL")
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS issues ("
+                "halo_issue_id TEXT NOT NULL, "
+                "project_key TEXT NOT NULL, "
+                "jira_key TEXT NOT NULL, "
+                "epic_key TEXT, "
+                "status TEXT, "
+                "last_seen_at TEXT, "
+                "payload_hash TEXT, "
+                "updated_at TEXT, "
+                "PRIMARY KEY (halo_issue_id, project_key, jira_key))"
+            )
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS epics ("
+                "group_key_hash TEXT NOT NULL, "
+                "project_key TEXT NOT NULL, "
+                "jira_key TEXT NOT NULL, "
+                "status TEXT NOT NULL DEFAULT 'open', "
+                "updated_at TEXT, "
+                "PRIMARY KEY (group_key_hash, project_key))"
+            )
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS watermarks ("
+                "rule_name TEXT PRIMARY KEY, "
+                "watermark TEXT NOT NULL, "
+                "last_full_sync TEXT)"
+            )
+
+    def get_issue_states(self, project_key, halo_issue_ids=None):
+        """Return dict of Halo issue ID to the list of stored rows for a project.
+
+        Args:
+            project_key (str): Jira project key.
+            halo_issue_ids (list): Only return the rows of these Halo issues,
+                which are queried in chunks. All rows of the project are
+                returned if None.
+        """
+        issue_states = {}
+        if halo_issue_ids is None:
+            with self.lock:
+                rows = self.connection.execute(
+                    "SELECT * FROM issues WHERE project_key = ?", (project_key,)
+                ).fetchall()
+        else:
+            halo_issue_ids = list(halo_issue_ids)
+            rows = []
+            for i in range(0, len(halo_issue_ids), self.query_chunk_size):
+                chunk = halo_issue_ids[i:i + self.query_chunk_size]
+                placeholders = ", ".join("?" for _ in chunk)
+                with self.lock:
+                    rows.extend(self.connection.execute(
+                        f"SELECT * FROM issues WHERE project_key = ? AND halo_issue_id IN ({placeholders})",
+                        [project_key] + chunk
+                    ).fetchall())
+        for row in rows:
+            issue_states.setdefault(row["halo_issue_id"], []).append(dict(row))
+        return issue_states
+
+    def get_issue_state(self, halo_issue_id, project_key, jira_key):
+        """Return the stored row for one Jira issue, or None."""
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT * FROM issues WHERE halo_issue_id = ? AND project_key = ? AND jira_key = ?",
+                (halo_issue_id, project_key, jira_key)
+            ).fetchone()
+        return dict(row) if row else None
+
+    def record_issue(self, halo_issue_id, project_key, jira_key, epic_key=None, status=None,
+                     last_seen_at=None, payload_hash=None):
+        """Insert or update the state of one Jira issue.
+
+        Columns passed as None keep their stored value.
+        """
+        with self.lock, self.connection:
+            self.connection.execute(
+                "INSERT INTO issues (halo_issue_id, project_key, jira_key, epic_key, status, "
+                "last_seen_at, payload_hash, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (halo_issue_id, project_key, jira_key) DO UPDATE SET "
+                "epic_key = COALESCE(excluded.epic_key, epic_key), "
+                "status = COALESCE(excluded.status, status), "
+                "last_seen_at = COALESCE(excluded.last_seen_at, last_seen_at), "
+                "payload_hash = COALESCE(excluded.payload_hash, payload_hash), "
+                "updated_at = excluded.updated_at",
+                (halo_issue_id, project_key, jira_key, epic_key, status, last_seen_at, payload_hash,
+                 self.now())
+            )
+
+    def forget_issue(self, project_key, jira_key):
+        """Drop a Jira issue which no longer exists."""
+        with self.lock, self.connection:
+            self.connection.execute(
+                "DELETE FROM issues WHERE project_key = ? AND jira_key = ?", (project_key, jira_key)
+            )
+
+    def get_epic_keys(self, project_key):
+        """Return dict of group key hash to Jira key for open epics in a project."""
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT group_key_hash, jira_key FROM epics WHERE project_key = ? AND status = 'open'",
+                (project_key,)
+            ).fetchall()
+        return {row["group_key_hash"]: row["jira_key"] for row in rows}
+
+    def record_epic(self, group_key_hash, project_key, jira_key, status="open"):
+        with self.lock, self.connection:
+            self.connection.execute(
+                "INSERT INTO epics (group_key_hash, project_key, jira_key, status, updated_at) "
+                "VALUES (?, ?, ?, ?, ?) ON CONFLICT (group_key_hash, project_key) DO UPDATE SET "
+                "jira_key = excluded.jira_key, status = excluded.status, updated_at = excluded.updated_at",
+                (group_key_hash, project_key, jira_key, status, self.now())
+            )
+
+    def close_epic(self, jira_key):
+        with self.lock, self.connection:
+            self.connection.execute(
+                "UPDATE epics SET status = 'closed', updated_at = ? WHERE jira_key = ?", (self.now(), jira_key)
+            )
+
+    def get_unused_epic_keys(self, project_keys):
+        """Return keys of open epics which no unresolved issue is linked to."""
+        placeholders = ", ".join("?" for _ in project_keys)
+        with self.lock:
+            rows = self.connection.execute(
+                f"SELECT jira_key FROM epics WHERE project_key IN ({placeholders}) AND status = 'open' "
+                f"AND jira_key NOT IN (SELECT epic_key FROM issues WHERE epic_key IS NOT NULL "
+                f"AND (status IS NULL OR status != 'resolved'))",
+                list(project_keys)
+            ).fetchall()
+        return [row["jira_key"] for row in rows]
+
+    def get_watermark(self, rule_name):
+        """Return (watermark, last_full_sync) for a rule, or (None, None)."""
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT watermark, last_full_sync FROM watermarks WHERE rule_name = ?", (rule_name,)
+            ).fetchone()
+        return (row["watermark"], row["last_full_sync"]) if row else (None, None)
+
+    def set_watermark(self, rule_name, watermark, full_sync=False):
+        """Persist the watermark of a rule after a successful run."""
+        with self.lock, self.connection:
+            self.connection.execute(
+                "INSERT INTO watermarks (rule_name, watermark, last_full_sync) VALUES (?, ?, ?) "
+                "ON CONFLICT (rule_name) DO UPDATE SET watermark = excluded.watermark, "
+                "last_full_sync = COALESCE(excluded.last_full_sync, last_full_sync)",
+                (rule_name, watermark, watermark if full_sync else None)
+            )
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+    @staticmethod
+    def now():
+        return datetime.now(timezone.utc).isoformat()
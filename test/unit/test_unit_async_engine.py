@@ -0,0 +1,200 @@
+import asyncio
+import json
+import threading
+import time
+from types import SimpleNamespace
+from urllib.parse import urlparse
+import jlib
+import jlib.async_engine
+
+
+class FakeResponse:
+    def __init__(self, status, body):
+        self.status = status
+        self.body = body
+        self.headers = {}
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        return False
+
+    async def text(self):
+        return json.dumps(self.body)
+
+
+class FakeSession:
+    """Stand-in for aiohttp.ClientSession, answering requests by method and path."""
+
+    def __init__(self, routes):
+        self.routes = routes
+        self.requests = []
+
+    def __call__(self, connector=None):
+        return self
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        return False
+
+    def request(self, method, url, **kwargs):
+        path = urlparse(url).path
+        self.requests.append((method, path, kwargs))
+        return FakeResponse(*self.routes[(method, path)])
+
+
+class FakeReconciler:
+    def __init__(self, rule):
+        self.rule = rule
+        self.prepared = []
+
+    def get_changed_issues(self, halo_issues):
+        return halo_issues
+
+    def prepare_issues(self, halo_issues, jira_issues_dicts):
+        self.prepared.extend(halo_issues)
+        return [], {}
+
+
+class TestUnitAsyncEngine:
+    @staticmethod
+    def engine():
+        halo = jlib.Halo("key", "secret", "api.cloudpassage.com")
+        halo.session.auth_token = "token"
+        config = SimpleNamespace(jira_api_url="https://jira.example.com", jira_api_user="user", jira_api_token="token")
+        return jlib.AsyncEngine(config, halo)
+
+    def test_unit_async_engine_sync_rule(self, monkeypatch):
+        session = FakeSession({
+            ("GET", "/v3/issues"): (200, {"issues": [
+                {"id": "1", "status": "active", "asset_url": "https://api.cloudpassage.com/v1/servers/s1",
+                 "extended_attributes": {}}
+            ], "pagination": {}}),
+            ("GET", "/v1/servers/s1"): (200, {"server": {"id": "s1"}}),
+        })
+        monkeypatch.setattr(jlib.async_engine.aiohttp, "ClientSession", session)
+        engine = self.engine()
+        reconciler = FakeReconciler({"name": "rule", "filters": {"issue": {"type": "sva", "group_id": None}},
+                                     "jira_config": {"project_keys": []}})
+        halo_issues = engine.sync_rule(reconciler)
+        assert session.requests[0][2]["params"] == {"type": "sva"}
+        assert [issue["asset"] for issue in halo_issues] == [{"id": "s1"}]
+        assert reconciler.prepared == halo_issues
+        assert engine.described == {}
+        return
+
+    def test_unit_async_engine_create_jira_issue_chunk(self):
+        session = FakeSession({
+            ("POST", "/rest/api/2/issue/bulk"): (400, {
+                "issues": [{"id": "10001", "key": "CL-1"}],
+                "errors": [{"status": 400, "failedElementNumber": 1,
+                            "elementErrors": {"errors": {"summary": "Summary is required."}}}]
+            }),
+            ("POST", "/rest/api/2/issue"): (201, {"id": "10002", "key": "CL-2"}),
+        })
+        engine = self.engine()
+        created_keys = []
+        jira_local = SimpleNamespace(
+            log=jlib.Logger(),
+            record_created_issue=lambda prepared, project_key, jira_key, epic_link, pushed: created_keys.append(
+                jira_key)
+        )
+        chunk = [(jlib.PreparedIssue({"id": issue_id}, {}, "hash"), None, {"summary": issue_id})
+                 for issue_id in ["1", "2"]]
+
+        async def run():
+            engine.client = session
+            engine.slot_freed = {engine.halo_scheduler.name: asyncio.Condition(),
+                                 engine.jira_scheduler.name: asyncio.Condition()}
+            await engine.create_jira_issue_chunk(jira_local, chunk, "CL")
+
+        asyncio.run(run())
+        assert [request[1] for request in session.requests] == ["/rest/api/2/issue/bulk", "/rest/api/2/issue"]
+        assert session.requests[1][2]["json"] == {"fields": {"summary": "2"}}
+        assert sorted(created_keys) == ["CL-1", "CL-2"]
+        return
+
+    def test_unit_async_engine_send_slot_freed_by_thread(self):
+        session = FakeSession({("GET", "/rest/api/2/myself"): (200, {"name": "user"})})
+        engine = self.engine()
+        engine.jira_scheduler = jlib.ServiceScheduler("jira", 1)
+        slot_taken = threading.Event()
+
+        def hold_slot():
+            with engine.jira_scheduler.slot():
+                slot_taken.set()
+                time.sleep(0.3)
+
+        async def run():
+            engine.client = session
+            engine.slot_freed = {engine.jira_scheduler.name: asyncio.Condition()}
+            thread = threading.Thread(target=hold_slot)
+            thread.start()
+            slot_taken.wait()
+            result = await asyncio.wait_for(engine.jira_request("GET", "myself"), 5)
+            thread.join()
+            return result
+
+        assert asyncio.run(run()) == {"name": "user"}
+        assert engine.jira_scheduler.in_flight == 0
+        return
+
+    def test_unit_async_engine_finish_created_issue_attachment(self):
+        session = FakeSession({
+            ("POST", "/rest/api/2/issue/CL-1/attachments"): (200, [{"id": "2"}]),
+            ("DELETE", "/rest/api/2/attachment/1"): (204, None),
+        })
+        engine = self.engine()
+        recorded = []
+        jira_local = SimpleNamespace(
+            log=jlib.Logger(),
+            record_created_issue=lambda prepared, project_key, jira_key, epic_link, pushed: recorded.append(
+                (jira_key, pushed))
+        )
+        prepared = jlib.PreparedIssue({"id": "a"}, {}, "hash", attachment=("halo-a-2.json.gz", b"content"))
+        attachments = [{"id": "1", "filename": "halo-a-1.json.gz"}, {"id": "3", "filename": "other.json.gz"}]
+
+        async def run():
+            engine.client = session
+            engine.slot_freed = {engine.jira_scheduler.name: asyncio.Condition()}
+            await engine.finish_created_issue(jira_local, prepared, "CL", "CL-1", None)
+            return await engine.sync_attachment(jira_local, "CL-1", attachments, prepared)
+
+        assert asyncio.run(run()) is True
+        assert [request[:2] for request in session.requests] == [
+            ("POST", "/rest/api/2/issue/CL-1/attachments"), ("POST", "/rest/api/2/issue/CL-1/attachments"),
+            ("DELETE", "/rest/api/2/attachment/1")
+        ]
+        assert session.requests[0][2]["headers"] == {"X-Atlassian-Token": "no-check"}
+        assert recorded == [("CL-1", True)]
+        return
+
+    def test_unit_async_engine_get_jira_issues_by_key(self):
+        session = FakeSession({("POST", "/rest/api/2/search"): (200, {
+            "issues": [{"key": "CL-1", "fields": {"customfield_1": "a"}}], "total": 1,
+            "warningMessages": ["An issue with key 'CL-2' does not exist for field 'key'."]
+        })})
+        engine = self.engine()
+        forgotten_keys = []
+        jira_local = SimpleNamespace(
+            lookup_page_size=50,
+            lookup=SimpleNamespace(get_issue_id=lambda issue: issue.raw["fields"]["customfield_1"]),
+            state_store=SimpleNamespace(forget_issue=lambda project_key, key: forgotten_keys.append(key))
+        )
+
+        async def run():
+            engine.client = session
+            engine.slot_freed = {engine.jira_scheduler.name: asyncio.Condition()}
+            return await engine.get_jira_issues_by_key(jira_local, "CL", {"a": ["CL-1"], "b": ["CL-2"]})
+
+        jira_issues_dict = asyncio.run(run())
+        assert session.requests[0][2]["json"]["jql"] == "key in (CL-1, CL-2)"
+        assert session.requests[0][2]["json"]["validateQuery"] == "warn"
+        assert {issue_id: [issue.key for issue in issues] for issue_id, issues in jira_issues_dict.items()} == {
+            "a": ["CL-1"]
+        }
+        assert forgotten_keys == ["CL-2"]
+        return
@@ -0,0 +1,112 @@
+import threading
+import time
+
+import pytest
+
+from jlib.cache import DiskCache, SingleFlightCache
+
+
+class TestUnitCache:
+    def test_unit_cache_single_flight_collapses_loads(self):
+        cache = SingleFlightCache()
+        calls = []
+        release = threading.Event()
+
+        def loader(key):
+            calls.append(key)
+            release.wait(5)
+            return {"id": key}
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(cache.get("url", loader, "url")))
+                   for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        time.sleep(0.1)
+        release.set()
+        for thread in threads:
+            thread.join()
+        assert calls == ["url"]
+        assert results == [{"id": "url"}] * 5
+        assert "url" in cache
+        return
+
+    def test_unit_cache_single_flight_does_not_cache_failure(self):
+        cache = SingleFlightCache()
+
+        def loader():
+            raise ValueError("boom")
+
+        with pytest.raises(ValueError):
+            cache.get("url", loader)
+        assert "url" not in cache
+        assert cache.get("url", lambda: 1) == 1
+        return
+
+    def test_unit_cache_single_flight_failure_reaches_waiters(self):
+        cache = SingleFlightCache()
+        calls = []
+        release = threading.Event()
+
+        def loader():
+            calls.append(1)
+            release.wait(5)
+            raise ValueError("boom")
+
+        errors = []
+
+        def get():
+            try:
+                cache.get("url", loader)
+            except ValueError as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=get) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        time.sleep(0.1)
+        release.set()
+        for thread in threads:
+            thread.join()
+        assert len(calls) == 1
+        assert len(errors) == 3
+        assert "url" not in cache
+        assert cache.get("url", lambda: 1) == 1
+        return
+
+    def test_unit_cache_single_flight_discard(self):
+        cache = SingleFlightCache()
+        calls = []
+
+        def loader(key):
+            calls.append(key)
+            return len(calls)
+
+        assert cache.get("url", loader, "url") == 1
+        assert cache.get("url", loader, "url") == 1
+        cache.discard(["url", "missing"])
+        assert "url" not in cache
+        assert cache.get("url", loader, "url") == 2
+        cache.clear()
+        assert cache.get("url", loader, "url") == 3
+        return
+
+    def test_unit_cache_disk_cache_ttl(self, tmp_path):
+        cache = DiskCache(str(tmp_path / "cache.db"), "assets", 60)
+        cache.set("url", {"id": "abc"})
+        assert cache.get("url") == {"id": "abc"}
+        assert cache.get("other") is None
+        cache.ttl = -1
+        assert cache.get("url") is None
+        return
+
+    def test_unit_cache_disk_cache_evict(self, tmp_path):
+        cache = DiskCache(str(tmp_path / "cache.db"), "cve_details", 60, max_entries=2)
+        for cve_id in ["CVE-1", "CVE-2", "CVE-3"]:
+            cache.set(cve_id, {"id": cve_id})
+            time.sleep(0.01)
+        cache.evict()
+        assert len(cache) == 2
+        assert cache.get("CVE-1") is None
+        assert cache.get("CVE-3") == {"id": "CVE-3"}
+        return
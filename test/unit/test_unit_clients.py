@@ -0,0 +1,52 @@
+from types import SimpleNamespace
+import jlib
+import jlib.clients
+from jlib.scheduler import ScheduledHTTPAdapter
+
+
+class FakeSession:
+    def __init__(self):
+        self.adapters = {}
+
+    def mount(self, prefix, adapter):
+        self.adapters[prefix] = adapter
+
+
+class FakeJira:
+    def __init__(self, server, **kwargs):
+        self.server = server
+        self.kwargs = kwargs
+        self._session = FakeSession()
+
+
+class TestUnitClients:
+    def test_unit_clients_get_jira(self, monkeypatch):
+        monkeypatch.setattr(jlib.clients, "JIRA", FakeJira)
+        jira = jlib.ClientRegistry.get_jira("https://jira.example.com", "user", "token")
+        assert jira.kwargs == {"basic_auth": ("user", "token"), "max_retries": 0}
+        assert all(isinstance(adapter, ScheduledHTTPAdapter) for adapter in jira._session.adapters.values())
+        assert sorted(jira._session.adapters) == ["http://", "https://"]
+        assert jlib.ClientRegistry.get_jira("https://jira.example.com", "user", "token") is jira
+        assert jlib.ClientRegistry.get_jira("https://jira.example.com", "user", "rotated") is not jira
+        assert all("token" not in key for key in jlib.ClientRegistry.clients)
+        scheduler = jlib.Scheduler.configure("jira", 2)
+        jlib.ClientRegistry.clear()
+        jira = jlib.ClientRegistry.get_jira("https://jira.example.com", "user", "token")
+        assert jira._session.adapters["https://"].scheduler is scheduler
+        jlib.ClientRegistry.clear()
+        jlib.Scheduler.clear()
+        return
+
+    def test_unit_clients_get_halo(self):
+        config = SimpleNamespace(halo_api_key="key", halo_api_secret_key="secret",
+                                 halo_api_hostname="api.cloudpassage.com", cache_db_path=None, asset_cache_ttl=0,
+                                 cve_cache_ttl=0, cve_cache_max_entries=None, describe_cache_ttl=0)
+        halo = jlib.ClientRegistry.get_halo(config)
+        assert jlib.ClientRegistry.get_halo(config) is halo
+        assert jlib.ClientRegistry.get_halo(SimpleNamespace(**dict(vars(config), halo_api_key="other"))) is not halo
+        rotated_config = SimpleNamespace(**dict(vars(config), halo_api_secret_key="rotated"))
+        assert jlib.ClientRegistry.get_halo(rotated_config) is not halo
+        jlib.ClientRegistry.clear()
+        assert jlib.ClientRegistry.get_halo(config) is not halo
+        jlib.ClientRegistry.clear()
+        return
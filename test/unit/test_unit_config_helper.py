@@ -1,4 +1,5 @@
 import jlib
+import jlib.config_helper
 import pytest
 
 
@@ -110,3 +111,75 @@ class TestUnitConfigHelper:
         desired = ""
         assert result == desired
         return
+
+
+class TestUnitConfigHelperValidation:
+    @staticmethod
+    def config_helper(**kwargs):
+        config = object.__new__(jlib.ConfigHelper)
+        config.logger = jlib.Logger()
+        config.halo_api_key = config.halo_api_secret_key = "secret"
+        config.halo_api_hostname = "api.cloudpassage.com"
+        config.jira_api_user = config.jira_api_token = "secret"
+        config.sync_engine = "threaded"
+        config.json_encoder = "json"
+        config.jira_fields_dict = {"halo_jira_id": "customfield_1"}
+        config.rules = [{"name": "rule", "jira_config": {
+            "project_keys": ["CL"], "jira_issue_id_field": "halo_jira_id", "jira_issue_type": "Bug",
+            "issue_status_active": "To Do", "issue_status_closed": "Done", "issue_status_reopened": "To Do"
+        }}]
+        for key, value in kwargs.items():
+            setattr(config, key, value)
+        return config
+
+    def test_unit_confighelper_validate_config(self):
+        assert self.config_helper().validate_config() is True
+        return
+
+    def test_unit_confighelper_validate_config_invalid_rule(self):
+        config = self.config_helper()
+        config.rules[0]["jira_config"]["payload_profile"] = "minimal"
+        assert config.validate_config() is False
+        return
+
+    def test_unit_confighelper_validate_config_invalid_lookup_strategy(self):
+        config = self.config_helper()
+        config.rules[0]["jira_config"]["lookup_strategy"] = "fuzzy"
+        assert config.validate_rules() is False
+        assert config.validate_jira_fields() is True
+        assert config.validate_config() is False
+        config.rules[0]["jira_config"]["lookup_strategy"] = "label"
+        assert config.validate_config() is True
+        return
+
+    def test_unit_confighelper_validate_config_invalid_update_mode(self):
+        config = self.config_helper()
+        config.rules[0]["jira_config"]["update_mode"] = "patch"
+        assert config.validate_config() is False
+        config.rules[0]["jira_config"]["update_mode"] = "diff"
+        assert config.validate_config() is True
+        return
+
+    def test_unit_confighelper_validate_config_json_encoder(self, monkeypatch):
+        assert self.config_helper(json_encoder="ujson").validate_config() is False
+        monkeypatch.setattr(jlib.config_helper, "orjson", None)
+        assert self.config_helper(json_encoder="orjson").validate_config() is False
+        assert self.config_helper(json_encoder="json").validate_config() is True
+        return
+
+    def test_unit_confighelper_validate_config_sync_engine(self):
+        assert self.config_helper(sync_engine="fibers").validate_settings() is False
+        assert self.config_helper(sync_engine="fibers").validate_config() is False
+        for sync_engine in ["threaded", "async", "streaming"]:
+            assert self.config_helper(sync_engine=sync_engine).validate_config() is True
+        return
+
+    def test_unit_confighelper_validate_config_partitions(self):
+        config = self.config_helper()
+        config.rules[0]["filters"] = {"issue": {"type": "sva"}, "partitions": [{"type": "sva"}, {"type": "csm"}]}
+        assert config.validate_config() is False
+        config.rules[0]["filters"] = {"issue": {"critical": True}, "partitions": [{"status": "active"}]}
+        assert config.validate_config() is False
+        config.rules[0]["filters"] = {"issue": {"critical": True}, "partitions": [{"type": "sva"}, {"type": "csm"}]}
+        assert config.validate_config() is True
+        return
@@ -0,0 +1,43 @@
+import pytest
+
+from jlib.filter_engine import FilterEngine, UnsupportedFilter
+
+
+class TestUnitFilterEngine:
+    issue = {"critical": True, "type": "sva", "max_cvss": 7.5, "os_type": "Linux", "status": "active",
+             "csp_tags": [{"key": "environment", "value": "production"}, {"key": "Name", "value": "web"}],
+             "cve_ids": ["CVE-2017-10685"]}
+
+    def test_unit_filter_engine_match(self):
+        predicate = FilterEngine.compile({"critical": True, "type": "sva,csm", "max_cvss_gte": 7.0,
+                                          "os_type": "linux", "csp_tags": {"environment": "production"},
+                                          "cve_id": ["CVE-2017-10684", "CVE-2017-10685"]})
+        assert predicate(self.issue) is True
+        return
+
+    def test_unit_filter_engine_no_match(self):
+        assert FilterEngine.compile({"max_cvss_gte": 8})(self.issue) is False
+        assert FilterEngine.compile({"csp_tags": {"environment": "development"}})(self.issue) is False
+        assert FilterEngine.compile({"status": "resolved"})(self.issue) is False
+        assert FilterEngine.compile({"group_name": "customer-success"})(self.issue) is False
+        return
+
+    def test_unit_filter_engine_unsupported(self):
+        with pytest.raises(UnsupportedFilter):
+            FilterEngine.compile({"since": "2020-01-01"})
+        with pytest.raises(UnsupportedFilter):
+            FilterEngine.compile({"name": "nameofissue"})
+        with pytest.raises(UnsupportedFilter):
+            FilterEngine.compile({"image_sha": None})
+        with pytest.raises(UnsupportedFilter):
+            FilterEngine.compile({"resolved_at_gte": "2020-01-01"})
+        return
+
+    def test_unit_filter_engine_union_filters(self):
+        result = FilterEngine.union_filters([
+            {"critical": True, "type": "sva", "max_cvss_gte": 7.0, "csp_tags": {"environment": "production"}},
+            {"critical": True, "type": "csm", "max_cvss_gte": 5.0, "csp_tags": {"environment": "development"}},
+        ])
+        desired = {"critical": "true", "type": "sva,csm", "max_cvss_gte": 5.0, "status": "active"}
+        assert result == desired
+        return
@@ -0,0 +1,31 @@
+import jlib
+
+
+class TestUnitFormatter:
+    def test_unit_formatter_format_description(self):
+        objects = [("issue", {"id": "1"}), ("server", {"name": "host"})]
+        desired = jlib.Formatter.format_object("issue", {"id": "1"}) + jlib.Formatter.format_object(
+            "server", {"name": "host"})
+        assert jlib.Formatter.format_description(objects) == desired
+        return
+
+    def test_unit_formatter_format_description_truncated(self):
+        objects = [("issue", {"id": "1"}), ("findings", {"findings": ["x" * 50] * 1000}), ("server", {})]
+        formatted = jlib.Formatter.format_description(objects, max_length=500)
+        assert len(formatted) == 500
+        assert formatted.endswith("{code}\n\n")
+        assert formatted.count("{code:JSON}") == formatted.count("{code}\n\n") == 2
+        return
+
+    def test_unit_formatter_payload_profile(self):
+        profile = jlib.Formatter.get_payload_profile("core")
+        issue = {"id": "1", "name": "Issue", "status": "active", "extended_attributes": {"cve_info": [{"detail": {}}]}}
+        assert jlib.Formatter.project(issue, profile.get("issue")) == {"id": "1", "name": "Issue", "status": "active"}
+        findings = {"id": "f", "status": "bad", "rule_name": "Rule", "rule_description": "...", "details": [{}]}
+        assert jlib.Formatter.project(findings, profile.get("findings")) == {"id": "f", "status": "bad",
+                                                                             "rule_name": "Rule"}
+        assert jlib.Formatter.project(issue, jlib.Formatter.get_payload_profile("full").get("findings")) is issue
+        assert jlib.Formatter.get_payload_profile({"asset": ["asset_name"]}) == {"asset": ["asset_name"]}
+        assert jlib.Formatter.get_payload_profile({"server": ["asset_name"]}) is None
+        assert jlib.Formatter.get_payload_profile("minimal") is None
+        return
@@ -0,0 +1,121 @@
+import json
+import pytest
+import jlib
+from jlib.cache import DiskCache
+
+
+class TestUnitHalo:
+    def test_unit_halo_enrich_memoized(self):
+        halo = jlib.Halo("key", "secret", "api.cloudpassage.com")
+        calls = []
+
+        def get_asset_and_findings(issues):
+            calls.extend(issue["id"] for issue in issues)
+            for issue in issues:
+                issue["asset"] = {"id": issue["asset_url"]}
+                issue["findings"] = None
+            return issues
+
+        halo.get_asset_and_findings = get_asset_and_findings
+        halo.get_cve_details = lambda issues: issues
+        halo.enrich([{"id": "1", "last_seen_at": "t1", "asset_url": "a", "extended_attributes": {}}])
+        issues = halo.enrich([{"id": "1", "last_seen_at": "t1", "asset_url": "a", "extended_attributes": {}},
+                              {"id": "1", "last_seen_at": "t2", "asset_url": "a", "extended_attributes": {}}])
+        assert calls == ["1", "1"]
+        assert issues[0]["asset"] == {"id": "a"}
+        halo.release(issues)
+        assert halo.enrichment_memo == {}
+        return
+
+    def test_unit_halo_list_issues_partitions(self):
+        halo = jlib.Halo("key", "secret", "api.cloudpassage.com")
+        listed = []
+
+        def list_all(**filters):
+            listed.append(filters)
+            return [{"id": "1"}, {"id": filters["type"]}]
+
+        halo.issue.list_all = list_all
+        issues = halo.list_issues({"critical": True}, [{"type": "sva"}, {"type": "csm"}])
+        assert sorted(issue["id"] for issue in issues) == ["1", "csm", "sva"]
+        assert all(filters["critical"] is True for filters in listed)
+        with pytest.raises(ValueError):
+            halo.list_issues({"type": "sva"}, [{"type": "sva"}, {"type": "csm"}])
+        return
+
+    def test_unit_halo_iter_issue_pages_partitions(self):
+        halo = jlib.Halo("key", "secret", "api.cloudpassage.com")
+        requested = []
+
+        def get(endpoint, params=None):
+            requested.append(params)
+            return {"issues": [{"id": "1"}, {"id": params["type"]}], "pagination": {}}
+
+        halo.http_helper.get = get
+        pages = list(halo.iter_issue_pages({"critical": True}, [{"type": "sva"}, {"type": "csm"}]))
+        assert [[issue["id"] for issue in page] for page in pages] == [["1", "sva"], ["csm"]]
+        assert requested == [{"critical": "true", "type": "sva"}, {"critical": "true", "type": "csm"}]
+        with pytest.raises(ValueError):
+            list(halo.iter_issue_pages({"type": "sva"}, [{"type": "csm"}]))
+        return
+
+    def test_unit_halo_get_issues_for_rules_uncapped(self):
+        halo = jlib.Halo("key", "secret", "api.cloudpassage.com")
+        pages = {f"/v3/issues?page={n}": {"issues": [{"id": str(n), "status": "active", "type": "sva"}],
+                                          "pagination": {"next": f"/v3/issues?page={n + 1}"} if n < 25 else {}}
+                 for n in range(1, 26)}
+        pages["/v3/issues"] = pages.pop("/v3/issues?page=1")
+
+        def get(endpoint, params=None):
+            return pages[endpoint]
+
+        halo.http_helper.get = get
+        rules = [{"name": "sva", "filters": {"issue": {"type": "sva"}}},
+                 {"name": "csm", "filters": {"issue": {"type": "csm"}}}]
+        issues_by_rule = halo.get_issues_for_rules(rules)
+        assert len(issues_by_rule["sva"]) == 25
+        assert issues_by_rule["csm"] == []
+        return
+
+    def test_unit_halo_get_conditional(self, tmp_path):
+        class FakeResponse:
+            def __init__(self, status_code, body=None, headers=None):
+                self.status_code = status_code
+                self.body = body
+                self.text = json.dumps(body)
+                self.headers = headers or {}
+
+            def json(self):
+                return self.body
+
+        sent_headers = []
+        responses = [FakeResponse(200, {"server": {"id": "s1"}}, {"ETag": '"v1"'}), FakeResponse(304),
+                     FakeResponse(200, {"server": {"id": "s2"}})]
+
+        def get(url, headers=None):
+            sent_headers.append(headers)
+            return responses.pop(0)
+
+        halo = jlib.Halo("key", "secret", "api.cloudpassage.com")
+        halo.session.auth_token = "token"
+        halo.session.client.get = get
+        halo.describe_body_cache = DiskCache(str(tmp_path / "cache.db"), "describe_bodies", 60)
+        assert halo.get_conditional("/v1/servers/s1") == {"server": {"id": "s1"}}
+        assert halo.get_conditional("/v1/servers/s1") == {"server": {"id": "s1"}}
+        halo.describe_body_cache.ttl = -1
+        assert halo.get_conditional("/v1/servers/s1") == {"server": {"id": "s2"}}
+        assert sent_headers == [{}, {"If-None-Match": '"v1"'}, {}]
+        return
+
+    def test_unit_halo_get_asset_and_findings_evicts(self, tmp_path):
+        halo = jlib.Halo("key", "secret", "api.cloudpassage.com", str(tmp_path / "cache.db"), asset_cache_ttl=60)
+        halo.asset_cache.set("https://api.cloudpassage.com/v1/servers/old", {"id": "old"})
+        halo.asset_cache.ttl = -1
+        halo.describe = lambda url: {"id": url.rsplit("/", 1)[-1]}
+        issues = halo.get_asset_and_findings([
+            {"id": "1", "asset_url": "https://api.cloudpassage.com/v1/servers/s1", "extended_attributes": {}}
+        ])
+        assert issues[0]["asset"] == {"id": "s1"}
+        assert len(halo.asset_cache) == 0
+        halo.asset_cache.close()
+        return
@@ -0,0 +1,16 @@
+import jlib
+
+
+class TestUnitIssueStore:
+    def test_unit_issue_store_read_back(self, tmp_path):
+        issue_store = jlib.IssueStore(str(tmp_path / "spill"))
+        issue_store.extend([{"id": str(x), "asset": {"name": "host"}} for x in range(5)])
+        assert len(issue_store) == 5
+        assert issue_store[3] == {"id": "3", "asset": {"name": "host"}}
+        assert [len(batch) for batch in issue_store.iter_batches(2)] == [2, 2, 1]
+        assert [issue["id"] for issue in issue_store] == ["0", "1", "2", "3", "4"]
+        issue_store[0].pop("asset")
+        assert "asset" in issue_store[0]
+        issue_store.close()
+        assert list((tmp_path / "spill").iterdir()) == []
+        return
@@ -0,0 +1,204 @@
+import gzip
+import json
+import pytest
+import jlib
+from jira.exceptions import JIRAError
+import requests
+
+
+@pytest.fixture
+def make_jira_local():
+    """Return a factory of jlib.JiraLocal() objects without a Jira client, clearing the client registry after."""
+    jlib.ClientRegistry.clients[jlib.ClientRegistry.get_key("jira", "user", "https://jira.example.com", "token")] = None
+
+    def make_jira_local(state_store=None, fields=None, jira_fields=None, **jira_config):
+        rule = {"name": "rule", "jira_config": dict(jira_issue_id_field="Halo Issue ID", jira_issue_type="Task",
+                                                    **jira_config)}
+        if fields:
+            rule["fields"] = fields
+        jira_fields_dict = dict({"Halo Issue ID": "customfield_1", "Epic Link": "customfield_2"}, **(jira_fields or {}))
+        return jlib.JiraLocal("https://jira.example.com", "user", "token", rule, jira_fields_dict, state_store)
+
+    yield make_jira_local
+    jlib.ClientRegistry.clear()
+
+
+@pytest.fixture
+def state_store(tmp_path):
+    state_store = jlib.StateStore(str(tmp_path / "state.db"))
+    yield state_store
+    state_store.close()
+
+
+class TestUnitJiraLocal:
+    def test_unit_jira_local_parse_bulk_create_response(self):
+        raw_issue_json = {
+            "issues": [{"id": "10001", "key": "CL-1"}, {"id": "10003", "key": "CL-3"}],
+            "errors": [{"status": 400, "failedElementNumber": 1,
+                        "elementErrors": {"errors": {"summary": "Summary is required."}}}]
+        }
+        desired = [("CL-1", None), (None, {"summary": "Summary is required."}), ("CL-3", None)]
+        assert jlib.JiraLocal.parse_bulk_create_response(raw_issue_json, 3) == desired
+        return
+
+    def test_unit_jira_local_render_issue(self, make_jira_local):
+        jira_local = make_jira_local()
+        issue = {"id": "1", "name": "Issue", "asset_type": "server", "status": "active",
+                 "asset": {"id": "a"}, "findings": {"id": "f"}}
+        prepared = jira_local.render_issue(issue, {}, jira_local.jira_fields_dict, "hash")
+        assert issue["asset"] == {"id": "a"} and issue["findings"] == {"id": "f"}
+        assert "asset" not in prepared.issue
+        assert prepared.fields["summary"] == "Issue"
+        for project_key in ["CL", "OPS"]:
+            issue_dict = jira_local.get_create_fields(prepared, "EPIC-1", project_key)
+            assert issue_dict["project"] == {"key": project_key}
+            assert issue_dict["customfield_1"] == "1"
+        assert "customfield_1" not in prepared.fields
+        return
+
+    def test_unit_jira_local_render_issue_attachment(self, make_jira_local):
+        jira_local = make_jira_local(attach_details=True)
+        cve_info = [{"id": "CVE-1", "detail": {"summary": "Overflow in parser"}}]
+        issue = {"id": "1", "name": "Issue", "asset_type": "server", "status": "active",
+                 "extended_attributes": {"cve_info": cve_info},
+                 "asset": {"id": "a", "asset_name": "web-1", "kernel_modules": ["ext4"]}, "findings": {"id": "f"}}
+        prepared = jira_local.render_issue(issue, {}, jira_local.jira_fields_dict)
+        filename, content = prepared.attachment
+        assert filename.startswith("halo-1-") and filename.endswith(".json.gz")
+        assert json.loads(gzip.decompress(content)) == {
+            "asset": issue["asset"], "findings": {"id": "f"}, "extended_attributes": {"cve_info": cve_info}
+        }
+        description = prepared.fields["description"]
+        assert f"[^{filename}]" in description
+        assert "web-1" in description
+        assert "h2. findings" not in description
+        assert "Overflow in parser" not in description and "kernel_modules" not in description
+        assert jira_local.render_issue(issue, {}, jira_local.jira_fields_dict).attachment[0] == filename
+        jira_local = make_jira_local(attach_details=True, payload_profile={"asset": ["kernel_modules"]})
+        description = jira_local.render_issue(issue, {}, jira_local.jira_fields_dict).fields["description"]
+        assert "kernel_modules" in description and "web-1" not in description
+        assert "Overflow in parser" not in description
+        return
+
+    def test_unit_jira_local_classify_change(self, make_jira_local, state_store):
+        class FakeJiraIssue:
+            key = "CL-1"
+            raw = {"fields": {"project": {"key": "CL"}, "status": {"name": "To Do"}}}
+
+        jira_local = make_jira_local(state_store, issue_status_closed="Done", issue_status_reopened="To Do",
+                                     status_fast_path=True)
+        state_store.record_issue("1", "CL", "CL-1", status="active", last_seen_at="t1", payload_hash="hash")
+        issue = {"id": "1", "status": "active", "last_seen_at": "t1"}
+        assert jira_local.classify_change(issue, [[FakeJiraIssue()]]) == "unchanged"
+        assert jira_local.classify_change(dict(issue, status="resolved"), [[FakeJiraIssue()]]) == "status"
+        assert jira_local.classify_change(dict(issue, last_seen_at="t2"), [[FakeJiraIssue()]]) == "content"
+        assert jira_local.classify_change(issue, [[FakeJiraIssue()], []]) == "content"
+        prepared = jira_local.prepare_change(dict(issue, status="resolved"), {}, jira_local.jira_fields_dict, "status")
+        assert prepared.fields is None and prepared.issue["status"] == "resolved"
+        issues = [issue, dict(issue, status="resolved"), dict(issue, last_seen_at="t2"),
+                  {"id": "2", "status": "active"}]
+        assert jira_local.get_changed_issues(issues, ["CL"]) == issues[2:]
+        assert jira_local.get_changed_issues(issues[:2], ["CL", "OPS"]) == issues[:2]
+        return
+
+    def test_unit_jira_local_cleanup_epics_from_state(self, make_jira_local, state_store):
+        class FakeJiraIssue:
+            raw = {"fields": {"customfield_2": "CL-9"}}
+
+        class FakeJira:
+            def search_issues(self, jql, fields=None, maxResults=50, validate_query=True):
+                assert jql == '"Epic Link" in (CL-9, CL-10, CL-11) AND resolution = Unresolved'
+                if validate_query:
+                    raise JIRAError(status_code=400, text="An issue with key 'CL-11' does not exist")
+                return [FakeJiraIssue()]
+
+        jira_local = make_jira_local(state_store)
+        jira_local.jira_instance = FakeJira()
+        closed_epic_keys = []
+        jira_local.close_epic = closed_epic_keys.append
+        state_store.record_epic("hash1", "CL", "CL-9")
+        state_store.record_epic("hash2", "CL", "CL-10")
+        state_store.record_epic("hash3", "CL", "CL-11")
+        state_store.record_issue("abc", "CL", "CL-1", epic_key="CL-9", status="resolved")
+        jira_local.cleanup_epics_from_state(["CL"])
+        assert sorted(closed_epic_keys) == ["CL-10", "CL-11"]
+        return
+
+    def test_unit_jira_local_failed_attachment_not_recorded(self, make_jira_local, state_store):
+        class FakeJira:
+            def add_attachment(self, jira_key, attachment=None, filename=None):
+                raise JIRAError(text="Attachments are disabled")
+
+        jira_local = make_jira_local(state_store, attach_details=True)
+        jira_local.jira_instance = FakeJira()
+        issue = {"id": "1", "name": "Issue", "asset_type": "server", "status": "active", "last_seen_at": "t1",
+                 "asset": {"id": "a"}, "findings": {"id": "f"}}
+        prepared = jira_local.render_issue(issue, {}, jira_local.jira_fields_dict)
+        assert jira_local.sync_attachment("CL-1", [{"filename": prepared.attachment[0]}], prepared) is True
+        jira_local.finish_created_issue(prepared, "CL", "CL-1", None)
+        issue_state = state_store.get_issue_state("1", "CL", "CL-1")
+        assert issue_state["status"] == "active"
+        assert issue_state["payload_hash"] is None and issue_state["last_seen_at"] is None
+        assert "CL-1" not in jira_local.pushed_payload_hashes
+        return
+
+    def test_unit_jira_local_create_jira_issues_fallback(self, make_jira_local):
+        jira_local = make_jira_local(bulk_create_size=1)
+        bulk_results = {"1": requests.exceptions.ConnectionError("Connection reset"), "2": [(None, "error")],
+                        "3": [("CL-3", None)], "4": KeyError("issues")}
+
+        def bulk_create(field_dicts):
+            result = bulk_results[field_dicts[0]["customfield_1"]]
+            if isinstance(result, Exception):
+                raise result
+            return result
+
+        retried_ids = []
+
+        def create_prepared_issue(prepared, epic_link, issue_dict, project_key):
+            retried_ids.append(prepared.issue["id"])
+            return prepared.issue["id"] == "1"
+
+        created_keys = []
+        jira_local.bulk_create = bulk_create
+        jira_local.create_prepared_issue = create_prepared_issue
+        jira_local.finish_created_issue = lambda prepared, project_key, jira_key, epic_link: \
+            created_keys.append(jira_key)
+        prepared_issues = [jlib.PreparedIssue({"id": issue_id}, {"summary": issue_id}, "hash") for issue_id in "1234"]
+        jira_local.create_jira_issues([(prepared, None) for prepared in prepared_issues], "CL")
+        assert sorted(retried_ids) == ["1", "2"]
+        assert created_keys == ["CL-3"]
+        return
+
+    def test_unit_jira_local_get_jira_issue_index(self, make_jira_local):
+        class FakeResults(list):
+            total = 3
+
+        class FakeJiraIssue:
+            def __init__(self, key, issue_id):
+                self.key = key
+                self.raw = {"fields": {"customfield_1": issue_id}}
+
+        class FakeJira:
+            def __init__(self):
+                self.searches = []
+
+            def search_issues(self, jql, startAt=0, maxResults=50, fields=None):
+                self.searches.append((startAt, fields))
+                issues = [FakeJiraIssue("CL-1", "a"), FakeJiraIssue("CL-2", "b"), FakeJiraIssue("CL-3", "a")]
+                return FakeResults(issues[startAt:startAt + maxResults])
+
+        jira_local = make_jira_local(lookup_page_size=2)
+        jira_local.jira_instance = FakeJira()
+        jira_issue_index = jira_local.get_jira_issue_index("CL")
+        assert {issue_id: [issue.key for issue in issues] for issue_id, issues in jira_issue_index.items()} == {
+            "a": ["CL-1", "CL-3"], "b": ["CL-2"]
+        }
+        index_fields = ["customfield_1", "project", "status", "customfield_2"]
+        assert jira_local.jira_instance.searches == [(0, index_fields), (2, index_fields)]
+        jira_local = make_jira_local(fields={"static": {"Priority": "High"}}, jira_fields={"Priority": "priority"},
+                                     update_mode="diff", lookup_strategy="label")
+        assert jira_local.index_fields == index_fields[:1] + ["labels"] + index_fields[1:] + [
+            "summary", "description", "priority"
+        ]
+        return
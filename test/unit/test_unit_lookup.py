@@ -0,0 +1,49 @@
+from jlib.lookup import get_lookup_strategy, LabelLookup, TextFieldLookup
+
+
+class FakeJiraIssue(object):
+    def __init__(self, fields):
+        self.raw = {"fields": fields}
+
+
+class TestUnitLookup:
+    jira_fields_dict = {"halo_jira_id": "customfield_1", "customfield_1": "customfield_1",
+                        "Labels": "labels", "labels": "labels"}
+
+    def test_unit_lookup_default_text(self):
+        result = get_lookup_strategy({"jira_issue_id_field": "halo_jira_id"}, self.jira_fields_dict)
+        assert isinstance(result, TextFieldLookup)
+        assert result.match_clause("abc") == '"halo_jira_id"~abc'
+        return
+
+    def test_unit_lookup_text_get_issue_id(self):
+        strategy = get_lookup_strategy({"jira_issue_id_field": "halo_jira_id"}, self.jira_fields_dict)
+        result = strategy.get_issue_id(FakeJiraIssue({"customfield_1": " abc "}))
+        assert result == "abc"
+        return
+
+    def test_unit_lookup_label_clause(self):
+        config = {"jira_issue_id_field": "halo_jira_id", "lookup_strategy": "label"}
+        strategy = get_lookup_strategy(config, self.jira_fields_dict)
+        assert isinstance(strategy, LabelLookup)
+        assert strategy.match_clause("abc") == '"labels" = "halo-abc"'
+        assert strategy.fallback_clause("abc") == '"halo_jira_id"~abc'
+        return
+
+    def test_unit_lookup_label_apply_keeps_labels(self):
+        config = {"jira_issue_id_field": "halo_jira_id", "lookup_strategy": "label"}
+        strategy = get_lookup_strategy(config, self.jira_fields_dict)
+        result = strategy.apply({"labels": ["security"]}, "abc")
+        desired = {"labels": ["security", "halo-abc"], "customfield_1": "abc"}
+        assert result == desired
+        return
+
+    def test_unit_lookup_label_needs_migration(self):
+        config = {"jira_issue_id_field": "halo_jira_id", "lookup_strategy": "label"}
+        strategy = get_lookup_strategy(config, self.jira_fields_dict)
+        jira_issue = FakeJiraIssue({"customfield_1": "abc", "labels": []})
+        assert strategy.get_issue_id(jira_issue) == "abc"
+        assert strategy.needs_migration(jira_issue, "abc") is True
+        jira_issue = FakeJiraIssue({"customfield_1": "abc", "labels": ["halo-abc"]})
+        assert strategy.needs_migration(jira_issue, "abc") is False
+        return
@@ -0,0 +1,31 @@
+from jlib.mapper import diff_fields
+
+
+class TestUnitMapper:
+    def test_unit_mapper_diff_fields_unchanged(self):
+        prepared = {"summary": "Package vulnerable ",
+                    "description": "h2. issue\r\n{code}\n\n",
+                    "duedate": "2020-02-03T07:31:08.237537+00:00",
+                    "priority": {"name": "High"},
+                    "labels": ["b", "a"],
+                    "customfield_1": None}
+        current = {"summary": "Package vulnerable",
+                   "description": "h2. issue\n{code}",
+                   "duedate": "2020-02-03",
+                   "priority": {"name": "High", "id": "2"},
+                   "labels": ["a", "b"]}
+        assert diff_fields(prepared, current) == {}
+        return
+
+    def test_unit_mapper_diff_fields_changed(self):
+        prepared = {"summary": "a", "customfield_1": "True", "duedate": "2020-02-04T07:31:08+00:00"}
+        current = {"summary": "a", "customfield_1": "False", "duedate": "2020-02-03"}
+        desired = {"customfield_1": "True", "duedate": "2020-02-04T07:31:08+00:00"}
+        assert diff_fields(prepared, current) == desired
+        return
+
+    def test_unit_mapper_diff_fields_datetime_precision(self):
+        prepared = {"customfield_2": "2020-02-03T07:31:08.237537+00:00"}
+        current = {"customfield_2": "2020-02-03T07:31:08.237+0000"}
+        assert diff_fields(prepared, current) == {}
+        return
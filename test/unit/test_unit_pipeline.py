@@ -0,0 +1,98 @@
+import threading
+import time
+import pytest
+import jlib
+
+
+class FakeHalo:
+    def __init__(self, pages):
+        self.pages = pages
+        self.pages_listed = 0
+        self.issue_filters = None
+        self.released = []
+
+    def iter_issue_pages(self, issue_filters, partitions=None):
+        self.issue_filters = issue_filters
+        for page in self.pages:
+            self.pages_listed += 1
+            yield [dict(issue) for issue in page]
+
+    def release(self, issues):
+        self.released.extend(issue["id"] for issue in issues)
+
+
+class FakeReconciler:
+    rule = {"name": "rule", "filters": {"issue": {"type": "sva"}}}
+
+    def __init__(self, fail_on=None):
+        self.fail_on = fail_on
+        self.batches = []
+
+    def enrich(self, halo_issues):
+        if any(issue["id"] == self.fail_on for issue in halo_issues):
+            raise RuntimeError("enrichment failed")
+        return halo_issues
+
+    def reconcile_batch(self, halo_issues, caches):
+        self.batches.append([issue["id"] for issue in halo_issues])
+
+
+class TestUnitPipeline:
+    def test_unit_pipeline_stage(self):
+        pipeline = jlib.StreamingPipeline(None, None, queue_size=1)
+        pages = pipeline.stage(iter([[1, 2], [3]]))
+        assert list(pipeline.stage(pages, lambda page: [x * 2 for x in page])) == [[2, 4], [6]]
+        return
+
+    def test_unit_pipeline_stage_error(self):
+        def pages():
+            yield [1]
+            raise ValueError("listing failed")
+
+        pipeline = jlib.StreamingPipeline(None, None)
+        with pytest.raises(ValueError):
+            list(pipeline.stage(pipeline.stage(pages()), len))
+        return
+
+    def test_unit_pipeline_stage_bounded(self):
+        produced = []
+
+        def pages():
+            for page in range(10):
+                produced.append(page)
+                yield [page]
+
+        pipeline = jlib.StreamingPipeline(None, None, queue_size=1)
+        output = pipeline.stage(pages())
+        assert next(output) == [0]
+        time.sleep(0.2)
+        # One page consumed, one queued and one waiting to be queued.
+        assert len(produced) <= 3
+        assert list(output) == [[page] for page in range(1, 10)]
+        return
+
+    def test_unit_pipeline_run(self):
+        halo = FakeHalo([[{"id": "1"}, {"id": "2"}], [{"id": "3"}]])
+        reconciler = FakeReconciler()
+        pipeline = jlib.StreamingPipeline(halo, reconciler, queue_size=1)
+        assert pipeline.run("2020-01-01T00:00:00.000000Z") == 3
+        assert halo.issue_filters == {"type": "sva", "last_seen_at_gte": "2020-01-01T00:00:00.000000Z"}
+        assert reconciler.batches == [["1", "2"], ["3"]]
+        assert halo.released == ["1", "2", "3"]
+        return
+
+    def test_unit_pipeline_run_error_stops_stages(self):
+        halo = FakeHalo([[{"id": str(page)}] for page in range(100)])
+        reconciler = FakeReconciler(fail_on="1")
+        threads_before = threading.active_count()
+        pipeline = jlib.StreamingPipeline(halo, reconciler, queue_size=1)
+        with pytest.raises(RuntimeError):
+            pipeline.run()
+        assert pipeline.stopped.is_set()
+        for _ in range(20):
+            if threading.active_count() <= threads_before:
+                break
+            time.sleep(0.1)
+        assert threading.active_count() <= threads_before
+        assert halo.pages_listed < 100
+        return
@@ -0,0 +1,104 @@
+from types import SimpleNamespace
+import jlib
+
+
+class FakeJiraIssue:
+    def __init__(self, key):
+        self.key = key
+        self.raw = {"fields": {"project": {"key": "CL"}, "status": {"name": "To Do"}}}
+
+
+class FakeHalo:
+    def __init__(self, listed_issues):
+        self.listed_issues = listed_issues
+        self.listed_filters = []
+        self.enriched_ids = []
+
+    def list_issues(self, issue_filters, partitions=None):
+        self.listed_filters.append(issue_filters)
+        return self.listed_issues
+
+    def enrich(self, issues):
+        for issue in issues:
+            issue["asset"] = {"id": "a"}
+            issue["findings"] = None
+        self.enriched_ids.extend(issue["id"] for issue in issues)
+        return issues
+
+
+class TestUnitReconciler:
+    @staticmethod
+    def reconciler(halo, state_store=None):
+        reconciler = object.__new__(jlib.Reconciler)
+        reconciler.logger = jlib.Logger()
+        reconciler.halo = halo
+        reconciler.rule = {"name": "rule", "filters": {"issue": {"type": "sva"}}}
+        reconciler.state_store = state_store
+        reconciler.since_filter = "last_seen_at_gte"
+        reconciler.describe_halo_issues = lambda issue_ids: [{"id": issue_id} for issue_id in sorted(issue_ids)]
+        return reconciler
+
+    def test_unit_reconciler_get_jira_halo_issues_full_pass(self):
+        halo = FakeHalo([{"id": "1", "status": "resolved"}, {"id": "9", "status": "resolved"}])
+        reconciler = self.reconciler(halo)
+        jira_issues_dict = {"1": [FakeJiraIssue("CL-1")], "2": [FakeJiraIssue("CL-2")]}
+        issues = reconciler.get_jira_halo_issues(jira_issues_dict)
+        assert halo.listed_filters == [{"type": "sva", "status": "resolved"}]
+        assert [issue["id"] for issue in issues] == ["1", "2"]
+        return
+
+    def test_unit_reconciler_get_jira_halo_issues_since(self, tmp_path):
+        state_store = jlib.StateStore(str(tmp_path / "state.db"))
+        state_store.record_issue("2", "CL", "CL-2", status="resolved", last_seen_at="2020-01-01T00:00:00.000000Z")
+        state_store.record_issue("3", "CL", "CL-3", status="active", last_seen_at="2020-01-03T00:00:00.000000Z")
+        # Resolved in Halo between runs, without being seen again.
+        state_store.record_issue("5", "CL", "CL-5", status="active", last_seen_at="2020-01-01T00:00:00.000000Z")
+        halo = FakeHalo([{"id": "1", "status": "active"}])
+        reconciler = self.reconciler(halo, state_store)
+        reconciler.describe_halo_issues = lambda issue_ids: [
+            {"id": issue_id, "status": "resolved" if issue_id == "5" else "active"} for issue_id in sorted(issue_ids)
+        ]
+        jira_issues_dict = {issue_id: [FakeJiraIssue(f"CL-{issue_id}")] for issue_id in ["1", "2", "3", "4", "5"]}
+        issues = reconciler.get_jira_halo_issues(jira_issues_dict, "2020-01-02T00:00:00.000000Z")
+        assert halo.listed_filters == [
+            {"type": "sva", "status": "active,resolved", "last_seen_at_gte": "2020-01-02T00:00:00.000000Z"}
+        ]
+        assert [issue["id"] for issue in issues] == ["1", "3", "4", "5"]
+        assert issues[-1]["status"] == "resolved"
+        state_store.close()
+        return
+
+    def test_unit_reconciler_prepare_tracked_issues_status_only(self, tmp_path):
+        state_store = jlib.StateStore(str(tmp_path / "state.db"))
+        state_store.record_issue("1", "CL", "CL-1", status="active", last_seen_at="t1", payload_hash="hash")
+        state_store.record_issue("2", "CL", "CL-2", status="active", last_seen_at="t1", payload_hash="hash")
+        jira_key = jlib.ClientRegistry.get_key("jira", "user", "https://jira.example.com", "token")
+        jlib.ClientRegistry.clients[jira_key] = None
+        try:
+            rule = {"name": "rule", "jira_config": {
+                "project_keys": ["CL"], "jira_issue_id_field": "Halo Issue ID", "jira_issue_type": "Task",
+                "issue_status_closed": "Done", "issue_status_reopened": "To Do", "status_fast_path": True
+            }}
+            jira_fields_dict = {"Halo Issue ID": "customfield_1", "Epic Link": "customfield_2"}
+            halo = FakeHalo([])
+            reconciler = self.reconciler(halo, state_store)
+            reconciler.rule = rule
+            reconciler.config = SimpleNamespace(jira_fields_dict=jira_fields_dict)
+            reconciler.jira = jlib.JiraLocal("https://jira.example.com", "user", "token", rule, jira_fields_dict,
+                                             state_store)
+            halo_issues = [
+                {"id": "1", "name": "Issue", "asset_type": "server", "status": "resolved", "last_seen_at": "t1"},
+                {"id": "2", "name": "Issue", "asset_type": "server", "status": "active", "last_seen_at": "t2"},
+            ]
+            reconciler.enrich(halo_issues)
+            assert halo.enriched_ids == ["2"]
+            jira_issues_dict = {"1": [FakeJiraIssue("CL-1")], "2": [FakeJiraIssue("CL-2")]}
+            prepared_issues = reconciler.prepare_tracked_issues(halo_issues, {}, jira_issues_dict)
+            assert [(prepared.issue["id"], prepared.fields is None) for prepared in prepared_issues] == [
+                ("1", True), ("2", False)
+            ]
+            assert reconciler.jira.get_transition_name(prepared_issues[0].issue, FakeJiraIssue("CL-1")) == "Done"
+        finally:
+            jlib.ClientRegistry.clear()
+            state_store.close()
+        return
@@ -0,0 +1,61 @@
+import io
+import requests
+from requests.adapters import HTTPAdapter
+import jlib
+from jlib.scheduler import ScheduledHTTPAdapter, TokenBucket
+
+
+class TestUnitScheduler:
+    def get_response(self, status_code, headers=None):
+        response = requests.Response()
+        response.status_code = status_code
+        response.raw = io.BytesIO(b"")
+        response.headers.update(headers or {})
+        return response
+
+    def test_unit_scheduler_token_bucket(self):
+        bucket = TokenBucket(2, burst=2)
+        assert bucket.reserve() == 0
+        assert bucket.reserve() == 0
+        assert 0.4 < bucket.reserve() <= 0.5
+        assert TokenBucket(0).reserve() == 0
+        return
+
+    def test_unit_scheduler_should_retry(self):
+        scheduler = jlib.ServiceScheduler("jira", 2, max_retries=2)
+        assert scheduler.should_retry("POST", 429, 0)
+        assert scheduler.should_retry("GET", 503, 1)
+        assert not scheduler.should_retry("POST", 503, 0)
+        assert not scheduler.should_retry("GET", 404, 0)
+        assert not scheduler.should_retry("GET", 429, 2)
+        return
+
+    def test_unit_scheduler_parse_retry_after(self):
+        assert jlib.ServiceScheduler.parse_retry_after("3") == 3.0
+        assert jlib.ServiceScheduler.parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT") == 0.0
+        assert jlib.ServiceScheduler.parse_retry_after(None) is None
+        assert jlib.ServiceScheduler.parse_retry_after("soon") is None
+        return
+
+    def test_unit_scheduler_adapter_retries_throttled(self, monkeypatch):
+        responses = [self.get_response(429, {"Retry-After": "0"}), self.get_response(200)]
+        monkeypatch.setattr(HTTPAdapter, "send", lambda self, request, **kwargs: responses.pop(0))
+        adapter = ScheduledHTTPAdapter(jlib.ServiceScheduler("jira", 2))
+        request = requests.Request("POST", "https://jira.example.com/rest/api/2/issue", data="{}").prepare()
+        assert adapter.send(request).status_code == 200
+        assert responses == []
+        return
+
+    def test_unit_scheduler_adaptive_limit(self):
+        scheduler = jlib.ServiceScheduler("halo", 8, adaptive=True, min_concurrency=2)
+        assert scheduler.limit == 4
+        for _ in range(20):
+            scheduler.record(200, 0.1)
+        assert scheduler.get_stats()["limit"] == 7
+        scheduler.record(429, 0.1)
+        assert scheduler.get_stats()["limit"] == 3
+        assert scheduler.get_stats()["history"][-1]["reason"] == "status 429"
+        scheduler.decreased_at = 0
+        scheduler.record(200, 5)
+        assert scheduler.get_stats()["limit"] == 2
+        return
@@ -0,0 +1,69 @@
+import jlib
+
+
+class TestUnitStateStore:
+    def get_state_store(self, tmp_path):
+        return jlib.StateStore(str(tmp_path / "state" / "state.db"))
+
+    def test_unit_state_store_record_issue(self, tmp_path):
+        state_store = self.get_state_store(tmp_path)
+        state_store.record_issue("abc", "CL", "CL-1", epic_key="CL-9", status="active")
+        state_store.record_issue("abc", "CL", "CL-1", payload_hash="123")
+        result = state_store.get_issue_states("CL")["abc"][0]
+        assert result["jira_key"] == "CL-1"
+        assert result["epic_key"] == "CL-9"
+        assert result["status"] == "active"
+        assert result["payload_hash"] == "123"
+        assert state_store.get_issue_states("DEV") == {}
+        assert state_store.get_issue_state("abc", "CL", "CL-1")["payload_hash"] == "123"
+        assert state_store.get_issue_state("abc", "CL", "CL-2") is None
+        return
+
+    def test_unit_state_store_issue_states_by_id(self, tmp_path):
+        state_store = self.get_state_store(tmp_path)
+        state_store.query_chunk_size = 2
+        for i in range(5):
+            state_store.record_issue(f"id{i}", "CL", f"CL-{i}")
+        state_store.record_issue("id0", "DEV", "DEV-1")
+        result = state_store.get_issue_states("CL", ["id0", "id2", "id4", "missing"])
+        assert sorted(result) == ["id0", "id2", "id4"]
+        assert [state["jira_key"] for state in result["id0"]] == ["CL-0"]
+        assert state_store.get_issue_states("CL", []) == {}
+        return
+
+    def test_unit_state_store_issue_states_beyond_parameter_limit(self, tmp_path):
+        state_store = self.get_state_store(tmp_path)
+        halo_issue_ids = [f"id{i}" for i in range(1200)]
+        for halo_issue_id in halo_issue_ids[::100]:
+            state_store.record_issue(halo_issue_id, "CL", f"CL-{halo_issue_id}")
+        result = state_store.get_issue_states("CL", halo_issue_ids)
+        assert sorted(result) == sorted(halo_issue_ids[::100])
+        return
+
+    def test_unit_state_store_forget_issue(self, tmp_path):
+        state_store = self.get_state_store(tmp_path)
+        state_store.record_issue("abc", "CL", "CL-1")
+        state_store.forget_issue("CL", "CL-1")
+        assert state_store.get_issue_states("CL") == {}
+        return
+
+    def test_unit_state_store_unused_epics(self, tmp_path):
+        state_store = self.get_state_store(tmp_path)
+        state_store.record_epic("hash1", "CL", "CL-9")
+        state_store.record_epic("hash2", "CL", "CL-10")
+        state_store.record_issue("abc", "CL", "CL-1", epic_key="CL-9", status="active")
+        state_store.record_issue("def", "CL", "CL-2", epic_key="CL-10", status="resolved")
+        assert state_store.get_unused_epic_keys(["CL"]) == ["CL-10"]
+        state_store.close_epic("CL-10")
+        assert state_store.get_epic_keys("CL") == {"hash1": "CL-9"}
+        assert state_store.get_unused_epic_keys(["CL"]) == []
+        return
+
+    def test_unit_state_store_watermark(self, tmp_path):
+        state_store = self.get_state_store(tmp_path)
+        assert state_store.get_watermark("rule.yaml") == (None, None)
+        state_store.set_watermark("rule.yaml", "2020-01-01T00:00:00.000000Z", full_sync=True)
+        state_store.set_watermark("rule.yaml", "2020-01-02T00:00:00.000000Z")
+        desired = ("2020-01-02T00:00:00.000000Z", "2020-01-01T00:00:00.000000Z")
+        assert state_store.get_watermark("rule.yaml") == desired
+        return